@@ -0,0 +1,189 @@
+"""
+Lazy, cached construction of the specialist agents.
+
+Before this module, every message built every specialist agent, and each one
+got a fresh `ResilientGeminiModel` (a key rotation, a client lookup and a new
+`GenerativeModel`), even when the plan routed to a single agent. The
+registry keeps one model handle per agent name for the life of the process
+and builds agents only when a request actually routes to them.
+
+Key Components:
+- `AgentSpec`: A data class describing how to build one agent.
+- `AgentRegistry`: The process-wide registry holding the specs and the
+  cached model handles.
+- `RequestAgents`: A read-only mapping returned by `AgentRegistry.bind` that
+  builds agents on first access for a single request, binding that request's
+  RLS-enabled Supabase client and, optionally, its `UserDataSnapshot`.
+"""
+import logging
+import threading
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AgentSpec:
+    """
+    Describes how to build one agent.
+
+    Attributes:
+        factory (Callable[[Any, Any], Any]): Builds the agent, called as
+            `factory(ai_model, supabase)`.
+        model_name (Optional[str]): The name of the cached model handle, or None
+            if the agent does not use an AI model.
+        chat_model (bool): If True the model is created for natural language
+            output, otherwise for JSON output.
+        routable (bool): If False the agent is used by the orchestrator only
+            (e.g. the AnsweringAgent) and plans may not route to it.
+    """
+    factory: Callable[[Any, Any], Any]
+    model_name: Optional[str] = None
+    chat_model: bool = False
+    routable: bool = True
+
+
+class AgentRegistry:
+    """
+    Builds agents lazily and shares their model handles across requests.
+
+    Model handles are created once per `model_name` and reused by every
+    request. Agent instances are cheap and may hold per-request state (for
+    example the Supabase client), so they are created per request by
+    `RequestAgents`.
+
+    Attributes:
+        api_key_manager (ApiKeyManager): The manager that creates model handles.
+    """
+
+    def __init__(self, api_key_manager: Any):
+        """
+        Initializes an empty registry.
+
+        Args:
+            api_key_manager: The `ApiKeyManager` used to create model handles.
+        """
+        self.api_key_manager = api_key_manager
+        self._specs: Dict[str, AgentSpec] = {}
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[Any, Any], Any],
+                 model_name: Optional[str] = None, chat_model: bool = False, routable: bool = True):
+        """
+        Registers how to build an agent.
+
+        Args:
+            name: The routing name of the agent (e.g. "TaskAgent").
+            factory: Builds the agent, called as `factory(ai_model, supabase)`.
+            model_name: The name of the shared model handle, or None if the
+                        agent does not use an AI model.
+            chat_model: If True the model is created for natural language output.
+            routable: If False plans may not route to the agent.
+        """
+        self._specs[name] = AgentSpec(factory=factory, model_name=model_name, chat_model=chat_model, routable=routable)
+
+    def names(self):
+        """Returns the registered agent names."""
+        return self._specs.keys()
+
+    def routable_names(self):
+        """Returns the names of the agents plans may route to."""
+        return [name for name, spec in self._specs.items() if spec.routable]
+
+    def get_model(self, model_name: str, chat_model: bool = False) -> Any:
+        """
+        Returns the shared model handle for a name, creating it on first use.
+
+        Args:
+            model_name: The name of the model handle.
+            chat_model: If True the model is created for natural language output.
+
+        Returns:
+            A `ResilientGeminiModel` instance.
+        """
+        model = self._models.get(model_name)
+        if model is not None:
+            return model
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                if chat_model:
+                    model = self.api_key_manager.create_chat_model(model_name)
+                else:
+                    model = self.api_key_manager.create_ai_model(model_name)
+                self._models[model_name] = model
+                logger.info(f"🧩 Created shared model handle for '{model_name}'.")
+        return model
+
+    def create(self, name: str, supabase: Any = None) -> Any:
+        """
+        Builds a new instance of a registered agent.
+
+        Args:
+            name: The routing name of the agent.
+            supabase: The Supabase client to bind to the agent.
+
+        Returns:
+            The agent instance.
+
+        Raises:
+            KeyError: If no agent is registered under `name`.
+        """
+        spec = self._specs[name]
+        model = self.get_model(spec.model_name, spec.chat_model) if spec.model_name else None
+        return spec.factory(model, supabase)
+
+    def bind(self, supabase: Any, data_snapshot: Any = None) -> 'RequestAgents':
+        """
+        Returns a request-scoped view that builds agents bound to `supabase` on first access.
+
+        Args:
+            supabase: The request's RLS-enabled Supabase client.
+            data_snapshot: The request's `UserDataSnapshot`, set on every agent
+                           that declares a `data_snapshot` attribute.
+        """
+        return RequestAgents(self, supabase, data_snapshot)
+
+
+class RequestAgents(Mapping):
+    """
+    A read-only mapping of agent name to agent for a single request.
+
+    Membership checks never build anything. An agent is built the first time
+    it is looked up and then reused for the rest of the request. Membership,
+    iteration and length cover the routable agents only, so a plan that routes
+    to an orchestrator-only agent is skipped; those agents can still be looked
+    up by name.
+    """
+
+    def __init__(self, registry: AgentRegistry, supabase: Any, data_snapshot: Any = None):
+        self._registry = registry
+        self._supabase = supabase
+        self._data_snapshot = data_snapshot
+        self._agents: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> Any:
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        with self._lock:
+            agent = self._agents.get(name)
+            if agent is None:
+                agent = self._registry.create(name, self._supabase)
+                if self._data_snapshot is not None and hasattr(agent, 'data_snapshot'):
+                    agent.data_snapshot = self._data_snapshot
+                self._agents[name] = agent
+        return agent
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._registry.routable_names()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._registry.routable_names())
+
+    def __len__(self) -> int:
+        return len(self._registry.routable_names())
@@ -1,94 +1,581 @@
 """
 Manages and rotates Gemini API keys to provide resilient access to the AI model.
 
-This module contains two key classes: `ApiKeyManager` and `ResilientGeminiModel`.
-The `ApiKeyManager` is responsible for maintaining a pool of API keys in memory,
-cycling through them, and marking keys as broken if they fail. The
-`ResilientGeminiModel` acts as a proxy to the actual Gemini model, using the
-`ApiKeyManager` to automatically retry API calls with a new key upon encountering
-quota or permission errors. This makes the application more robust and able to
-withstand single-key failures.
+This module contains three key classes: `ApiKeyManager`, `ResilientGeminiModel`
+and `GeminiClientPool`, plus the `KeyHealth` record kept for each key.
+The `ApiKeyManager` is responsible for maintaining a pool of API keys in memory
+and tracking the health of each one (in-flight calls, latency, error rate).
+Every call is given the least-loaded healthy key; a key that hits its quota
+cools down and is probed before it is used again, and only a key rejected
+outright is marked as broken. The `ResilientGeminiModel` acts as a proxy to the
+actual Gemini model, using the `ApiKeyManager` to pick a key for each call and
+to retry on another key upon encountering quota or permission errors. This
+makes the application more robust and able to withstand single-key failures.
+
+Both a blocking `generate_content` and an awaitable `generate_content_async`
+are provided, plus `generate_content_stream_async`, which yields the text as
+Gemini produces it. The async path uses Gemini's native asyncio (gRPC) client, so
+an event loop can keep many requests in flight without tying up threads.
+
+Models never rely on the process-global `genai.configure`. Each key owns its
+own Gemini service clients in a `GeminiClientPool`, and every call is bound
+to the clients of the key it was given. Concurrent calls on different keys
+therefore cannot change each other's key, and each key's gRPC channel (a
+persistent HTTP/2 connection) is reused by every call that uses that key.
+
+When the manager is given a `KeyRateLimiter`, every call first reserves
+capacity on its key and waits only if that key is near its RPM/TPM quota.
+
+Calls made inside a message `Deadline` (see `deadline.py`) get a timeout no
+longer than the time left, and are not started once it is spent. When the
+manager is given a `HedgePolicy`, a call that runs longer than a high
+percentile of its agent's recent latencies is duplicated on another key and
+the first answer wins.
+
+When the manager is given an `LLMResponseCache`, models created for the
+agents it enables answer repeated prompts from the cache without a call.
+
+When the manager is given a `GeminiContextCache` (see `context_cache.py`), a
+prompt that starts with a prefix registered by its agent sends only the rest
+of the prompt and references the prefix's cached content by its handle.
+
+When the manager is given a key health store (see `key_health_store.py`),
+cooldowns, broken keys and usage counters are shared with every other
+instance using the same store, so a cold start skips keys that are already
+known to be exhausted.
 """
-import itertools
+import asyncio
+import contextvars
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+import time
+import weakref
+from concurrent.futures import as_completed, wait as futures_wait
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, List, Any, Optional, Tuple
 
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 from google.api_core import exceptions as google_exceptions
 
+from context_cache import GeminiContextCache
+from deadline import DeadlineExceeded, current_deadline, remaining_seconds
+from hedging import HedgePolicy, LatencyTracker
+from key_health_store import KeyHealthState, hash_api_key
+from llm_cache import LLMResponseCache, build_cache_key
+from rate_limiter import EXPECTED_OUTPUT_TOKENS, KeyRateLimiter, estimate_tokens
+
 logger = logging.getLogger(__name__)
 
+# The Gemini model used by every agent.
+GEMINI_MODEL_NAME = 'gemini-2.5-flash-lite'
+
+
+class GeminiClientPool:
+    """
+    Owns one set of Gemini service clients per API key.
+
+    A blocking client is created once per key and shared by every thread. An
+    asyncio client is created once per key and event loop, because an asyncio
+    gRPC channel is bound to the loop that created it. Clients of loops that
+    have been garbage collected are dropped with the loop.
+    """
+
+    def __init__(self):
+        """Initializes an empty pool."""
+        self._clients: Dict[str, glm.GenerativeServiceClient] = {}
+        self._cache_clients: Dict[str, glm.CacheServiceClient] = {}
+        self._async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, glm.GenerativeServiceAsyncClient]]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get_client(self, api_key: str) -> glm.GenerativeServiceClient:
+        """
+        Returns the blocking client for a key, creating it on first use.
+
+        Args:
+            api_key: The Gemini API key.
+        """
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+                self._clients[api_key] = client
+                logger.info(f"🔌 Created Gemini client for key ending in ...{api_key[-4:]}.")
+        return client
+
+    def get_async_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        """
+        Returns the asyncio client for a key on the running event loop, creating it on first use.
+
+        Args:
+            api_key: The Gemini API key.
+
+        Raises:
+            RuntimeError: If called outside a running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.setdefault(loop, {})
+            client = loop_clients.get(api_key)
+            if client is None:
+                client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+                loop_clients[api_key] = client
+        return client
+
+    def get_cache_client(self, api_key: str) -> glm.CacheServiceClient:
+        """
+        Returns the blocking context cache client for a key, creating it on first use.
+
+        Args:
+            api_key: The Gemini API key.
+        """
+        with self._lock:
+            client = self._cache_clients.get(api_key)
+            if client is None:
+                client = glm.CacheServiceClient(client_options={"api_key": api_key})
+                self._cache_clients[api_key] = client
+        return client
+
+    def discard(self, api_key: str):
+        """
+        Forgets the clients of a key, e.g. after it has been marked as broken.
+
+        Args:
+            api_key: The Gemini API key.
+        """
+        with self._lock:
+            self._clients.pop(api_key, None)
+            self._cache_clients.pop(api_key, None)
+            for loop_clients in self._async_clients.values():
+                loop_clients.pop(api_key, None)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns the number of blocking clients and of asyncio clients across all loops."""
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "async_clients": sum(len(loop_clients) for loop_clients in self._async_clients.values()),
+                "event_loops": len(self._async_clients),
+            }
+
+
+
+@dataclass
+class KeyHealth:
+    """
+    The health of one API key, as observed by the `ApiKeyManager`.
+
+    Attributes:
+        value (str): The API key.
+        name (str): The configured name of the key (e.g. "gemini_1").
+        in_flight (int): The number of calls currently using the key.
+        ewma_latency (Optional[float]): The exponentially weighted average call latency in seconds.
+        ewma_error_rate (float): The exponentially weighted share of failed calls, in [0, 1].
+        requests (int): The number of completed calls.
+        failures (int): The number of failed calls.
+        quota_errors (int): Consecutive `ResourceExhausted` errors; reset by a success.
+        cooldown_until (float): The `time.monotonic()` value until which the key is not used.
+        is_broken (bool): True if the key was rejected with `PermissionDenied` and is never used again.
+        key_hash (str): The key's identifier in the shared health store.
+        state_updated_at (float): The Unix time the cooldown, quota errors or broken
+            flag last changed, here or in the shared store.
+        state_dirty (bool): True if the state changed since it was last written to the store.
+        unsynced_requests (int): Completed calls not yet added to the store's counters.
+        unsynced_failures (int): Failed calls not yet added to the store's counters.
+    """
+    value: str
+    name: str
+    in_flight: int = 0
+    ewma_latency: Optional[float] = None
+    ewma_error_rate: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    quota_errors: int = 0
+    cooldown_until: float = 0.0
+    is_broken: bool = False
+    key_hash: str = field(init=False)
+    state_updated_at: float = 0.0
+    state_dirty: bool = False
+    unsynced_requests: int = 0
+    unsynced_failures: int = 0
+
+    def __post_init__(self):
+        self.key_hash = hash_api_key(self.value)
+
+    def state(self, now: float) -> str:
+        """
+        Returns the key's scheduling state.
+
+        Returns:
+            "broken", "cooling" (inside a cooldown window), "probing" (the
+            cooldown has expired but no call has succeeded since), or "healthy".
+        """
+        if self.is_broken:
+            return "broken"
+        if now < self.cooldown_until:
+            return "cooling"
+        if self.quota_errors:
+            return "probing"
+        return "healthy"
+
 
 class ResilientGeminiModel:
     """
     A proxy wrapper for the Gemini model that enhances resilience.
 
-    This class automatically handles API key rotation on specific failures,
-    such as quota errors or permission issues, by collaborating with an
-    `ApiKeyManager` instance. It ensures that if one key fails, the system
-    seamlessly switches to the next available key.
+    Every call asks the `ApiKeyManager` for the best key at that moment, so
+    concurrent calls spread across keys. If a call fails with a quota or
+    permission error, the manager records it and the call is retried on
+    another key until one succeeds or no usable key is left.
+
+    If the manager has a response cache enabled for this agent, a repeated
+    prompt is answered from the cache without selecting a key. If it has a
+    context cache, prompts starting with a prefix registered through
+    `register_static_prefix` send only the rest of the prompt once the
+    prefix's cached content is ready on the chosen key.
 
     Attributes:
         _key_manager (ApiKeyManager): The manager responsible for providing API keys.
         _agent_name (str): The name of the agent using this model, for logging.
         _is_json_model (bool): Flag indicating if the model should be configured for JSON output.
-        _current_key (Optional[str]): The API key currently in use.
-        _current_model (Optional[genai.GenerativeModel]): The active Gemini model instance.
+        _models (Dict[str, genai.GenerativeModel]): Per key, a model instance bound to
+            that key's blocking client.
+        _async_models (weakref.WeakKeyDictionary): Per event loop, the model instances
+            bound to each key's asyncio client for that loop.
+        _latencies (LatencyTracker): This model's recent successful call latencies,
+            used for the hedging threshold.
+        _static_prefixes (List[str]): The registered prompt prefixes that never change.
     """
     def __init__(self, key_manager: 'ApiKeyManager', agent_name: str, is_json_model: bool):
         """
         Initializes the ResilientGeminiModel.
 
         Args:
-            key_manager: An instance of `ApiKeyManager` to handle key rotation.
+            key_manager: An instance of `ApiKeyManager` to handle key selection.
             agent_name: A name for the agent using this model, for logging purposes.
             is_json_model: If True, configures the model to expect JSON output.
         """
         self._key_manager = key_manager
         self._agent_name = agent_name
         self._is_json_model = is_json_model
-        
-        self._current_key: Optional[str] = None
-        self._current_model: Optional[genai.GenerativeModel] = None
-        
-        # Initialize the first model with the first valid key
-        self._get_new_model()
+        self._generation_config = {"response_mime_type": "application/json"} if is_json_model else None
+        policy = key_manager.hedge_policy
+        self._latencies = LatencyTracker(policy.window if policy is not None else 200)
+
+        self._static_prefixes: List[str] = []
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._async_models: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, genai.GenerativeModel]]' = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def register_static_prefix(self, prefix: str):
+        """
+        Registers a prompt prefix that never changes, so it can be served from Gemini's context cache.
 
-    def _get_new_model(self):
+        Args:
+            prefix: The exact text that the agent's prompts start with.
         """
-        Fetches the next valid API key and creates a new model instance.
+        with self._lock:
+            if prefix and prefix not in self._static_prefixes:
+                self._static_prefixes.append(prefix)
 
-        This private method is called during initialization and whenever the
-        current API key is marked as broken. It raises a `RuntimeError` if
-        no valid keys are left.
+    def _build_model(self, cached_content: Optional[str] = None) -> genai.GenerativeModel:
+        """
+        Creates a model instance, configured for JSON output if this is a JSON model.
 
-        Raises:
-            RuntimeError: If all available API keys have failed.
-        """
-        self._current_key = self._key_manager.get_next_key()
-        if self._current_key is None:
-            self._current_model = None
-            raise RuntimeError(f"All available Gemini API keys have failed for agent '{self._agent_name}'.")
-
-        logger.info(f"Agent '{self._agent_name}' is now using a new API key ending in ...{self._current_key[-4:]}")
-        genai.configure(api_key=self._current_key)
-        
-        # Configure the model based on whether JSON output is required
-        if self._is_json_model:
-            self._current_model = genai.GenerativeModel(
-                'gemini-2.5-flash-lite',
-                generation_config={"response_mime_type": "application/json"}
-            )
+        Args:
+            cached_content: The name of a cached content the model's requests
+                            reference, or None.
+        """
+        if self._generation_config:
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME, generation_config=self._generation_config)
         else:
-            self._current_model = genai.GenerativeModel('gemini-2.5-flash-lite') # Updated model name
+            model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        if cached_content:
+            # Equivalent to `GenerativeModel.from_cached_content`, which would look the cache up with the global client.
+            model._cached_content = cached_content
+        return model
+
+    def _use_context_cache(self, key: str, args: tuple, kwargs: dict) -> Tuple[Optional[str], tuple, dict]:
+        """
+        Strips a registered prefix from the prompt if its cached content is ready on `key`.
+
+        Returns:
+            A `(cached_content, args, kwargs)` tuple: the cached content name and
+            the arguments with only the rest of the prompt, or `(None, args, kwargs)`
+            unchanged.
+        """
+        context_cache = self._key_manager.context_cache
+        if context_cache is None or not self._static_prefixes:
+            return None, args, kwargs
+        contents = args[0] if args else kwargs.get('contents')
+        if not isinstance(contents, str):
+            return None, args, kwargs
+        prefix = next((p for p in self._static_prefixes if len(contents) > len(p) and contents.startswith(p)), None)
+        if prefix is None:
+            return None, args, kwargs
+        cached_content = context_cache.lookup(key, GEMINI_MODEL_NAME, prefix, self._key_manager.client_pool.get_cache_client)
+        if cached_content is None:
+            return None, args, kwargs
+        rest = contents[len(prefix):]
+        if args:
+            return cached_content, (rest,) + args[1:], kwargs
+        return cached_content, args, {**kwargs, 'contents': rest}
+
+    def _get_model(self, key: str, cached_content: Optional[str] = None) -> genai.GenerativeModel:
+        """Returns the model instance bound to `key`'s blocking client, referencing `cached_content` if given."""
+        if cached_content:
+            model = self._build_model(cached_content)
+            model._client = self._key_manager.client_pool.get_client(key)
+            return model
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._build_model()
+                # Bind the model to its key's own client instead of the global genai configuration.
+                model._client = self._key_manager.client_pool.get_client(key)
+                self._models[key] = model
+        return model
+
+    def _get_async_model(self, key: str, cached_content: Optional[str] = None) -> genai.GenerativeModel:
+        """Returns the model instance bound to `key`'s asyncio client on the running loop, referencing `cached_content` if given."""
+        if cached_content:
+            model = self._build_model(cached_content)
+            model._async_client = self._key_manager.client_pool.get_async_client(key)
+            return model
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_models = self._async_models.setdefault(loop, {})
+            model = loop_models.get(key)
+            if model is None:
+                model = self._build_model()
+                model._async_client = self._key_manager.client_pool.get_async_client(key)
+                loop_models[key] = model
+        return model
+
+    def _reserve_capacity(self, key: str, args: tuple, kwargs: dict) -> Tuple[int, float]:
+        """
+        Reserves rate-limit capacity for a call on `key`.
+
+        Returns:
+            A `(estimated_tokens, wait_seconds)` tuple; `(0, 0.0)` without a rate limiter.
+        """
+        limiter = self._key_manager.rate_limiter
+        if limiter is None:
+            return 0, 0.0
+        contents = args[0] if args else kwargs.get('contents', '')
+        estimated_tokens = estimate_tokens(contents) + EXPECTED_OUTPUT_TOKENS
+        return estimated_tokens, limiter.reserve(key, estimated_tokens)
+
+    def _record_usage(self, key: str, estimated_tokens: int, response: Any):
+        """Corrects the rate limiter's reservation with the response's reported usage."""
+        if self._key_manager.rate_limiter is not None:
+            self._key_manager.rate_limiter.record_usage(key, estimated_tokens, response)
+
+    def _cache_key(self, args: tuple, kwargs: dict) -> Optional[str]:
+        """Returns the response cache key for a call, or None if the call is not cached."""
+        cache = self._key_manager.response_cache
+        if cache is None or not cache.is_enabled_for(self._agent_name) or kwargs.get('stream'):
+            return None
+        contents = args[0] if args else kwargs.get('contents', '')
+        # Everything except the prompt and the transport options can change the output.
+        options = {name: value for name, value in kwargs.items() if name not in ('contents', 'request_options')}
+        return build_cache_key(contents, GEMINI_MODEL_NAME, {**(self._generation_config or {}), **options})
+
+    def _store_in_cache(self, cache_key: Optional[str], response: Any):
+        """Caches a response's text. Responses without text (e.g. blocked ones) are skipped."""
+        if cache_key is None:
+            return
+        try:
+            text = response.text
+        except Exception:
+            return
+        self._key_manager.response_cache.set(cache_key, text)
+
+    def _no_key_error(self, last_error: Optional[Exception]) -> Exception:
+        """Returns the exception to raise when no key could serve the call."""
+        if last_error is not None:
+            logger.error(f"All available keys have failed. Raising final exception for agent '{self._agent_name}'.")
+            return last_error
+        return RuntimeError(f"No usable Gemini API key for agent '{self._agent_name}'. All keys are broken or cooling down.")
+
+    def _call_options(self, kwargs: dict) -> dict:
+        """
+        Returns the call's keyword arguments with a timeout that fits the message deadline.
+
+        Raises:
+            DeadlineExceeded: If the message's time budget is already spent.
+        """
+        deadline = current_deadline()
+        if deadline is None:
+            return kwargs
+        deadline.check(f"Gemini call for agent '{self._agent_name}'")
+        request_options = dict(kwargs.get('request_options') or {})
+        timeout = deadline.remaining()
+        if request_options.get('timeout') is not None:
+            timeout = min(timeout, request_options['timeout'])
+        request_options['timeout'] = timeout
+        return {**kwargs, 'request_options': request_options}
+
+    def _capped_wait(self, wait: float) -> float:
+        """Caps a rate-limit wait to the time left before the message deadline."""
+        remaining = remaining_seconds()
+        return wait if remaining is None else min(wait, remaining)
+
+    def _call_with_key(self, key: str, args: tuple, kwargs: dict) -> Any:
+        """
+        Makes one blocking call on `key` and reports its outcome to the manager.
+
+        Raises:
+            Exception: Whatever the call raised, after it has been reported.
+        """
+        estimated_tokens, wait = self._reserve_capacity(key, args, kwargs)
+        wait = self._capped_wait(wait)
+        if wait > 0:
+            time.sleep(wait)
+        cached_content, call_args, call_kwargs = self._use_context_cache(key, args, kwargs)
+        try:
+            options = self._call_options(call_kwargs)
+        except DeadlineExceeded:
+            self._key_manager.release_key(key, 0.0, completed=False)
+            raise
+        started = time.monotonic()
+        try:
+            response = self._get_model(key, cached_content).generate_content(*call_args, **options)
+        except Exception as e:
+            self._key_manager.release_key(key, time.monotonic() - started, error=e)
+            raise
+        latency = time.monotonic() - started
+        self._key_manager.release_key(key, latency)
+        self._latencies.record(latency)
+        self._record_usage(key, estimated_tokens, response)
+        return response
+
+    async def _call_with_key_async(self, key: str, args: tuple, kwargs: dict) -> Any:
+        """
+        Makes one asyncio call on `key` and reports its outcome to the manager.
+
+        A cancelled call (e.g. the slower half of a hedge) or one refused by the
+        message deadline only frees the key.
+
+        Raises:
+            Exception: Whatever the call raised, after it has been reported.
+        """
+        estimated_tokens, wait = self._reserve_capacity(key, args, kwargs)
+        started = time.monotonic()
+        try:
+            wait = self._capped_wait(wait)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            cached_content, call_args, call_kwargs = self._use_context_cache(key, args, kwargs)
+            options = self._call_options(call_kwargs)
+            started = time.monotonic()
+            response = await self._get_async_model(key, cached_content).generate_content_async(*call_args, **options)
+        except (asyncio.CancelledError, DeadlineExceeded):
+            self._key_manager.release_key(key, time.monotonic() - started, completed=False)
+            raise
+        except Exception as e:
+            self._key_manager.release_key(key, time.monotonic() - started, error=e)
+            raise
+        latency = time.monotonic() - started
+        self._key_manager.release_key(key, latency)
+        self._latencies.record(latency)
+        self._record_usage(key, estimated_tokens, response)
+        return response
+
+    def _hedge_key(self, tried: set) -> Optional[str]:
+        """Acquires a different key for a hedge, or counts that none was available."""
+        hedge_key = self._key_manager.acquire_key(exclude=tried)
+        if hedge_key is None:
+            self._key_manager.hedge_policy.record_no_spare_key()
+            return None
+        tried.add(hedge_key)
+        logger.info(f"🏁 Gemini call for agent '{self._agent_name}' is slow; hedging on key ending in ...{hedge_key[-4:]}.")
+        return hedge_key
+
+    def _call_hedged(self, key: str, tried: set, args: tuple, kwargs: dict) -> Any:
+        """
+        Makes a blocking call on `key`, hedged on another key if it runs past the threshold.
+
+        The first successful answer is returned; the other call finishes in the
+        background and its result is discarded. If both calls fail, the last
+        error is raised.
+        """
+        policy = self._key_manager.hedge_policy
+        threshold = policy.threshold(self._latencies) if policy is not None else None
+        if threshold is None:
+            return self._call_with_key(key, args, kwargs)
+
+        # The calls run on pool threads, which do not inherit the message deadline on their own.
+        primary = policy.executor.submit(contextvars.copy_context().run, self._call_with_key, key, args, kwargs)
+        done, _ = futures_wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+
+        hedge_key = self._hedge_key(tried)
+        if hedge_key is None:
+            return primary.result()
+        hedge = policy.executor.submit(contextvars.copy_context().run, self._call_with_key, hedge_key, args, kwargs)
+
+        last_error = None
+        for future in as_completed([primary, hedge]):
+            if future.exception() is None:
+                policy.record_hedge(hedge_won=future is hedge)
+                return future.result()
+            last_error = future.exception()
+        policy.record_hedge(hedge_won=False)
+        raise last_error
+
+    async def _call_hedged_async(self, key: str, tried: set, args: tuple, kwargs: dict) -> Any:
+        """
+        Makes an asyncio call on `key`, hedged on another key if it runs past the threshold.
+
+        The first successful answer is returned and the other call is
+        cancelled. If both calls fail, the last error is raised.
+        """
+        policy = self._key_manager.hedge_policy
+        threshold = policy.threshold(self._latencies) if policy is not None else None
+        if threshold is None:
+            return await self._call_with_key_async(key, args, kwargs)
+
+        primary = asyncio.ensure_future(self._call_with_key_async(key, args, kwargs))
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=threshold)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+
+        hedge_key = self._hedge_key(tried)
+        if hedge_key is None:
+            return await primary
+        hedge = asyncio.ensure_future(self._call_with_key_async(hedge_key, args, kwargs))
+
+        pending, last_error = {primary, hedge}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        policy.record_hedge(hedge_won=task is hedge)
+                        return task.result()
+                    last_error = task.exception()
+        finally:
+            for task in pending:
+                task.cancel()
+        policy.record_hedge(hedge_won=False)
+        raise last_error
 
     def generate_content(self, *args, **kwargs) -> Any:
         """
-        Wraps the model's `generate_content` call with retry logic.
+        Wraps the model's `generate_content` call with key selection and retry logic.
 
-        This method attempts an API call and, if it fails due to a quota or
-        permission error, it marks the current key as broken and retries with
-        a new key. This cycle continues until a call succeeds or all keys fail.
+        Each attempt uses the key the `ApiKeyManager` ranks best. A quota or
+        permission error is reported to the manager and the call is retried on
+        another key. Other errors are reported and re-raised. Within a message
+        deadline, each attempt's timeout is the time left; with a hedge policy,
+        an attempt slower than the agent's usual latency is duplicated on
+        another key.
 
         Args:
             *args: Positional arguments to be passed to the underlying model's
@@ -97,61 +584,229 @@ class ResilientGeminiModel:
                       `generate_content` method.
 
         Returns:
-            The content generated by the model.
+            The content generated by the model, or a `CachedResponse` with the
+            same `text` on a cache hit.
+
+        Raises:
+            DeadlineExceeded: If the message's time budget is spent.
+            RuntimeError: If no usable key is available.
+            google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied:
+                The last error, if every usable key failed.
+        """
+        cache_key = self._cache_key(args, kwargs)
+        if cache_key is not None:
+            cached = self._key_manager.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        tried, last_error = set(), None
+        deadline = current_deadline()
+        for _ in range(self._key_manager.get_key_count()):
+            if deadline is not None:
+                deadline.check(f"Gemini call for agent '{self._agent_name}'")
+            key = self._key_manager.acquire_key(exclude=tried)
+            if key is None:
+                break
+            tried.add(key)
+            try:
+                response = self._call_hedged(key, tried, args, kwargs)
+            except (google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied) as e:
+                last_error = e
+                continue
+            self._store_in_cache(cache_key, response)
+            return response
+
+        raise self._no_key_error(last_error)
+
+    async def generate_content_async(self, *args, **kwargs) -> Any:
+        """
+        Awaitable version of `generate_content` with the same key selection,
+        deadline and hedging.
+
+        The call runs on Gemini's native asyncio client, so it does not block
+        the event loop while the request is in flight.
+
+        Args:
+            *args: Positional arguments to be passed to the underlying model's
+                   `generate_content_async` method.
+            **kwargs: Keyword arguments to be passed to the underlying model's
+                      `generate_content_async` method.
+
+        Returns:
+            The content generated by the model, or a `CachedResponse` with the
+            same `text` on a cache hit.
 
         Raises:
-            RuntimeError: If no valid model is available or if all API keys
-                          fail in succession.
+            DeadlineExceeded: If the message's time budget is spent.
+            RuntimeError: If no usable key is available.
+            google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied:
+                The last error, if every usable key failed.
+        """
+        cache_key = self._cache_key(args, kwargs)
+        if cache_key is not None:
+            cached = self._key_manager.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        tried, last_error = set(), None
+        deadline = current_deadline()
+        for _ in range(self._key_manager.get_key_count()):
+            if deadline is not None:
+                deadline.check(f"Gemini call for agent '{self._agent_name}'")
+            key = self._key_manager.acquire_key(exclude=tried)
+            if key is None:
+                break
+            tried.add(key)
+            try:
+                response = await self._call_hedged_async(key, tried, args, kwargs)
+            except (google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied) as e:
+                last_error = e
+                continue
+            self._store_in_cache(cache_key, response)
+            return response
+
+        raise self._no_key_error(last_error)
+
+    async def generate_content_stream_async(self, *args, **kwargs) -> AsyncIterator[str]:
         """
-        if self._current_model is None:
-            raise RuntimeError(f"No valid model available for agent '{self._agent_name}'. All keys may be broken.")
+        Streams a response, yielding each piece of text as Gemini produces it.
+
+        Key selection, the message deadline and the rate limiter apply as in
+        `generate_content_async`. A quota or permission error is retried on
+        another key only while nothing has been yielded yet. Streamed calls
+        are neither cached nor hedged.
+
+        Args:
+            *args: Positional arguments to be passed to the underlying model's
+                   `generate_content_async` method.
+            **kwargs: Keyword arguments to be passed to the underlying model's
+                      `generate_content_async` method. `stream=True` is added.
+
+        Yields:
+            The response text, piece by piece.
 
-        # The number of retries is limited by the number of initially valid keys.
-        for attempt in range(self._key_manager.get_valid_key_count()):
+        Raises:
+            DeadlineExceeded: If the message's time budget is spent.
+            RuntimeError: If no usable key is available.
+            google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied:
+                The last error, if every usable key failed before any text was yielded.
+        """
+        tried, last_error = set(), None
+        deadline = current_deadline()
+        for _ in range(self._key_manager.get_key_count()):
+            if deadline is not None:
+                deadline.check(f"Gemini stream for agent '{self._agent_name}'")
+            key = self._key_manager.acquire_key(exclude=tried)
+            if key is None:
+                break
+            tried.add(key)
+            estimated_tokens, wait = self._reserve_capacity(key, args, kwargs)
+            started, yielded, response = time.monotonic(), False, None
             try:
-                # Attempt the API call with the current model
-                return self._current_model.generate_content(*args, **kwargs)
-            
+                wait = self._capped_wait(wait)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                options = self._call_options({**kwargs, 'stream': True})
+                started = time.monotonic()
+                response = await self._get_async_model(key).generate_content_async(*args, **options)
+                async for chunk in response:
+                    text = self._chunk_text(chunk)
+                    if text:
+                        yielded = True
+                        yield text
             except (google_exceptions.ResourceExhausted, google_exceptions.PermissionDenied) as e:
-                error_type = "Quota Exceeded (ResourceExhausted)" if isinstance(e, google_exceptions.ResourceExhausted) else "Permission Denied"
-                logger.warning(f"{error_type} for agent '{self._agent_name}' with key ending in ...{self._current_key[-4:]}. Marking key as broken and rotating.")
-                
-                # Mark the failed key as broken for the current session
-                self._key_manager.mark_key_as_broken(self._current_key)
-                
-                # Try to get a new model with the next available key
-                try:
-                    self._get_new_model()
-                except RuntimeError:
-                    # This happens if we've run out of keys
-                    logger.error(f"All available keys have failed. Raising final exception for agent '{self._agent_name}'.")
-                    raise e # Re-raise the last caught exception
-                
-                # If we successfully got a new model, the loop will continue and retry the call.
-
-        # If the loop finishes without a successful return, it means all keys were tried and failed.
-        raise RuntimeError(f"Failed to get a response for agent '{self._agent_name}' after trying all available API keys.")
+                self._key_manager.release_key(key, time.monotonic() - started, error=e)
+                if yielded:
+                    raise
+                last_error = e
+                continue
+            except (asyncio.CancelledError, GeneratorExit, DeadlineExceeded):
+                self._key_manager.release_key(key, time.monotonic() - started, completed=False)
+                raise
+            except Exception as e:
+                self._key_manager.release_key(key, time.monotonic() - started, error=e)
+                raise
+            self._key_manager.release_key(key, time.monotonic() - started)
+            self._record_usage(key, estimated_tokens, response)
+            return
 
+        raise self._no_key_error(last_error)
+
+    @staticmethod
+    def _chunk_text(chunk: Any) -> str:
+        """Returns a streamed chunk's text, or an empty string for chunks without text."""
+        try:
+            return chunk.text or ""
+        except (ValueError, AttributeError):
+            return ""
 
 class ApiKeyManager:
     """
-    Manages and rotates Gemini API keys entirely in memory.
+    Schedules Gemini API keys by health, in memory and optionally shared.
+
+    Each key's in-flight calls, latency and error rate are tracked, and every
+    call is given the least-loaded healthy key. A quota error
+    (`ResourceExhausted`) puts a key into a cooldown that doubles on each
+    consecutive quota error. When the cooldown expires, a single probe call is
+    let through, and the key is healthy again once a call succeeds. Only a
+    `PermissionDenied` error retires a key for the rest of the process.
+
+    With a `health_store`, the keys' state is loaded when the manager is
+    created. State changes and usage counters are then written back, and the
+    other instances' changes read in, by a background sync that runs as soon as
+    a key's state changes and otherwise at most every `sync_interval_seconds`.
+    A failing store is logged and ignored.
 
-    This class is designed to be stateless, making it ideal for serverless
-    environments. It tracks the status of keys (broken or not) only for the
-    duration of its instance's lifetime, without persisting this state.
+    This class is designed to be stateless between processes, making it ideal
+    for serverless environments. All methods are thread-safe.
 
     Attributes:
-        _keys (List[Dict[str, Any]]): A list of dictionaries, each representing an API key.
-        _key_cycle (itertools.cycle): An iterator that cycles through the keys.
+        client_pool (GeminiClientPool): The per-key Gemini clients used by the models.
+        rate_limiter (Optional[KeyRateLimiter]): The per-key RPM/TPM limiter shared
+            by all models, or None to call without client-side limiting.
+        quota_cooldown_seconds (float): The first cooldown after a quota error.
+        max_cooldown_seconds (float): The longest cooldown.
+        response_cache (Optional[LLMResponseCache]): The response cache shared by
+            all models, or None to always call Gemini.
+        hedge_policy (Optional[HedgePolicy]): When to duplicate slow calls on
+            another key, or None to never hedge.
+        context_cache (Optional[GeminiContextCache]): The cached contents of the
+            agents' static prompt prefixes, or None to always send full prompts.
+        health_store (Optional[Any]): A `SQLiteKeyHealthStore` or `SupabaseKeyHealthStore`,
+            or None to keep key health in this process only.
+        sync_interval_seconds (float): The longest time between two syncs with the store.
     """
 
-    def __init__(self, gemini_keys: Dict[str, str]):
+    # The weight of the newest observation in the latency and error-rate averages.
+    EWMA_ALPHA = 0.2
+    # The latency assumed for a key that has not completed a call yet.
+    DEFAULT_LATENCY_SECONDS = 1.0
+
+    def __init__(self, gemini_keys: Dict[str, str], rate_limiter: Optional[KeyRateLimiter] = None,
+                 quota_cooldown_seconds: float = 60.0, max_cooldown_seconds: float = 900.0,
+                 health_store: Optional[Any] = None, sync_interval_seconds: float = 30.0,
+                 response_cache: Optional[LLMResponseCache] = None,
+                 hedge_policy: Optional[HedgePolicy] = None,
+                 context_cache: Optional[GeminiContextCache] = None):
         """
         Initializes the ApiKeyManager with a dictionary of keys.
 
         Args:
             gemini_keys: A dictionary where keys are names and values are the API keys.
+            rate_limiter: An optional `KeyRateLimiter` shared by every model this
+                          manager creates.
+            quota_cooldown_seconds: The first cooldown after a quota error. Gemini
+                                    quotas reset per minute.
+            max_cooldown_seconds: The longest cooldown after repeated quota errors.
+            health_store: An optional shared key health store. It is read once
+                          before the constructor returns.
+            sync_interval_seconds: The longest time between two syncs with the store.
+            response_cache: An optional `LLMResponseCache` shared by every model
+                            this manager creates.
+            hedge_policy: An optional `HedgePolicy` shared by every model this
+                          manager creates.
+            context_cache: An optional `GeminiContextCache` shared by every model
+                           this manager creates.
 
         Raises:
             ValueError: If the `gemini_keys` dictionary is empty or no valid keys are loaded.
@@ -159,19 +814,228 @@ class ApiKeyManager:
         if not gemini_keys:
             raise ValueError("Gemini API key dictionary cannot be empty.")
 
-        # Initialize all keys with a 'is_broken' status of False.
-        # The status is only tracked in memory for this instance's lifetime.
-        self._keys: List[Dict[str, Any]] = [
-            {"value": key_value, "is_broken": False}
+        self._keys: List[KeyHealth] = [
+            KeyHealth(value=key_value, name=key_name)
             for key_name, key_value in gemini_keys.items()
+            if key_value
         ]
 
         if not self._keys:
             raise ValueError("No valid Gemini API keys were loaded from the configuration.")
 
-        # The cycler will loop through the list of keys indefinitely.
-        self._key_cycle = itertools.cycle(self._keys)
+        self.quota_cooldown_seconds = quota_cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        # Where the next selection starts, so that ties are spread round-robin.
+        self._next_index = 0
+        self._lock = threading.Lock()
+        # Each key's Gemini clients, shared by every model created by this manager.
+        self.client_pool = GeminiClientPool()
+        self.rate_limiter = rate_limiter
+        self.response_cache = response_cache
+        self.hedge_policy = hedge_policy
+        self.context_cache = context_cache
+        self.health_store = health_store
+        self.sync_interval_seconds = sync_interval_seconds
+        self._last_sync = 0.0
+        self._sync_lock = threading.Lock()
         logger.info(f"ApiKeyManager initialized with {len(self._keys)} Gemini API key(s).")
+        if health_store is not None:
+            self.sync_health()
+
+    def _find(self, key_value: str) -> Optional[KeyHealth]:
+        """Returns the health record of a key. Must hold the lock."""
+        return next((key for key in self._keys if key.value == key_value), None)
+
+    def _select(self, now: float, exclude: Optional[set] = None) -> Optional[KeyHealth]:
+        """
+        Picks the best usable key. Must hold the lock.
+
+        An idle probing key is picked first so it can recover. Otherwise the
+        healthy key with the lowest load score wins, where the score grows with
+        the key's in-flight calls, its average latency and its error rate.
+        """
+        count = len(self._keys)
+        ordered = [self._keys[(self._next_index + offset) % count] for offset in range(count)]
+        self._next_index = (self._next_index + 1) % count
+
+        best, best_score = None, None
+        for key in ordered:
+            if exclude and key.value in exclude:
+                continue
+            state = key.state(now)
+            if state == "probing" and key.in_flight == 0:
+                return key
+            if state != "healthy":
+                continue
+            latency = key.ewma_latency if key.ewma_latency is not None else self.DEFAULT_LATENCY_SECONDS
+            score = (key.in_flight + 1) * latency * (1 + 4 * key.ewma_error_rate)
+            if best_score is None or score < best_score:
+                best, best_score = key, score
+        return best
+
+    def acquire_key(self, exclude: Optional[set] = None) -> Optional[str]:
+        """
+        Picks the best usable key for a call and counts the call as in flight.
+
+        Every successful `acquire_key` must be followed by `release_key`.
+
+        Args:
+            exclude: Keys not to pick, e.g. keys that already failed for this call.
+
+        Returns:
+            The API key, or None if no key is usable right now.
+        """
+        with self._lock:
+            key = self._select(time.monotonic(), exclude)
+            if key is None:
+                return None
+            key.in_flight += 1
+            return key.value
+
+    def release_key(self, key_value: str, latency_seconds: float, error: Optional[Exception] = None,
+                    completed: bool = True):
+        """
+        Records the outcome of a call made with `acquire_key`.
+
+        Args:
+            key_value: The key the call used.
+            latency_seconds: How long the call took.
+            error: The exception the call raised, or None on success. A
+                   `ResourceExhausted` starts a cooldown and a
+                   `PermissionDenied` retires the key.
+            completed: False if the call was abandoned before it finished (e.g.
+                       the cancelled half of a hedge); only the in-flight count
+                       is updated.
+        """
+        now = time.monotonic()
+        with self._lock:
+            key = self._find(key_value)
+            if key is None:
+                return
+            key.in_flight = max(0, key.in_flight - 1)
+            if not completed:
+                return
+            key.requests += 1
+            key.unsynced_requests += 1
+            alpha = self.EWMA_ALPHA
+
+            if error is None:
+                key.ewma_latency = latency_seconds if key.ewma_latency is None else (1 - alpha) * key.ewma_latency + alpha * latency_seconds
+                key.ewma_error_rate = (1 - alpha) * key.ewma_error_rate
+                if key.quota_errors:
+                    logger.info(f"✅ Key ending in ...{key_value[-4:]} recovered after {key.quota_errors} quota error(s).")
+                    key.quota_errors = 0
+                    self._mark_state_changed(key)
+            else:
+                key.failures += 1
+                key.unsynced_failures += 1
+                key.ewma_error_rate = (1 - alpha) * key.ewma_error_rate + alpha
+
+                if isinstance(error, google_exceptions.ResourceExhausted):
+                    key.quota_errors += 1
+                    cooldown = min(self.quota_cooldown_seconds * 2 ** (key.quota_errors - 1), self.max_cooldown_seconds)
+                    key.cooldown_until = now + cooldown
+                    self._mark_state_changed(key)
+                    logger.warning(f"Quota Exceeded (ResourceExhausted) for key ending in ...{key_value[-4:]}. Cooling down for {cooldown:.0f}s.")
+                elif isinstance(error, google_exceptions.PermissionDenied):
+                    self._retire(key)
+
+            sync_due = key.state_dirty or now - self._last_sync >= self.sync_interval_seconds
+        if sync_due:
+            self._schedule_sync()
+
+    def _retire(self, key: KeyHealth):
+        """Marks a key as broken and discards its clients. Must hold the lock."""
+        if not key.is_broken:
+            key.is_broken = True
+            self._mark_state_changed(key)
+            self.client_pool.discard(key.value)
+            logger.warning(f"Marked key ending in ...{key.value[-4:]} as broken for this session.")
+
+    @staticmethod
+    def _mark_state_changed(key: KeyHealth):
+        """Stamps a local state change so the next sync writes it. Must hold the lock."""
+        key.state_updated_at = time.time()
+        key.state_dirty = True
+
+    # --------------------------------------------------------------------------
+    # Shared health store
+    # --------------------------------------------------------------------------
+
+    def _schedule_sync(self):
+        """Starts a background sync with the store unless one is already running."""
+        if self.health_store is None or self._sync_lock.locked():
+            return
+        threading.Thread(target=self.sync_health, name="key-health-sync", daemon=True).start()
+
+    def sync_health(self):
+        """
+        Writes local state changes and usage counters to the health store, then
+        adopts any newer state written by other instances.
+
+        Only one sync runs at a time; a call made while another sync is running
+        returns immediately. Store errors are logged, and unwritten counters and
+        state changes are kept for the next sync.
+        """
+        if self.health_store is None or not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                pending = []
+                for key in self._keys:
+                    if key.unsynced_requests or key.unsynced_failures or key.state_dirty:
+                        pending.append((key, key.unsynced_requests, key.unsynced_failures,
+                                        self._to_stored_state(key) if key.state_dirty else None))
+                        key.unsynced_requests = key.unsynced_failures = 0
+                        key.state_dirty = False
+
+            try:
+                while pending:
+                    key, requests, failures, state = pending[0]
+                    self.health_store.record(key.key_hash, requests, failures, state)
+                    pending.pop(0)
+                stored = self.health_store.load()
+            except Exception as e:
+                logger.warning(f"Could not sync key health with the shared store: {e}")
+                with self._lock:
+                    for key, requests, failures, state in pending:
+                        key.unsynced_requests += requests
+                        key.unsynced_failures += failures
+                        key.state_dirty = key.state_dirty or state is not None
+                return
+
+            self._adopt_stored_states(stored)
+        finally:
+            self._last_sync = time.monotonic()
+            self._sync_lock.release()
+
+    @staticmethod
+    def _to_stored_state(key: KeyHealth) -> KeyHealthState:
+        """Converts a key's state to the store's format, with Unix timestamps. Must hold the lock."""
+        remaining = max(0.0, key.cooldown_until - time.monotonic())
+        return KeyHealthState(
+            cooldown_until=time.time() + remaining if remaining else 0.0,
+            quota_errors=key.quota_errors,
+            is_broken=key.is_broken,
+            updated_at=key.state_updated_at,
+        )
+
+    def _adopt_stored_states(self, stored: Dict[str, KeyHealthState]):
+        """Applies every stored state that is newer than the local one."""
+        wall_now, monotonic_now = time.time(), time.monotonic()
+        with self._lock:
+            for key in self._keys:
+                state = stored.get(key.key_hash)
+                if state is None or state.updated_at <= key.state_updated_at or key.state_dirty:
+                    continue
+                key.cooldown_until = monotonic_now + max(0.0, state.cooldown_until - wall_now)
+                key.quota_errors = state.quota_errors
+                key.state_updated_at = state.updated_at
+                if state.is_broken and not key.is_broken:
+                    key.is_broken = True
+                    self.client_pool.discard(key.value)
+                if key.state(monotonic_now) != "healthy":
+                    logger.info(f"🩺 Key ending in ...{key.value[-4:]} is {key.state(monotonic_now)} according to the shared key health store.")
 
     def mark_key_as_broken(self, key_value: str):
         """
@@ -180,34 +1044,26 @@ class ApiKeyManager:
         Args:
             key_value: The API key string to be marked as broken.
         """
-        for key_info in self._keys:
-            if key_info['value'] == key_value:
-                if not key_info['is_broken']:
-                    key_info['is_broken'] = True
-                    logger.warning(f"Marked key ending in ...{key_value[-4:]} as broken for this session.")
-                break
+        with self._lock:
+            key = self._find(key_value)
+            if key is not None:
+                self._retire(key)
+        self._schedule_sync()
 
     def get_next_key(self) -> Optional[str]:
         """
-        Gets the next valid (not broken) Gemini key from the in-memory list.
+        Returns the key the next call would use, without counting it as in flight.
 
         Returns:
-            The next valid API key as a string, or None if all keys have been
-            marked as broken.
+            The best usable API key as a string, or None if no key is usable
+            right now.
         """
-        if self.get_valid_key_count() == 0:
-            logger.error("All Gemini keys are marked as broken for this session.")
+        with self._lock:
+            key = self._select(time.monotonic())
+        if key is None:
+            logger.error("No Gemini key is usable right now: all are broken or cooling down.")
             return None
-
-        # Cycle through the keys until a non-broken one is found.
-        # We loop at most the total number of keys to avoid an infinite loop.
-        for _ in range(len(self._keys)):
-            key_info = next(self._key_cycle)
-            if not key_info['is_broken']:
-                return key_info['value']
-        
-        # This should not be reached if get_valid_key_count() > 0, but is a safeguard.
-        return None
+        return key.value
 
     def create_ai_model(self, agent_name: str = "default") -> ResilientGeminiModel:
         """
@@ -251,7 +1107,36 @@ class ApiKeyManager:
         """
         Returns the number of keys not marked as broken in this session.
 
+        Keys in a cooldown count as valid, since they will be used again.
+
+        Returns:
+            The count of valid keys.
+        """
+        with self._lock:
+            return sum(1 for key in self._keys if not key.is_broken)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Returns the health of every key, identified by its name and last four characters.
+
         Returns:
-            The count of valid, usable keys.
+            A list of dictionaries with the state, in-flight count, average
+            latency, error rate, request and failure counts, and remaining
+            cooldown of each key.
         """
-        return sum(1 for key in self._keys if not key['is_broken'])
\ No newline at end of file
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": key.name,
+                    "key": f"...{key.value[-4:]}",
+                    "state": key.state(now),
+                    "in_flight": key.in_flight,
+                    "ewma_latency_seconds": round(key.ewma_latency, 3) if key.ewma_latency is not None else None,
+                    "ewma_error_rate": round(key.ewma_error_rate, 3),
+                    "requests": key.requests,
+                    "failures": key.failures,
+                    "cooldown_remaining_seconds": round(max(0.0, key.cooldown_until - now), 1),
+                }
+                for key in self._keys
+            ]
@@ -4,12 +4,10 @@ import sys
 import logging
 import asyncio
 import json
-from datetime import datetime, timezone, timedelta
 from typing import Dict, Any, Optional, Type
 
 # --- Third-Party Imports ---
-import jwt
-from supabase import create_client, Client
+from supabase import Client
 
 # --- Project-Specific Imports ---
 # Add the 'src' directory to the Python path to allow for absolute imports
@@ -30,6 +28,8 @@ logger = logging.getLogger(__name__)
 try:
     import config
     from api_key_manager import ApiKeyManager
+    from user_client_cache import UserClientCache
+    from supabase_transport import SupabaseTransport
     # Agent Imports
     from multi_agent_system.agents.financial_agent import FinancialAgent
     from multi_agent_system.agents.tech_support_agent import TechSupportAgent
@@ -68,31 +68,30 @@ AGENT_MAP: Dict[str, Type] = {
 
 # --- Utility Functions (adapted from wa_version.py) ---
 
-def create_user_jwt(user_id: str, jwt_secret: str) -> str:
-    """Generates a JWT for a given user ID."""
-    payload = {
-        "sub": user_id,
-        "role": "authenticated",
-        "aud": "authenticated",
-        "iat": datetime.now(timezone.utc),
-        "exp": datetime.now(timezone.utc) + timedelta(hours=1)
-    }
-    return jwt.encode(payload, jwt_secret, algorithm="HS256")
+# The same shared connection pool and per-user client cache as the webhook, so a
+# long session keeps one client whose JWT is refreshed before it expires.
+supabase_transport = SupabaseTransport(
+    max_connections=config.SUPABASE_POOL_MAX_CONNECTIONS,
+    max_keepalive_connections=config.SUPABASE_POOL_MAX_KEEPALIVE,
+    keepalive_expiry_seconds=config.SUPABASE_POOL_KEEPALIVE_EXPIRY_SECONDS,
+    timeout_seconds=config.SUPABASE_HTTP_TIMEOUT_SECONDS,
+    http2=config.SUPABASE_HTTP2_ENABLED,
+)
+user_clients = UserClientCache(
+    build_client=lambda: supabase_transport.create_client(config.SUPABASE_URL, config.SUPABASE_ANON_KEY),
+    apply_token=SupabaseTransport.authorize,
+    jwt_secret=config.SUPABASE_JWT_SECRET,
+    max_entries=config.RLS_CLIENT_CACHE_SIZE,
+    jwt_ttl_seconds=config.RLS_JWT_TTL_SECONDS,
+    refresh_margin_seconds=config.RLS_JWT_REFRESH_MARGIN_SECONDS,
+)
 
 def create_user_supabase_client(user_id: str) -> Optional[Client]:
-    """Creates a new Supabase client authenticated for a specific user (RLS)."""
+    """Returns the Supabase client authenticated for a specific user (RLS), reusing it between commands."""
     if not all([config.SUPABASE_URL, config.SUPABASE_ANON_KEY, config.SUPABASE_JWT_SECRET]):
         logger.error("Supabase URL, Anon Key, or JWT Secret is not configured.")
         return None
-    try:
-        user_jwt = create_user_jwt(user_id, config.SUPABASE_JWT_SECRET)
-        user_supabase_client = create_client(config.SUPABASE_URL, config.SUPABASE_ANON_KEY)
-        user_supabase_client.auth.set_session(access_token=user_jwt, refresh_token="dummy-refresh-token")
-        logger.info(f"Successfully created RLS-enabled client for user {user_id}")
-        return user_supabase_client
-    except Exception as e:
-        logger.error(f"Error creating user-specific Supabase client: {e}", exc_info=True)
-        return None
+    return user_clients.get(user_id)
 
 async def build_user_context(user_id: str, user_supabase_client: Optional[Client]) -> Dict[str, Any]:
     """Builds the user context dictionary required by agents."""
@@ -172,6 +171,9 @@ class AgentTesterCLI:
                 # --- Agent Processing ---
                 logger.info(f"--- Testing {agent_name} ---")
 
+                # Fetched per command, so the cached client's JWT is refreshed before it expires.
+                user_supabase_client = create_user_supabase_client(user_id)
+
                 # Instantiate the agent
                 agent_class = AGENT_MAP[agent_name]
                 ai_model = self.api_key_manager.create_ai_model(agent_name)
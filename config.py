@@ -10,16 +10,83 @@ Attributes:
     FONNTE_TOKEN (Optional[str]): API token for the Fonnte WhatsApp messaging service.
     SUPABASE_URL (Optional[str]): URL for the Supabase project database.
     SUPABASE_SERVICE_KEY (Optional[str]): Service key for authenticating with the Supabase backend.
+    SUPABASE_HTTP2_ENABLED (bool): If True, the shared Supabase connection pool negotiates HTTP/2.
+    SUPABASE_POOL_MAX_CONNECTIONS (int): The most connections the shared Supabase pool opens at once.
+    SUPABASE_POOL_MAX_KEEPALIVE (int): The most idle connections the shared Supabase pool keeps open.
+    SUPABASE_POOL_KEEPALIVE_EXPIRY_SECONDS (float): How long an idle Supabase connection is kept.
+    SUPABASE_HTTP_TIMEOUT_SECONDS (float): The timeout of each Supabase request.
     UNVERIFIED_LIMIT (int): The lifetime message limit for users who have not registered.
     VERIFIED_LIMIT (int): The daily message limit for registered and verified users.
+    USAGE_LEASES_ENABLED (bool): If True, each usage check claims a lease of several messages and the following messages are counted in memory.
+    USAGE_LEASE_SIZE (int): The messages claimed by one lease.
+    USAGE_LEASE_TTL_SECONDS (float): How long an unused lease stays valid.
     MAX_AGENT_LOOPS (int): A safety measure to prevent infinite loops in agent interactions.
+    SUBTASK_TIMEOUT_SECONDS (float): The maximum time a specialist agent may spend on one planned sub-task.
+    FUSED_PLANNING_ENABLED (bool): If True, context resolution and planning run as a single AI call, falling back to two calls when the fused output is invalid.
+    FAST_PATH_ROUTER_ENABLED (bool): If True, unambiguous commands are routed by local rules instead of the AuditAgent.
+    FAST_PATH_MIN_CONFIDENCE (float): The confidence a rule-based routing decision needs to skip the AuditAgent.
+    RESPONSE_TEMPLATES_ENABLED (bool): If True, simple single-agent outcomes are answered from templates instead of an AI call.
+    USER_DATA_SNAPSHOT_ENABLED (bool): If True, the agents share a per-message snapshot of the user's tasks, journals and schedules instead of querying each table themselves.
+    USER_DATA_SNAPSHOT_MAX_ROWS (int): The most rows the snapshot loads per table and status; category reads beyond it run their own query.
     CHAT_TEST_USER_ID (str): A constant UUID for a test user in the database.
     CHAT_TEST_PHONE (str): A special identifier for the user during chat-based testing.
     SUPABASE_JWT_SECRET (Optional[str]): The secret key for generating user-specific JWTs for Row Level Security.
     SUPABASE_ANON_KEY (Optional[str]): The anonymous key for the Supabase project.
+    RLS_CLIENT_CACHE_SIZE (int): The number of per-user RLS clients kept for reuse.
+    RLS_JWT_TTL_SECONDS (int): The lifetime of each signed user JWT.
+    RLS_JWT_REFRESH_MARGIN_SECONDS (int): How long before expiry a cached client's JWT is re-signed in the background.
+    ASYNC_WEBHOOK_ENABLED (bool): If True, the webhook acknowledges messages immediately and processes them on a background worker pool.
+    WEBHOOK_WORKER_COUNT (int): The number of background workers processing webhook messages.
+    WEBHOOK_QUEUE_MAXSIZE (int): The maximum number of messages waiting for a background worker.
+    WEBHOOK_MAX_QUEUE_PER_USER (int): The maximum number of messages a single user can have waiting.
+    WEBHOOK_MAX_ACTIVE_USERS (int): The maximum number of users whose messages are processed at the same time.
+    WEBHOOK_PREFETCH_THREADS (int): The number of threads the webhook uses to overlap independent database reads.
+    DEDUP_ENABLED (bool): If True, webhook deliveries that were already accepted are dropped before processing.
+    DEDUP_TTL_SECONDS (int): How long an accepted message is remembered for deduplication.
+    DEDUP_MAX_ENTRIES (int): The capacity of the in-memory deduplication store.
+    DEDUP_TEXT_FALLBACK_ENABLED (bool): If True, deliveries without a provider message id are deduplicated by sender and text. Legitimate repeats such as "yes" are then dropped within the window.
+    DEDUP_TIME_BUCKET_SECONDS (int): The sliding window in which identical text from the same sender counts as a redelivery when the text fallback is enabled.
+    DEDUP_SQLITE_PATH (Optional[str]): The path of an optional SQLite file shared by all processes on a host for deduplication.
+    HISTORY_WRITE_BEHIND_ENABLED (bool): If True, conversation history rows are queued and written in batches by a background thread.
+    HISTORY_BATCH_SIZE (int): The most conversation history rows written in one call.
+    HISTORY_FLUSH_INTERVAL_SECONDS (float): The longest a queued conversation history row waits before being written.
+    HISTORY_MAX_PENDING (int): The most conversation history rows kept queued; the oldest are dropped beyond it.
+    PHONE_CACHE_ENABLED (bool): If True, phone number to user ID lookups are cached, including numbers with no user.
+    PHONE_CACHE_TTL_SECONDS (int): How long a registered number's user ID is cached.
+    PHONE_CACHE_NEGATIVE_TTL_SECONDS (int): How long a number with no user is cached.
+    PHONE_CACHE_MAX_ENTRIES (int): The most phone numbers cached at once.
+    REGISTRATION_HOOK_SECRET (Optional[str]): The shared secret of the registration hook that clears cached phone lookups. The hook is disabled when unset.
+    GEMINI_RATE_LIMIT_ENABLED (bool): If True, Gemini calls are paced per key by a shared RPM/TPM token-bucket limiter.
+    GEMINI_RPM_PER_KEY (int): The requests-per-minute quota of each Gemini API key.
+    GEMINI_TPM_PER_KEY (int): The tokens-per-minute quota of each Gemini API key.
+    GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS (float): The longest the limiter delays a single call.
+    GEMINI_KEY_COOLDOWN_SECONDS (float): How long a key rests after its first quota error; doubles on each consecutive one.
+    GEMINI_KEY_MAX_COOLDOWN_SECONDS (float): The longest a key rests after repeated quota errors.
+    KEY_HEALTH_STORE (str): Where key health is shared between instances: "sqlite", "supabase", or "none".
+    KEY_HEALTH_SQLITE_PATH (str): The path of the SQLite file used when `KEY_HEALTH_STORE` is "sqlite".
+    KEY_HEALTH_SYNC_SECONDS (float): The longest time between two syncs with the key health store.
+    MESSAGE_DEADLINE_SECONDS (float): The processing time budget of one message, from the moment a worker picks it up (worker-queue wait is not counted); 0 disables it.
+    STREAMING_REPLIES_ENABLED (bool): If True, long AI-synthesized replies are sent paragraph by paragraph while they are generated.
+    STREAMING_MIN_CHUNK_CHARS (int): The smallest streamed message cut at a paragraph boundary.
+    STREAMING_MAX_CHUNK_CHARS (int): The largest streamed message.
+    GEMINI_HEDGE_ENABLED (bool): If True, a Gemini call slower than its agent's usual latency is duplicated on another key.
+    GEMINI_HEDGE_PERCENTILE (float): The latency percentile after which a call is hedged.
+    GEMINI_HEDGE_MIN_SAMPLES (int): The fewest recorded latencies before an agent's calls are hedged.
+    GEMINI_CONTEXT_CACHE_ENABLED (bool): If True, the agents' static prompt prefixes are registered as Gemini cached contents.
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS (int): How long each cached prompt prefix lives before it is replaced.
+    GEMINI_CONTEXT_CACHE_MIN_TOKENS (int): The smallest prompt prefix (in estimated tokens) that is cached.
+    LLM_CACHE_ENABLED (bool): If True (off by default), repeated prompts of the agents in `LLM_CACHE_AGENTS` are answered from a response cache.
+    LLM_CACHE_AGENTS (List[str]): The model names (e.g. "task_agent") whose responses are cached.
+    LLM_CACHE_TTL_SECONDS (int): How long a cached response is reused.
+    LLM_CACHE_MAX_ENTRIES (int): The capacity of the in-process response cache.
+    LLM_CACHE_SQLITE_PATH (Optional[str]): The path of the on-disk response cache, created readable by the owner only, or None (the default) for memory only.
+    PROMPT_BUDGET_ENABLED (bool): If True, the lists of user data embedded in agent prompts are capped at a token budget.
+    PROMPT_BUDGET_TOKENS (Dict[str, int]): The token budget of each agent's lists, by model name (e.g. "finding_agent").
+    PROMPT_BUDGET_DEFAULT_TOKENS (int): The token budget of agents not listed in `PROMPT_BUDGET_TOKENS`.
+    PROMPT_BUDGET_MAX_FIELD_CHARS (int): The longest a clipped text field (e.g. a task description) may be.
 """
 import os
-from typing import Dict, Optional
+from typing import Dict, List, Optional
 
 # ==============================================================================
 # --- CORE SECRETS & CREDENTIALS ---
@@ -34,6 +101,14 @@ FONNTE_TOKEN: Optional[str] = os.environ.get("FONNTE_TOKEN")
 SUPABASE_URL: Optional[str] = os.environ.get("SUPABASE_URL")
 SUPABASE_SERVICE_KEY: Optional[str] = os.environ.get("SUPABASE_SERVICE_KEY")
 
+# All Supabase clients (the service client and every per-user client) share
+# one keep-alive connection pool, so connections are reused across users.
+SUPABASE_HTTP2_ENABLED: bool = os.environ.get("SUPABASE_HTTP2_ENABLED", "true").lower() == "true"
+SUPABASE_POOL_MAX_CONNECTIONS: int = int(os.environ.get("SUPABASE_POOL_MAX_CONNECTIONS", "100"))
+SUPABASE_POOL_MAX_KEEPALIVE: int = int(os.environ.get("SUPABASE_POOL_MAX_KEEPALIVE", "20"))
+SUPABASE_POOL_KEEPALIVE_EXPIRY_SECONDS: float = float(os.environ.get("SUPABASE_POOL_KEEPALIVE_EXPIRY_SECONDS", "30"))
+SUPABASE_HTTP_TIMEOUT_SECONDS: float = float(os.environ.get("SUPABASE_HTTP_TIMEOUT_SECONDS", "120"))
+
 
 # ==============================================================================
 # --- GEMINI API KEY CONFIGURATION FOR APIKEYMANAGER ---
@@ -92,7 +167,171 @@ def get_gemini_api_keys() -> Dict[str, str]:
 # Usage limits for the WhatsApp bot
 UNVERIFIED_LIMIT: int = 10      # Lifetime message limit for non-registered numbers
 VERIFIED_LIMIT: int = 100       # Daily message limit for verified users
+# Quota leases trade up to USAGE_LEASE_SIZE - 1 messages per user (lost when a lease expires unused) for skipping most usage checks.
+USAGE_LEASES_ENABLED: bool = os.environ.get("USAGE_LEASES_ENABLED", "false").lower() == "true"
+USAGE_LEASE_SIZE: int = int(os.environ.get("USAGE_LEASE_SIZE", "5"))
+USAGE_LEASE_TTL_SECONDS: float = float(os.environ.get("USAGE_LEASE_TTL_SECONDS", "300"))
 MAX_AGENT_LOOPS: int = 5        # Safety limit for AI agent loops to prevent runaways
+SUBTASK_TIMEOUT_SECONDS: float = float(os.environ.get("SUBTASK_TIMEOUT_SECONDS", "45"))  # Per sub-task budget for specialist agents
+FUSED_PLANNING_ENABLED: bool = os.environ.get("FUSED_PLANNING_ENABLED", "false").lower() == "true"  # One AI call for context + plan
+FAST_PATH_ROUTER_ENABLED: bool = os.environ.get("FAST_PATH_ROUTER_ENABLED", "true").lower() == "true"  # Rule-based routing ahead of the AuditAgent
+FAST_PATH_MIN_CONFIDENCE: float = float(os.environ.get("FAST_PATH_MIN_CONFIDENCE", "0.85"))
+RESPONSE_TEMPLATES_ENABLED: bool = os.environ.get("RESPONSE_TEMPLATES_ENABLED", "true").lower() == "true"  # Template replies for simple outcomes
+USER_DATA_SNAPSHOT_ENABLED: bool = os.environ.get("USER_DATA_SNAPSHOT_ENABLED", "true").lower() == "true"  # Load each table once per message
+USER_DATA_SNAPSHOT_MAX_ROWS: int = int(os.environ.get("USER_DATA_SNAPSHOT_MAX_ROWS", "500"))
+MESSAGE_DEADLINE_SECONDS: float = float(os.environ.get("MESSAGE_DEADLINE_SECONDS", "60"))  # Processing budget per message; bounds every Gemini call
+STREAMING_REPLIES_ENABLED: bool = os.environ.get("STREAMING_REPLIES_ENABLED", "true").lower() == "true"  # Send long replies paragraph by paragraph
+STREAMING_MIN_CHUNK_CHARS: int = int(os.environ.get("STREAMING_MIN_CHUNK_CHARS", "200"))
+STREAMING_MAX_CHUNK_CHARS: int = int(os.environ.get("STREAMING_MAX_CHUNK_CHARS", "1500"))
+
+
+# ==============================================================================
+# --- WEBHOOK PROCESSING CONFIGURATION ---
+# In async mode the webhook validates and enqueues each message, returns
+# immediately, and a pool of background workers runs the agent pipeline.
+# Only enable this on long-running servers; serverless platforms may freeze
+# background threads once the HTTP response has been sent.
+# ==============================================================================
+
+ASYNC_WEBHOOK_ENABLED: bool = os.environ.get("ASYNC_WEBHOOK_ENABLED", "false").lower() == "true"
+WEBHOOK_WORKER_COUNT: int = int(os.environ.get("WEBHOOK_WORKER_COUNT", "8"))
+WEBHOOK_QUEUE_MAXSIZE: int = int(os.environ.get("WEBHOOK_QUEUE_MAXSIZE", "1000"))
+
+# Messages are serialized per user (one in flight at a time) and different
+# users are processed in parallel, up to WEBHOOK_MAX_ACTIVE_USERS at once.
+WEBHOOK_MAX_QUEUE_PER_USER: int = int(os.environ.get("WEBHOOK_MAX_QUEUE_PER_USER", "20"))
+WEBHOOK_MAX_ACTIVE_USERS: int = int(os.environ.get("WEBHOOK_MAX_ACTIVE_USERS", str(WEBHOOK_WORKER_COUNT)))
+
+# Threads the webhook uses to overlap independent reads (e.g. usage check and client creation).
+WEBHOOK_PREFETCH_THREADS: int = int(os.environ.get("WEBHOOK_PREFETCH_THREADS", "8"))
+
+
+# ==============================================================================
+# --- WEBHOOK DEDUPLICATION CONFIGURATION ---
+# The provider retries deliveries on timeouts. Deliveries are keyed by the
+# provider's message id (or, if opted in, sender + text hash) and repeats are
+# dropped before any Supabase or Gemini call is made.
+# ==============================================================================
+
+DEDUP_ENABLED: bool = os.environ.get("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_TTL_SECONDS: int = int(os.environ.get("DEDUP_TTL_SECONDS", "600"))
+DEDUP_MAX_ENTRIES: int = int(os.environ.get("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_TEXT_FALLBACK_ENABLED: bool = os.environ.get("DEDUP_TEXT_FALLBACK_ENABLED", "false").lower() == "true"
+DEDUP_TIME_BUCKET_SECONDS: int = int(os.environ.get("DEDUP_TIME_BUCKET_SECONDS", "60"))
+DEDUP_SQLITE_PATH: Optional[str] = os.environ.get("DEDUP_SQLITE_PATH") or None
+
+
+# ==============================================================================
+# --- CONVERSATION HISTORY CONFIGURATION ---
+# History rows are numbered by the append_conversation_turns database function.
+# With write-behind, they are queued and written in batches after the reply,
+# and flushed on a graceful shutdown. Like async mode, only enable it on
+# long-running servers; serverless platforms may freeze or recycle the
+# process before the queue is written.
+# ==============================================================================
+
+HISTORY_WRITE_BEHIND_ENABLED: bool = os.environ.get("HISTORY_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+HISTORY_BATCH_SIZE: int = int(os.environ.get("HISTORY_BATCH_SIZE", "50"))
+HISTORY_FLUSH_INTERVAL_SECONDS: float = float(os.environ.get("HISTORY_FLUSH_INTERVAL_SECONDS", "1.0"))
+HISTORY_MAX_PENDING: int = int(os.environ.get("HISTORY_MAX_PENDING", "10000"))
+
+
+# ==============================================================================
+# --- PHONE LOOKUP CACHE CONFIGURATION ---
+# Every delivery starts by resolving the sender's phone number to a user. The
+# result is cached, and unregistered numbers are cached for a shorter time.
+# Registration flows (e.g. a Supabase database webhook on `user_whatsapp`) can
+# POST to /hooks/user-registered with the X-Webhook-Secret header to clear a
+# number at once.
+# ==============================================================================
+
+PHONE_CACHE_ENABLED: bool = os.environ.get("PHONE_CACHE_ENABLED", "true").lower() == "true"
+PHONE_CACHE_TTL_SECONDS: int = int(os.environ.get("PHONE_CACHE_TTL_SECONDS", "600"))
+PHONE_CACHE_NEGATIVE_TTL_SECONDS: int = int(os.environ.get("PHONE_CACHE_NEGATIVE_TTL_SECONDS", "60"))
+PHONE_CACHE_MAX_ENTRIES: int = int(os.environ.get("PHONE_CACHE_MAX_ENTRIES", "10000"))
+REGISTRATION_HOOK_SECRET: Optional[str] = os.environ.get("REGISTRATION_HOOK_SECRET") or None
+
+
+# ==============================================================================
+# --- GEMINI RATE LIMITING CONFIGURATION ---
+# One limiter is shared by every model and tracks each key's requests and
+# tokens per minute. Calls are delayed only when their key is near its quota.
+# Set the quotas to match the tier of your keys.
+# ==============================================================================
+
+GEMINI_RATE_LIMIT_ENABLED: bool = os.environ.get("GEMINI_RATE_LIMIT_ENABLED", "true").lower() == "true"
+GEMINI_RPM_PER_KEY: int = int(os.environ.get("GEMINI_RPM_PER_KEY", "4000"))
+GEMINI_TPM_PER_KEY: int = int(os.environ.get("GEMINI_TPM_PER_KEY", "4000000"))
+GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS: float = float(os.environ.get("GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS", "10"))
+
+# A key that hits its quota is rested instead of being dropped, then probed
+# with a single call before it takes regular traffic again.
+GEMINI_KEY_COOLDOWN_SECONDS: float = float(os.environ.get("GEMINI_KEY_COOLDOWN_SECONDS", "60"))
+GEMINI_KEY_MAX_COOLDOWN_SECONDS: float = float(os.environ.get("GEMINI_KEY_MAX_COOLDOWN_SECONDS", "900"))
+
+# Key cooldowns and usage counters are shared so that a cold start does not
+# rediscover exhausted keys by failing user requests. "sqlite" shares them
+# between processes on one host (/tmp survives warm starts on Vercel);
+# "supabase" shares them between all instances (run sql/key_health_schema.sql).
+KEY_HEALTH_STORE: str = os.environ.get("KEY_HEALTH_STORE", "sqlite").lower()
+KEY_HEALTH_SQLITE_PATH: str = os.environ.get("KEY_HEALTH_SQLITE_PATH", "/tmp/todowa_key_health.sqlite3")
+KEY_HEALTH_SYNC_SECONDS: float = float(os.environ.get("KEY_HEALTH_SYNC_SECONDS", "30"))
+
+# A call that runs longer than this percentile of its agent's recent calls is
+# sent again on a different key, and the first answer wins.
+GEMINI_HEDGE_ENABLED: bool = os.environ.get("GEMINI_HEDGE_ENABLED", "true").lower() == "true"
+GEMINI_HEDGE_PERCENTILE: float = float(os.environ.get("GEMINI_HEDGE_PERCENTILE", "95"))
+GEMINI_HEDGE_MIN_SAMPLES: int = int(os.environ.get("GEMINI_HEDGE_MIN_SAMPLES", "20"))
+
+# Agent prompts start with a static block of instructions and examples. With
+# context caching, that block is uploaded once per key as a Gemini cached
+# content and referenced by handle instead of being resent on every call.
+# Explicit caching is billed for storage and is not offered on every tier,
+# so it is off by default; the static-first prompts still benefit from
+# Gemini's implicit prefix caching.
+GEMINI_CONTEXT_CACHE_ENABLED: bool = os.environ.get("GEMINI_CONTEXT_CACHE_ENABLED", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL_SECONDS: int = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+GEMINI_CONTEXT_CACHE_MIN_TOKENS: int = int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+
+# ==============================================================================
+# --- LLM RESPONSE CACHE CONFIGURATION ---
+# Deterministic JSON extractions (time expressions, schedules, financial
+# intents) repeat a lot. Their responses are cached by a hash of the
+# normalized prompt, the model and the generation config. Only the agents
+# listed here use the cache; conversational agents should not.
+# ==============================================================================
+
+LLM_CACHE_ENABLED: bool = os.environ.get("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_AGENTS: List[str] = [
+    name.strip()
+    for name in os.environ.get("LLM_CACHE_AGENTS", "task_agent,schedule_agent,financial_agent").split(",")
+    if name.strip()
+]
+LLM_CACHE_TTL_SECONDS: int = int(os.environ.get("LLM_CACHE_TTL_SECONDS", "600"))
+LLM_CACHE_MAX_ENTRIES: int = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_SQLITE_PATH: Optional[str] = os.environ.get("LLM_CACHE_SQLITE_PATH") or None  # Memory only unless set; the file is created 0600
+
+
+# ==============================================================================
+# --- PROMPT BUDGET CONFIGURATION ---
+# Agents that embed the user's own data in a prompt (search candidates,
+# journal titles, todo tasks) keep only as much of it as fits their token
+# budget, preferring the items that match the query, so prompt size stays
+# flat as a user's data grows. Format: "finding_agent=1500,task_agent=3000".
+# ==============================================================================
+
+PROMPT_BUDGET_ENABLED: bool = os.environ.get("PROMPT_BUDGET_ENABLED", "true").lower() == "true"
+PROMPT_BUDGET_TOKENS: Dict[str, int] = {
+    name.strip(): int(tokens)
+    for name, _, tokens in (
+        item.partition("=")
+        for item in os.environ.get("PROMPT_BUDGET_TOKENS", "finding_agent=1500,journal_agent=2000,task_agent=3000").split(",")
+    )
+    if name.strip() and tokens.strip()
+}
+PROMPT_BUDGET_DEFAULT_TOKENS: int = int(os.environ.get("PROMPT_BUDGET_DEFAULT_TOKENS", "2000"))
+PROMPT_BUDGET_MAX_FIELD_CHARS: int = int(os.environ.get("PROMPT_BUDGET_MAX_FIELD_CHARS", "200"))
 
 
 # ==============================================================================
@@ -108,4 +347,10 @@ CHAT_TEST_PHONE: str = "CHAT_TEST_USER"                          # A special ide
 # These keys are required to generate user-specific JWTs for RLS.
 # ==============================================================================
 SUPABASE_JWT_SECRET: Optional[str] = os.environ.get("SUPABASE_JWT_SECRET", "your-super-secret-jwt-token-with-at-least-32-characters-long")
-SUPABASE_ANON_KEY: Optional[str] = os.environ.get("SUPABASE_ANON_KEY", "your-anon-key")
\ No newline at end of file
+SUPABASE_ANON_KEY: Optional[str] = os.environ.get("SUPABASE_ANON_KEY", "your-anon-key")
+
+# Per-user clients are kept in an LRU and reused while their JWT is valid, so
+# an active user's client is built and its JWT signed only once per lifetime.
+RLS_CLIENT_CACHE_SIZE: int = int(os.environ.get("RLS_CLIENT_CACHE_SIZE", "256"))
+RLS_JWT_TTL_SECONDS: int = int(os.environ.get("RLS_JWT_TTL_SECONDS", "3600"))
+RLS_JWT_REFRESH_MARGIN_SECONDS: int = int(os.environ.get("RLS_JWT_REFRESH_MARGIN_SECONDS", "300"))
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+Gemini context caching for the static part of agent prompts.
+
+Most agent prompts are a long block of instructions and examples that never
+changes, followed by a short part with the user's command and data. The
+agents build the static block once and register it with their model
+(`ResilientGeminiModel.register_static_prefix`). With a `GeminiContextCache`,
+the model uploads each registered prefix once as a Gemini cached content and
+then sends only the dynamic part, referencing the prefix by its handle.
+
+Cached contents belong to the project of the API key that created them, so a
+prefix is cached once per key. Creation runs in the background: until a
+prefix's cache is ready (or if creating it fails, e.g. because the key's tier
+does not offer context caching or the prefix is below the minimum size), the
+call simply sends the full prompt. Because the prompts now start with their
+static part, Gemini's implicit prefix caching applies to those calls too.
+
+Key Components:
+- `ContextCacheStats`: A data class of counters for the context cache.
+- `GeminiContextCache`: Creates, tracks and refreshes the cached contents.
+"""
+import datetime
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from google.ai import generativelanguage as glm
+
+from key_health_store import hash_api_key
+from rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ContextCacheStats:
+    """
+    Counters for the context cache.
+
+    Attributes:
+        created (int): Cached contents created (including refreshes).
+        creation_failures (int): Cached contents that could not be created.
+        too_small (int): Prefixes skipped because they are below the minimum size.
+        hits (int): Calls that referenced a cached prefix instead of sending it.
+        misses (int): Calls that sent the full prompt because the cache was not ready.
+        tokens_not_resent (int): The estimated prefix tokens that calls did not send.
+    """
+    created: int = 0
+    creation_failures: int = 0
+    too_small: int = 0
+    hits: int = 0
+    misses: int = 0
+    tokens_not_resent: int = 0
+
+
+class GeminiContextCache:
+    """
+    Keeps one Gemini cached content per (API key, model, static prefix).
+
+    A cached content is created on the first lookup and used until shortly
+    before it expires, when a replacement is created in the background. A
+    failed creation is retried after `ttl_seconds`. All methods are
+    thread-safe and never block on the Gemini API.
+
+    Attributes:
+        ttl_seconds (float): How long each cached content lives.
+        min_tokens (int): The smallest prefix (in estimated tokens) worth caching.
+        refresh_margin_seconds (float): How long before expiry a replacement is created.
+    """
+
+    def __init__(self, ttl_seconds: float = 3600.0, min_tokens: int = 1024,
+                 refresh_margin_seconds: float = 300.0, max_workers: int = 2):
+        """
+        Initializes an empty cache.
+
+        Args:
+            ttl_seconds: How long each cached content lives.
+            min_tokens: The smallest prefix (in estimated tokens) worth caching.
+                        Gemini rejects cached contents below a model-specific minimum.
+            refresh_margin_seconds: How long before expiry a replacement is created.
+            max_workers: The threads that create cached contents.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.min_tokens = min_tokens
+        self.refresh_margin_seconds = min(refresh_margin_seconds, ttl_seconds / 2)
+        # (key hash, model, prefix hash) -> (cached content name, expires_at as time.monotonic())
+        self._entries: Dict[Tuple[str, str, str], Tuple[str, float]] = {}
+        # (key hash, model, prefix hash) -> time.monotonic() before which creation is not retried
+        self._failed_until: Dict[Tuple[str, str, str], float] = {}
+        self._pending: Set[Tuple[str, str, str]] = set()
+        self._prefix_tokens: Dict[str, int] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-context-cache")
+        self._stats = ContextCacheStats()
+        self._lock = threading.Lock()
+
+    def lookup(self, api_key: str, model_name: str, prefix: str,
+               client_factory: Callable[[str], Any]) -> Optional[str]:
+        """
+        Returns the handle of a prefix's cached content, creating it in the background if needed.
+
+        Args:
+            api_key: The key the call will use.
+            model_name: The Gemini model name.
+            prefix: The static prompt prefix.
+            client_factory: Returns the blocking `CacheServiceClient` for a key.
+
+        Returns:
+            The cached content name (e.g. "cachedContents/abc123"), or None if
+            the call should send the full prompt.
+        """
+        prefix_hash = hashlib.sha256(prefix.encode('utf-8')).hexdigest()
+        entry_key = (hash_api_key(api_key), model_name, prefix_hash)
+        now = time.monotonic()
+        with self._lock:
+            prefix_tokens = self._prefix_tokens.get(prefix_hash)
+            if prefix_tokens is None:
+                prefix_tokens = self._prefix_tokens[prefix_hash] = estimate_tokens(prefix)
+                if prefix_tokens < self.min_tokens:
+                    self._stats.too_small += 1
+                    logger.info(f"🧊 A {prefix_tokens}-token prompt prefix is below the {self.min_tokens}-token context cache minimum; it is sent in full.")
+            if prefix_tokens < self.min_tokens:
+                return None
+
+            entry = self._entries.get(entry_key)
+            name = entry[0] if entry is not None and entry[1] > now else None
+            needs_refresh = entry is None or entry[1] - now <= self.refresh_margin_seconds
+            if (needs_refresh and entry_key not in self._pending
+                    and self._failed_until.get(entry_key, 0.0) <= now):
+                self._pending.add(entry_key)
+                self._executor.submit(self._create, entry_key, api_key, model_name, prefix, client_factory)
+
+            if name is None:
+                self._stats.misses += 1
+            else:
+                self._stats.hits += 1
+                self._stats.tokens_not_resent += prefix_tokens
+            return name
+
+    def _create(self, entry_key: Tuple[str, str, str], api_key: str, model_name: str, prefix: str,
+                client_factory: Callable[[str], Any]):
+        """Creates a cached content for a prefix and records it (runs on a worker thread)."""
+        try:
+            cached_content = client_factory(api_key).create_cached_content(
+                cached_content=glm.CachedContent(
+                    model=f"models/{model_name}",
+                    contents=[glm.Content(role="user", parts=[glm.Part(text=prefix)])],
+                    ttl=datetime.timedelta(seconds=self.ttl_seconds),
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Could not create a Gemini context cache with key ending in ...{api_key[-4:]}; sending full prompts for now: {e}")
+            with self._lock:
+                self._pending.discard(entry_key)
+                self._failed_until[entry_key] = time.monotonic() + self.ttl_seconds
+                self._stats.creation_failures += 1
+            return
+
+        with self._lock:
+            self._pending.discard(entry_key)
+            self._failed_until.pop(entry_key, None)
+            # Expire a little early, so a call never references a cached content that has just expired.
+            self._entries[entry_key] = (cached_content.name, time.monotonic() + self.ttl_seconds - 30.0)
+            self._stats.created += 1
+        logger.info(f"🧊 Registered a static prompt prefix as Gemini cached content {cached_content.name}.")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+            A dictionary of counters plus the number of live cached contents
+            and the minimum prefix size.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = asdict(self._stats)
+            stats['live_entries'] = sum(1 for _, expires_at in self._entries.values() if expires_at > now)
+        stats['min_tokens'] = self.min_tokens
+        return stats
+
+    def shutdown(self):
+        """Stops the worker threads without waiting for pending creations."""
+        self._executor.shutdown(wait=False)
@@ -8,25 +8,34 @@ all data operations for an authenticated user, such as managing tasks,
 journal entries, schedules, and more.
 
 Key Features:
-- User identification and usage tracking.
+- User identification (with an optional phone lookup cache) and usage tracking.
 - A `DatabaseManager` class for authenticated, user-specific operations.
 - CRUD (Create, Read, Update, Delete) operations for various data models.
 - Specialized queries for fetching recent context and statistics.
 """
 
 import logging
+import threading
 from supabase import Client
 from datetime import datetime, timezone, date, timedelta
-from typing import Dict, List, Any, Optional
-from config import UNVERIFIED_LIMIT, VERIFIED_LIMIT
+from typing import Dict, List, Any, Optional, Tuple
+from config import VERIFIED_LIMIT
+from quota_leases import QuotaLeases
+from ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# PostgREST error codes meaning the `claim_message_quota` function is not installed.
+_MISSING_FUNCTION_CODES = ('PGRST202', '42883')
+# Set to False once the function is found missing, so later messages go straight to the legacy check.
+_quota_rpc_available = True
+
 # --- Standalone User Functions ---
 # These functions are used to identify a user before a manager is created.
 
 
-def check_and_update_usage(supabase: Client, sender_phone: str, user_id: str | None) -> tuple[bool, str]:
+def check_and_update_usage(supabase: Client, sender_phone: str, user_id: str | None,
+                           leases: Optional[QuotaLeases] = None) -> tuple[bool, str]:
     """
     Checks if a user is within their usage limits and updates their message count.
 
@@ -34,53 +43,188 @@ def check_and_update_usage(supabase: Client, sender_phone: str, user_id: str | N
     it tracks daily message counts, resetting them when a new day begins. For
     unregistered users, it provides a standard message.
 
+    The count is claimed in one atomic call to the `claim_message_quota`
+    function from `sql/usage_metering_schema.sql`. If that function is not
+    installed, the previous read-then-update check is used instead. With
+    `leases`, a claim reserves several messages and the following messages
+    are counted in memory.
+
     Args:
         supabase: An active Supabase client instance.
         sender_phone: The phone number of the user sending the message.
         user_id: The UUID of the user, if they are registered. None otherwise.
+        leases: Optional in-process quota leases.
 
     Returns:
         A tuple containing a boolean indicating if the user is allowed to proceed,
         and a string with an error message if they are not.
     """
+    if not user_id:
+        return (False, "Please register to use the service.")
     today = date.today().isoformat()
-    limit = VERIFIED_LIMIT if user_id else UNVERIFIED_LIMIT
+    limit = VERIFIED_LIMIT
+    if leases is not None and leases.consume(user_id, today):
+        return (True, "")
     try:
-        if user_id:
-            res = supabase.table('user_whatsapp').select('daily_message_count, last_message_date').eq('user_id', user_id).execute()
-            data = res.data[0] if res.data else {}
-            count = data.get('daily_message_count', 0)
-            last_date = data.get('last_message_date')
-            if last_date != today:
-                supabase.table('user_whatsapp').update({'daily_message_count': 1, 'last_message_date': today}).eq('user_id', user_id).execute()
-                return (True, "")
-            if count < limit:
-                supabase.table('user_whatsapp').update({'daily_message_count': count + 1}).eq('user_id', user_id).execute()
-                return (True, "")
+        granted = claim_message_quota(supabase, user_id, limit, today, leases.lease_size if leases is not None else 1)
+        if granted is None:
+            return _check_and_update_usage_legacy(supabase, user_id, limit, today)
+        if granted <= 0:
             return (False, f"You have reached your daily limit of {limit} messages.")
-        else:
-            return (False, "Please register to use the service.")
+        if leases is not None:
+            leases.grant(user_id, today, granted)
+        return (True, "")
     except Exception as e:
         print(f"!!! DATABASE ERROR in check_and_update_usage: {e}")
         return (False, "Sorry, I'm having trouble with my database right now.")
-    
-def get_user_id_by_phone(supabase: Client, phone: str) -> Optional[str]:
+
+def claim_message_quota(supabase: Client, user_id: str, limit: int, today: str, amount: int = 1) -> Optional[int]:
+    """
+    Atomically claims messages from a user's daily quota in one database call.
+
+    Args:
+        supabase: A service-role Supabase client instance.
+        user_id: The UUID of the user.
+        limit: The user's daily message limit.
+        today: The current day as an ISO date.
+        amount: The messages to claim.
+
+    Returns:
+        The number of messages granted (0 if the limit is reached), or None if
+        the `claim_message_quota` function is not installed.
+
+    Raises:
+        Exception: Any other database error.
+    """
+    global _quota_rpc_available
+    if not _quota_rpc_available:
+        return None
+    params = {'p_user_id': user_id, 'p_limit': limit, 'p_today': today, 'p_amount': amount}
+    try:
+        res = supabase.rpc('claim_message_quota', params).execute()
+    except Exception as e:
+        if getattr(e, 'code', None) in _MISSING_FUNCTION_CODES:
+            _quota_rpc_available = False
+            logger.warning("⚠️ The claim_message_quota function is not installed (see sql/usage_metering_schema.sql); using the two-step usage check.")
+            return None
+        raise
+    return int(res.data or 0)
+
+def _check_and_update_usage_legacy(supabase: Client, user_id: str, limit: int, today: str) -> tuple[bool, str]:
+    """The read-then-update usage check, for databases without `claim_message_quota`."""
+    res = supabase.table('user_whatsapp').select('daily_message_count, last_message_date').eq('user_id', user_id).execute()
+    data = res.data[0] if res.data else {}
+    count = data.get('daily_message_count', 0)
+    last_date = data.get('last_message_date')
+    if last_date != today:
+        supabase.table('user_whatsapp').update({'daily_message_count': 1, 'last_message_date': today}).eq('user_id', user_id).execute()
+        return (True, "")
+    if count < limit:
+        supabase.table('user_whatsapp').update({'daily_message_count': count + 1}).eq('user_id', user_id).execute()
+        return (True, "")
+    return (False, f"You have reached your daily limit of {limit} messages.")
+
+class PhoneLookupCache:
+    """
+    Caches phone number to user ID lookups, including numbers with no user.
+
+    Every webhook delivery starts with this lookup, and unregistered numbers
+    that keep writing would otherwise query `user_whatsapp` each time. A
+    number with no user is cached for a shorter time, so a new registration
+    is picked up quickly even if `invalidate` is never called for it.
+
+    Attributes:
+        negative_ttl_seconds (float): How long a number with no user is remembered.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 600.0, negative_ttl_seconds: float = 60.0):
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_entries: The most phone numbers remembered at once.
+            ttl_seconds: How long a registered number's user ID is remembered.
+            negative_ttl_seconds: How long a number with no user is remembered.
+        """
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._cache = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._negative_hits = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, phone: str) -> Tuple[bool, Optional[str]]:
+        """
+        Returns whether the number is cached and, if so, its user ID.
+
+        Args:
+            phone: The phone number.
+
+        Returns:
+            A tuple of (found, user_id). The user ID is None for a cached
+            number with no user.
+        """
+        user_id = self._cache.get(phone, self._MISSING)
+        if user_id is self._MISSING:
+            return (False, None)
+        if user_id is None:
+            with self._lock:
+                self._negative_hits += 1
+        return (True, user_id)
+
+    def store(self, phone: str, user_id: Optional[str]):
+        """Remembers a lookup result; None means the number has no user."""
+        self._cache.set(phone, user_id, ttl_seconds=None if user_id else self.negative_ttl_seconds)
+
+    def invalidate(self, phone: Optional[str] = None):
+        """
+        Forgets a number, e.g. after it was registered or moved to another user.
+
+        Args:
+            phone: The phone number, or None to forget every number.
+        """
+        if phone is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(phone)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+            The `TTLCache` counters plus `negative_hits`, the hits for numbers with no user.
+        """
+        stats = self._cache.get_stats()
+        with self._lock:
+            stats['negative_hits'] = self._negative_hits
+        return stats
+
+def get_user_id_by_phone(supabase: Client, phone: str, cache: Optional[PhoneLookupCache] = None) -> Optional[str]:
     """
     Retrieves a user's unique identifier (UUID) using their phone number.
 
     Args:
         supabase: An active Supabase client instance.
         phone: The phone number to look up.
+        cache: An optional cache of previous lookups. Database errors are not cached.
 
     Returns:
         The user's UUID as a string if found, otherwise None.
     """
+    if cache is not None:
+        found, user_id = cache.lookup(phone)
+        if found:
+            return user_id
     try:
         res = supabase.table('user_whatsapp').select('user_id').eq('phone', phone).limit(1).execute()
-        return res.data[0].get('user_id') if res.data else None
+        user_id = res.data[0].get('user_id') if res.data else None
     except Exception as e:
         logger.error(f"DB Error in get_user_id_by_phone: {e}")
         return None
+    if cache is not None:
+        cache.store(phone, user_id)
+    return user_id
 
 def get_user_context(supabase: Client, user_id: str) -> Dict[str, Any]:
     """
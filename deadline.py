@@ -0,0 +1,105 @@
+"""
+A per-message time budget that follows the message through the pipeline.
+
+The budget starts when processing of a message starts. It is kept in a
+`contextvars.ContextVar`, so it reaches every agent without being passed as
+an argument: asyncio tasks and `asyncio.to_thread` copy the context, and code
+that uses its own thread pool runs the work through `contextvars.copy_context`.
+`ResilientGeminiModel` reads it to give each Gemini call a timeout no longer
+than the time that is left, and refuses to start a call once the budget is
+spent.
+
+Key Components:
+- `DeadlineExceeded`: Raised when work is started after the budget is spent.
+- `Deadline`: A point in time by which the message must be answered.
+- `deadline_scope`: A context manager that sets the deadline for a block.
+- `current_deadline` / `remaining_seconds`: Read the deadline of the current context.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call is attempted after the message's time budget is spent."""
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """
+    The point by which a message must be answered.
+
+    Attributes:
+        expires_at (float): The `time.monotonic()` value at which the budget runs out.
+        budget_seconds (float): The total budget, for logging.
+    """
+    expires_at: float
+    budget_seconds: float
+
+    @classmethod
+    def after(cls, budget_seconds: float, started_at: Optional[float] = None) -> 'Deadline':
+        """
+        Creates a deadline `budget_seconds` after a start time.
+
+        Args:
+            budget_seconds: The total time budget.
+            started_at: The Unix time the budget started (e.g. when a worker
+                        dequeued the message). Defaults to now.
+        """
+        elapsed = max(0.0, time.time() - started_at) if started_at is not None else 0.0
+        return cls(expires_at=time.monotonic() + budget_seconds - elapsed, budget_seconds=budget_seconds)
+
+    def remaining(self) -> float:
+        """Returns the seconds left, or 0 if the deadline has passed."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        """Returns True if the deadline has passed."""
+        return time.monotonic() >= self.expires_at
+
+    def check(self, what: str = "call"):
+        """
+        Raises if the deadline has passed.
+
+        Args:
+            what: A description of the work about to start, for the error message.
+
+        Raises:
+            DeadlineExceeded: If the deadline has passed.
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"The {self.budget_seconds:.0f}s message budget is spent; not starting the {what}.")
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar('current_deadline', default=None)
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Returns the deadline of the current context, or None if there is none."""
+    return _current_deadline.get()
+
+
+def remaining_seconds() -> Optional[float]:
+    """Returns the seconds left in the current context's budget, or None if there is no deadline."""
+    deadline = _current_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Sets the deadline of the current context for the duration of a block.
+
+    Args:
+        deadline: The deadline, or None to run the block without one.
+
+    Yields:
+        The deadline.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current_deadline.reset(token)
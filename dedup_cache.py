@@ -0,0 +1,238 @@
+"""
+Idempotent Webhook Deduplication.
+
+Fonnte retries a delivery when the webhook does not answer in time. Without a
+guard, every retry re-runs the whole multi-agent pipeline and can create the
+same task or journal entry twice. This module recognizes a redelivered
+message before any Supabase or Gemini call is made, so the webhook can drop it.
+
+Key Components:
+- `build_dedup_key`: Derives a stable key from the provider's message id, or,
+  only when opted in, from the sender and a hash of the text.
+- `SQLiteDedupStore`: An optional shared store so several processes on the
+  same host agree on what has already been seen.
+- `MessageDeduplicator`: Claims keys against a bounded in-memory `TTLCache`,
+  backed by the SQLite store when one is configured.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Payload fields that may carry the provider's unique message id, in order of preference.
+MESSAGE_ID_FIELDS = ('id', 'message_id', 'inboxid')
+
+
+def build_dedup_key(payload: Dict[str, Any], text_fallback: bool = False) -> Optional[str]:
+    """
+    Derives the deduplication key for a webhook payload.
+
+    Args:
+        payload: The JSON body received by the webhook.
+        text_fallback: If True, a payload without a message id is keyed by its
+                       sender and text. Legitimate repeats ("yes", "ok") then
+                       collide with each other, so this is opt-in.
+
+    Returns:
+        A string key, or None if the payload cannot be deduplicated.
+    """
+    for field_name in MESSAGE_ID_FIELDS:
+        message_id = payload.get(field_name)
+        if message_id not in (None, ''):
+            return f"id:{message_id}"
+
+    if not text_fallback:
+        return None
+    sender = payload.get('sender')
+    message = payload.get('message')
+    if not sender or not message:
+        return None
+    digest = hashlib.sha256(message.encode('utf-8')).hexdigest()[:32]
+    return f"msg:{sender}:{digest}"
+
+
+class SQLiteDedupStore:
+    """
+    A deduplication store shared through a SQLite file.
+
+    Keys are claimed with `INSERT OR IGNORE`, so two processes racing on the
+    same key see exactly one success. Expired rows are purged opportunistically.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    _PURGE_INTERVAL_SECONDS = 60.0
+
+    def __init__(self, path: str):
+        """
+        Opens (and if needed creates) the SQLite database.
+
+        Args:
+            path: The path of the SQLite database file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_dedup (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        self._last_purge = 0.0
+
+    def claim(self, key: str, ttl_seconds: float) -> bool:
+        """
+        Records a key if it has not been seen within its TTL.
+
+        Args:
+            key: The deduplication key.
+            ttl_seconds: How long the key stays claimed.
+
+        Returns:
+            True if the key was new, False if it was already claimed.
+        """
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge >= self._PURGE_INTERVAL_SECONDS:
+                self._conn.execute("DELETE FROM webhook_dedup WHERE expires_at <= ?", (now,))
+                self._last_purge = now
+            # Replace the row only if it has expired, then try to insert a fresh one.
+            self._conn.execute("DELETE FROM webhook_dedup WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO webhook_dedup (key, expires_at) VALUES (?, ?)",
+                (key, now + ttl_seconds),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, key: str):
+        """Forgets a key so that a later delivery is processed again."""
+        with self._lock:
+            self._conn.execute("DELETE FROM webhook_dedup WHERE key = ?", (key,))
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class MessageDeduplicator:
+    """
+    Drops webhook deliveries that have already been accepted.
+
+    Every key is first checked against a bounded in-memory `TTLCache`. When a
+    SQLite path is configured, keys not found in memory are also claimed in
+    the shared store, so a retry that lands on another process is caught too.
+    If the SQLite store fails, the deduplicator degrades to memory only rather
+    than rejecting messages.
+
+    Payloads without a provider message id are processed as new unless
+    `text_fallback` is set. Then identical text from the same sender is
+    dropped for `text_window_seconds` after it was first accepted (a sliding
+    window, so a redelivery is caught however the clock falls).
+
+    Attributes:
+        ttl_seconds (float): How long a message with a provider id is remembered.
+        text_fallback (bool): Whether payloads without an id are keyed by sender and text.
+        text_window_seconds (float): How long identical text from a sender counts as a redelivery.
+    """
+
+    def __init__(self, ttl_seconds: float = 600.0, max_entries: int = 10000,
+                 sqlite_path: Optional[str] = None, text_fallback: bool = False,
+                 text_window_seconds: float = 60.0):
+        """
+        Initializes the deduplicator.
+
+        Args:
+            ttl_seconds: How long a message with a provider id is remembered.
+            max_entries: The capacity of the in-memory store.
+            sqlite_path: The path of an optional shared SQLite store.
+            text_fallback: Whether payloads without an id are keyed by sender and text.
+            text_window_seconds: How long identical text from a sender counts as a redelivery.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.text_fallback = text_fallback
+        self.text_window_seconds = text_window_seconds
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._shared: Optional[SQLiteDedupStore] = None
+        if sqlite_path:
+            try:
+                self._shared = SQLiteDedupStore(sqlite_path)
+                logger.info(f"🔁 Webhook deduplication is shared through SQLite at {sqlite_path}.")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open the dedup SQLite store at {sqlite_path}; using memory only: {e}")
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+
+    def claim(self, payload: Dict[str, Any]) -> Optional[str]:
+        """
+        Claims a webhook payload for processing.
+
+        Args:
+            payload: The JSON body received by the webhook.
+
+        Returns:
+            The payload's deduplication key if it is new and should be
+            processed, or None if it is a duplicate. Payloads without a usable
+            key are always treated as new and return an empty string.
+        """
+        key = build_dedup_key(payload, self.text_fallback)
+        if key is None:
+            return ''
+
+        ttl_seconds = self.ttl_seconds if key.startswith('id:') else self.text_window_seconds
+        is_new = self._memory.add(key, ttl_seconds=ttl_seconds)
+        if is_new and self._shared is not None:
+            try:
+                is_new = self._shared.claim(key, ttl_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"Dedup SQLite store failed; relying on memory only: {e}")
+
+        with self._lock:
+            self._checked += 1
+            if not is_new:
+                self._duplicates += 1
+        if not is_new and not key.startswith('id:'):
+            logger.warning(f"🔁 Dropped a message from {payload.get('sender')} identical to one accepted in the last {self.text_window_seconds:.0f}s.")
+        return key if is_new else None
+
+    def release(self, key: str):
+        """
+        Forgets a claimed key, e.g. when a message was rejected before processing
+        and a redelivery should be allowed through.
+
+        Args:
+            key: The key returned by `claim`.
+        """
+        if not key:
+            return
+        self._memory.pop(key)
+        if self._shared is not None:
+            try:
+                self._shared.release(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not release dedup key from SQLite: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of the deduplicator's counters.
+
+        Returns:
+            A dictionary with `checked`, `duplicates`, whether a shared store
+            is in use, and the in-memory cache statistics.
+        """
+        with self._lock:
+            stats = {'checked': self._checked, 'duplicates': self._duplicates}
+        stats['shared_store'] = self._shared is not None
+        stats['memory'] = self._memory.get_stats()
+        return stats
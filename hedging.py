@@ -0,0 +1,163 @@
+"""
+Hedged Gemini requests for tail latency.
+
+Most Gemini calls finish quickly, but a few take many times longer than the
+rest and hold the whole message up. When a call has been running for longer
+than a high percentile of its agent's recent latencies, `ResilientGeminiModel`
+sends a duplicate on a different key and uses whichever answer arrives first.
+The slower call is cancelled (async) or left to finish and discarded (sync).
+Because the threshold is a high percentile, only a small share of calls is
+duplicated.
+
+Key Components:
+- `LatencyTracker`: A sliding window of one model's recent call latencies.
+- `HedgeStats`: A data class of counters for hedging.
+- `HedgePolicy`: The threshold rule, counters and worker threads shared by all models.
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """
+    A thread-safe sliding window of call latencies.
+
+    Attributes:
+        window (int): The number of recent latencies kept.
+    """
+
+    def __init__(self, window: int = 200):
+        """
+        Initializes an empty tracker.
+
+        Args:
+            window: The number of recent latencies kept.
+        """
+        self.window = window
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        """Adds one call latency."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Returns a percentile of the recorded latencies.
+
+        Args:
+            percentile: The percentile, between 0 and 100.
+            min_samples: The fewest samples for which a value is returned.
+
+        Returns:
+            The latency in seconds, or None if there are fewer than `min_samples` samples.
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+
+@dataclass
+class HedgeStats:
+    """
+    Counters for hedged requests.
+
+    Attributes:
+        hedged (int): Calls for which a duplicate was sent.
+        hedge_wins (int): Hedged calls answered by the duplicate.
+        no_spare_key (int): Calls that passed the threshold but had no other key to hedge on.
+    """
+    hedged: int = 0
+    hedge_wins: int = 0
+    no_spare_key: int = 0
+
+
+class HedgePolicy:
+    """
+    Decides when to hedge, and runs the blocking calls that may be hedged.
+
+    Attributes:
+        percentile (float): The latency percentile after which a duplicate is sent.
+        min_samples (int): The fewest recorded latencies before a model hedges.
+        window (int): The number of recent latencies each model keeps.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, window: int = 200,
+                 max_workers: int = 32):
+        """
+        Initializes the policy.
+
+        Args:
+            percentile: The latency percentile after which a duplicate is sent.
+            min_samples: The fewest recorded latencies before a model hedges.
+            window: The number of recent latencies each model keeps.
+            max_workers: The threads available for blocking calls that may be hedged.
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self._max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = HedgeStats()
+        self._lock = threading.Lock()
+
+    def threshold(self, tracker: LatencyTracker) -> Optional[float]:
+        """
+        Returns how long a call may run before it is hedged.
+
+        Args:
+            tracker: The calling model's latencies.
+
+        Returns:
+            The threshold in seconds, or None if the model has too few samples.
+        """
+        return tracker.percentile(self.percentile, self.min_samples)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """The threads that run blocking calls which may be hedged, created on first use."""
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix="gemini-hedge")
+        return self._executor
+
+    def record_hedge(self, hedge_won: bool):
+        """Counts a hedged call and whether the duplicate answered first."""
+        with self._lock:
+            self._stats.hedged += 1
+            if hedge_won:
+                self._stats.hedge_wins += 1
+
+    def record_no_spare_key(self):
+        """Counts a call that could not be hedged because no other key was usable."""
+        with self._lock:
+            self._stats.no_spare_key += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the hedging counters and settings.
+
+        Returns:
+            A dictionary of counters plus `percentile` and `min_samples`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+        stats['percentile'] = self.percentile
+        stats['min_samples'] = self.min_samples
+        return stats
+
+    def shutdown(self):
+        """Stops the worker threads without waiting for running calls."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
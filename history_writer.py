@@ -0,0 +1,283 @@
+"""
+Conversation history writes with server-assigned turns and write-behind.
+
+Each message used to log its turn by reading the user's highest
+`conversation_turn` and then inserting the next one: two blocking round trips
+at the end of every message, and two concurrent messages could take the same
+turn. The `append_conversation_turns` function (see
+`sql/conversation_history_schema.sql`) numbers and inserts a whole batch of
+rows in one call, with turns taken from a per-user counter under a row lock.
+
+With write-behind, `ConversationHistoryWriter.append` only queues the row, and
+a background thread sends the queue in batches once the reply is on its way.
+Queued rows are merged into reads of the recent history, so the next message
+sees its predecessor even before it is flushed, and `close` flushes whatever
+is left on a graceful shutdown.
+
+Key Components:
+- `HistoryWriterStats`: A data class of counters for the writer.
+- `ConversationHistoryWriter`: Queues history rows and writes them in batches.
+"""
+import logging
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# PostgREST error codes meaning the `append_conversation_turns` function is not installed.
+_MISSING_FUNCTION_CODES = ('PGRST202', '42883')
+
+# SQLSTATE classes of errors a retry cannot fix: data exceptions (22) and
+# integrity constraint violations (23), e.g. a bad UUID or a missing user.
+_REJECTED_SQLSTATE_CLASSES = ('22', '23')
+
+
+def _is_rejected(error: Exception) -> bool:
+    """Returns True if a write failed because of the row itself, not the connection or the database."""
+    if isinstance(error, (TypeError, ValueError, KeyError)):
+        # The row could not be serialized or lacks a required column.
+        return True
+    return str(getattr(error, 'code', None) or '')[:2] in _REJECTED_SQLSTATE_CLASSES
+
+
+@dataclass
+class HistoryWriterStats:
+    """
+    Counters for the conversation history writer.
+
+    Attributes:
+        queued (int): Rows appended.
+        written (int): Rows written to the database.
+        batches (int): Successful writes (one call each, or one per row on the legacy path).
+        failed_batches (int): Writes that failed and were retried later.
+        dropped (int): Rows dropped because the queue was full.
+        rejected (int): Rows dropped because the database refused them (bad data or a constraint violation).
+        legacy_rows (int): Rows written with the read-then-insert path.
+    """
+    queued: int = 0
+    written: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    dropped: int = 0
+    rejected: int = 0
+    legacy_rows: int = 0
+
+
+class ConversationHistoryWriter:
+    """
+    Writes conversation history rows with a service-role Supabase client.
+
+    Rows carry their own `created_at`, so a delayed write keeps the time the
+    message was answered. Without write-behind, `append` writes the row at
+    once in a single call. With it, rows are written by a background thread
+    every `flush_interval_seconds`, or as soon as `batch_size` are queued. When
+    a batch fails, its rows are retried one by one: a row the database refuses
+    (see `_is_rejected`) is dropped and counted, so it cannot block the rows
+    behind it, while a row that fails for another reason stays queued and is
+    retried later. When the queue exceeds `max_pending` rows, the oldest are
+    dropped.
+
+    Attributes:
+        write_behind (bool): Whether rows are queued and written in the background.
+        batch_size (int): The most rows written in one call.
+        flush_interval_seconds (float): The longest a row waits before being written.
+        max_pending (int): The most rows kept queued.
+    """
+
+    def __init__(self, supabase: Any, write_behind: bool = True, batch_size: int = 50,
+                 flush_interval_seconds: float = 1.0, max_pending: int = 10000):
+        """
+        Initializes the writer and, with write-behind, starts its flush thread.
+
+        Args:
+            supabase: A service-role Supabase client.
+            write_behind: Whether rows are queued and written in the background.
+            batch_size: The most rows written in one call.
+            flush_interval_seconds: The longest a row waits before being written.
+            max_pending: The most rows kept queued.
+        """
+        self.supabase = supabase
+        self.write_behind = write_behind
+        self.batch_size = max(1, batch_size)
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self._pending: Deque[Dict[str, Any]] = deque()
+        self._rpc_available = True
+        self._stats = HistoryWriterStats()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Held while a batch is written, so only one thread writes at a time and rows stay in order.
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        if write_behind:
+            self._thread = threading.Thread(target=self._run, name="history-write-behind", daemon=True)
+            self._thread.start()
+
+    def append(self, row: Dict[str, Any]):
+        """
+        Adds a history row; its turn is assigned when it is written.
+
+        Args:
+            row: The `conversation_history` columns except `conversation_turn`,
+                 including `user_id` and `created_at`.
+        """
+        if not self.write_behind or self._closed:
+            with self._lock:
+                self._stats.queued += 1
+            error = self._write([row])
+            if error is not None and not self._reject(row, error):
+                logger.error("❌ The conversation history row is lost; it is not queued without write-behind.")
+            return
+        with self._wakeup:
+            self._pending.append(row)
+            self._stats.queued += 1
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                self._stats.dropped += 1
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.notify()
+
+    def pending_for(self, user_id: str) -> List[Dict[str, Any]]:
+        """
+        Returns a user's rows that have not been written yet, oldest first.
+
+        Args:
+            user_id: The user's ID.
+        """
+        with self._lock:
+            return [row for row in self._pending if row.get('user_id') == user_id]
+
+    def flush(self):
+        """Writes every queued row, in batches, on the calling thread."""
+        while True:
+            with self._flush_lock:
+                # Without the database function, rows are written one at a time so a failure never repeats a written row.
+                size = self.batch_size if self._rpc_available else 1
+                with self._lock:
+                    batch = [self._pending[i] for i in range(min(size, len(self._pending)))]
+                if not batch:
+                    return
+                error = self._write(batch)
+                if error is None:
+                    self._remove(batch)
+                elif len(batch) > 1:
+                    # One bad row fails the whole call, so retry the rows one by one to isolate it.
+                    if not self._write_singly(batch):
+                        return
+                elif self._reject(batch[0], error):
+                    self._remove(batch)
+                else:
+                    return
+
+    def _write_singly(self, rows: List[Dict[str, Any]]) -> bool:
+        """Writes rows one at a time, dropping refused ones. Returns False at the first row that may succeed later."""
+        for row in rows:
+            error = self._write([row])
+            if error is not None and not self._reject(row, error):
+                return False
+            self._remove([row])
+        return True
+
+    def _reject(self, row: Dict[str, Any], error: Exception) -> bool:
+        """Drops a row the database refused. Returns False, leaving it alone, if the error may be transient."""
+        if not _is_rejected(error):
+            return False
+        with self._lock:
+            self._stats.rejected += 1
+        logger.error(f"❌ Dropping a conversation history row the database refused (user '{row.get('user_id')}', "
+                     f"created at {row.get('created_at')}): {error}")
+        return True
+
+    def _remove(self, rows: List[Dict[str, Any]]):
+        """Removes rows that were written or dropped from the head of the queue."""
+        with self._lock:
+            # Rows are only removed once written, so readers never miss them.
+            for row in rows:
+                if self._pending and self._pending[0] is row:
+                    self._pending.popleft()
+
+    def _run(self):
+        """Flushes the queue every interval, or sooner when a batch is full (runs on the flush thread)."""
+        while True:
+            with self._wakeup:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval_seconds)
+                if self._closed:
+                    return
+            self.flush()
+
+    def _write(self, rows: List[Dict[str, Any]]) -> Optional[Exception]:
+        """Writes rows in one call, or one by one if the database function is missing. Returns the error, or None on success."""
+        try:
+            if self._rpc_available:
+                try:
+                    self.supabase.rpc('append_conversation_turns', {'p_rows': rows}).execute()
+                except Exception as e:
+                    if getattr(e, 'code', None) not in _MISSING_FUNCTION_CODES:
+                        raise
+                    self._rpc_available = False
+                    logger.warning("⚠️ The append_conversation_turns function is not installed (see sql/conversation_history_schema.sql); numbering turns in the application.")
+            if not self._rpc_available:
+                for row in rows:
+                    self._write_legacy(row)
+        except Exception as e:
+            logger.error(f"❌ Failed to write {len(rows)} conversation history row(s): {e}")
+            with self._lock:
+                self._stats.failed_batches += 1
+            return e
+
+        with self._lock:
+            self._stats.batches += 1 if self._rpc_available else len(rows)
+            self._stats.written += len(rows)
+            if not self._rpc_available:
+                self._stats.legacy_rows += len(rows)
+        logger.info(f"📝 Logged {len(rows)} conversation turn(s) to the database.")
+        return None
+
+    def _write_legacy(self, row: Dict[str, Any]):
+        """Reads the user's last turn and inserts the row as the next one."""
+        result = self.supabase.table('conversation_history') \
+            .select('conversation_turn') \
+            .eq('user_id', row['user_id']) \
+            .order('conversation_turn', desc=True) \
+            .limit(1) \
+            .execute()
+        last_turn = result.data[0].get('conversation_turn', 0) if result.data else 0
+        self.supabase.table('conversation_history').insert({**row, 'conversation_turn': last_turn + 1}).execute()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the writer's counters.
+
+        Returns:
+            A dictionary of counters plus `pending` and `write_behind`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['write_behind'] = self.write_behind
+        return stats
+
+    def close(self, timeout: Optional[float] = 10.0):
+        """
+        Stops the flush thread and writes the rows still queued.
+
+        Args:
+            timeout: The longest to wait for a write in progress on the flush thread.
+        """
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+        remaining = self.get_stats()['pending']
+        if remaining:
+            logger.error(f"❌ {remaining} conversation history row(s) could not be written before shutdown.")
+        else:
+            logger.info("📝 Conversation history writer flushed and stopped.")
@@ -0,0 +1,213 @@
+"""
+Shared storage for Gemini API key health.
+
+Every serverless instance builds its own `ApiKeyManager`, so without shared
+state a cold instance only learns that a key is exhausted by failing a real
+user request on it. The stores in this module persist each key's cooldown,
+consecutive quota errors, broken flag and usage counters, so that new
+instances and concurrent workers start from the same view.
+
+Keys are never stored in plain text: every row is keyed by `hash_api_key`.
+
+Both stores offer the same two methods:
+- `load()` returns every stored key's health.
+- `record(key_hash, requests, failures, state)` adds usage counters and, when
+  `state` is given, replaces the key's state. Counters are added rather than
+  overwritten so several writers never lose each other's counts.
+
+Key Components:
+- `hash_api_key`: The stable, non-reversible identifier of a key.
+- `KeyHealthState`: A data class with the persisted state of one key.
+- `SQLiteKeyHealthStore`: A store in a local SQLite file (the default).
+- `SupabaseKeyHealthStore`: A store in the `gemini_key_health` table
+  (see `sql/key_health_schema.sql`), shared by every instance.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def hash_api_key(api_key: str) -> str:
+    """
+    Returns the identifier under which a key's health is stored.
+
+    Args:
+        api_key: The API key.
+
+    Returns:
+        The first 32 hex characters of the key's SHA-256 digest.
+    """
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:32]
+
+
+@dataclass
+class KeyHealthState:
+    """
+    The persisted state of one API key.
+
+    Attributes:
+        cooldown_until (float): The Unix time until which the key should not be used.
+        quota_errors (int): Consecutive quota errors since the last success.
+        is_broken (bool): True if the key was rejected outright.
+        updated_at (float): The Unix time the state was last changed.
+        requests (int): The number of calls made with the key, by all writers.
+        failures (int): The number of failed calls, by all writers.
+    """
+    cooldown_until: float = 0.0
+    quota_errors: int = 0
+    is_broken: bool = False
+    updated_at: float = 0.0
+    requests: int = 0
+    failures: int = 0
+
+
+class SQLiteKeyHealthStore:
+    """
+    A key health store in a SQLite file, shared by every process on a host.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens (and if needed creates) the SQLite database.
+
+        Args:
+            path: The path of the SQLite database file.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS gemini_key_health ("
+            "key_hash TEXT PRIMARY KEY, "
+            "cooldown_until REAL NOT NULL DEFAULT 0, "
+            "quota_errors INTEGER NOT NULL DEFAULT 0, "
+            "is_broken INTEGER NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL DEFAULT 0, "
+            "requests INTEGER NOT NULL DEFAULT 0, "
+            "failures INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def load(self) -> Dict[str, KeyHealthState]:
+        """Returns the stored health of every key, by key hash."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key_hash, cooldown_until, quota_errors, is_broken, updated_at, requests, failures "
+                "FROM gemini_key_health"
+            ).fetchall()
+        return {
+            row[0]: KeyHealthState(
+                cooldown_until=row[1], quota_errors=row[2], is_broken=bool(row[3]),
+                updated_at=row[4], requests=row[5], failures=row[6],
+            )
+            for row in rows
+        }
+
+    def record(self, key_hash: str, requests: int = 0, failures: int = 0,
+               state: Optional[KeyHealthState] = None):
+        """
+        Adds usage counters to a key and optionally replaces its state.
+
+        Args:
+            key_hash: The key's `hash_api_key` value.
+            requests: The calls to add to the key's request counter.
+            failures: The failed calls to add to the key's failure counter.
+            state: The key's new state, or None to leave the stored state alone.
+                   Its counters are ignored.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO gemini_key_health (key_hash) VALUES (?) ON CONFLICT(key_hash) DO NOTHING",
+                (key_hash,),
+            )
+            self._conn.execute(
+                "UPDATE gemini_key_health SET requests = requests + ?, failures = failures + ? WHERE key_hash = ?",
+                (requests, failures, key_hash),
+            )
+            if state is not None:
+                self._conn.execute(
+                    "UPDATE gemini_key_health SET cooldown_until = ?, quota_errors = ?, is_broken = ?, updated_at = ? "
+                    "WHERE key_hash = ?",
+                    (state.cooldown_until, state.quota_errors, int(state.is_broken), state.updated_at, key_hash),
+                )
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class SupabaseKeyHealthStore:
+    """
+    A key health store in the Supabase `gemini_key_health` table.
+
+    Writes go through the `record_gemini_key_health` function so that counters
+    are incremented atomically. Both are created by `sql/key_health_schema.sql`.
+
+    Attributes:
+        supabase (Client): A service-role Supabase client.
+    """
+
+    TABLE = 'gemini_key_health'
+
+    def __init__(self, supabase: Any):
+        """
+        Initializes the store.
+
+        Args:
+            supabase: A service-role Supabase client.
+        """
+        self.supabase = supabase
+
+    def load(self) -> Dict[str, KeyHealthState]:
+        """Returns the stored health of every key, by key hash."""
+        result = self.supabase.table(self.TABLE).select(
+            'key_hash, cooldown_until, quota_errors, is_broken, updated_at, requests, failures'
+        ).execute()
+        return {
+            row['key_hash']: KeyHealthState(
+                cooldown_until=float(row.get('cooldown_until') or 0.0),
+                quota_errors=int(row.get('quota_errors') or 0),
+                is_broken=bool(row.get('is_broken')),
+                updated_at=float(row.get('updated_at') or 0.0),
+                requests=int(row.get('requests') or 0),
+                failures=int(row.get('failures') or 0),
+            )
+            for row in result.data or []
+        }
+
+    def record(self, key_hash: str, requests: int = 0, failures: int = 0,
+               state: Optional[KeyHealthState] = None):
+        """
+        Adds usage counters to a key and optionally replaces its state.
+
+        Args:
+            key_hash: The key's `hash_api_key` value.
+            requests: The calls to add to the key's request counter.
+            failures: The failed calls to add to the key's failure counter.
+            state: The key's new state, or None to leave the stored state alone.
+                   Its counters are ignored.
+        """
+        params = {
+            'p_key_hash': key_hash,
+            'p_requests': requests,
+            'p_failures': failures,
+            'p_update_state': state is not None,
+            'p_cooldown_until': state.cooldown_until if state else 0.0,
+            'p_quota_errors': state.quota_errors if state else 0,
+            'p_is_broken': state.is_broken if state else False,
+            'p_updated_at': state.updated_at if state else 0.0,
+        }
+        self.supabase.rpc('record_gemini_key_health', params).execute()
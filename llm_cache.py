@@ -0,0 +1,295 @@
+"""
+A two-tier cache for Gemini responses to repeated prompts.
+
+Many agent prompts are deterministic JSON extractions whose inputs repeat a
+lot (time expressions, schedule phrases, financial intents). This module lets
+`ResilientGeminiModel` answer a repeated prompt without calling Gemini: first
+from a bounded in-process `TTLCache`, then from an optional SQLite file that
+survives restarts and is shared by the processes on a host.
+
+Entries are keyed by a hash of the normalized prompt, the model name and the
+generation config. Normalization collapses whitespace and truncates ISO
+timestamps to the minute, so prompts that embed "the current time" still hit
+within the same minute. Only the response text is cached, which is all the
+agents read.
+
+Caching is opt-in per agent: only models created for an agent name in
+`enabled_agents` use the cache.
+
+Key Components:
+- `build_cache_key`: Hashes a prompt, model name and generation config.
+- `CachedResponse`: The stand-in returned for a cache hit.
+- `SQLiteResponseStore`: The on-disk tier.
+- `LLMCacheStats`: A data class of counters for the cache.
+- `LLMResponseCache`: The two tiers behind one `get` / `set` interface.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterable, Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# ISO 8601 timestamps with seconds; group 1 is the part up to the minute.
+_TIMESTAMP_PATTERN = re.compile(r'(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}):\d{2}(?:\.\d+)?')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_prompt(contents: Any) -> str:
+    """
+    Returns the form of a prompt used for cache keys.
+
+    Args:
+        contents: A prompt string, or a list of strings / parts.
+
+    Returns:
+        The prompt with whitespace collapsed and ISO timestamps truncated to the minute.
+    """
+    if isinstance(contents, (list, tuple)):
+        text = '\n'.join(part if isinstance(part, str) else str(part) for part in contents)
+    else:
+        text = contents if isinstance(contents, str) else str(contents)
+    text = _TIMESTAMP_PATTERN.sub(r'\1', text)
+    return _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+
+def build_cache_key(contents: Any, model_name: str, generation_config: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Derives the cache key for a `generate_content` call.
+
+    Args:
+        contents: The prompt passed to `generate_content`.
+        model_name: The Gemini model name.
+        generation_config: The effective generation config, if any.
+
+    Returns:
+        A hex SHA-256 digest.
+    """
+    config_str = json.dumps(generation_config or {}, sort_keys=True, default=str)
+    payload = f"{model_name}\x00{config_str}\x00{normalize_prompt(contents)}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class CachedResponse:
+    """
+    A cached Gemini response.
+
+    Attributes:
+        text (str): The response text.
+        usage_metadata (None): Always None; a cached response used no tokens.
+    """
+    text: str
+    usage_metadata: Any = None
+
+
+class SQLiteResponseStore:
+    """
+    The on-disk tier of the response cache, shared by the processes on a host.
+
+    Attributes:
+        path (str): The path of the SQLite database file.
+    """
+
+    _PURGE_INTERVAL_SECONDS = 300.0
+
+    def __init__(self, path: str):
+        """
+        Opens (and if needed creates) the SQLite database.
+
+        The file holds model responses that may quote users' messages, so it
+        is created readable by the owner only (0600), and a new directory 0700.
+
+        Args:
+            path: The path of the SQLite database file.
+
+        Raises:
+            OSError: If the file cannot be created or its permissions restricted.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            os.fchmod(fd, 0o600)
+        finally:
+            os.close(fd)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_response_cache (key TEXT PRIMARY KEY, text TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._last_purge = 0.0
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the unexpired text stored under `key`, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM llm_response_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, text: str, ttl_seconds: float):
+        """Stores `text` under `key` for `ttl_seconds`, purging expired rows now and then."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge >= self._PURGE_INTERVAL_SECONDS:
+                self._conn.execute("DELETE FROM llm_response_cache WHERE expires_at <= ?", (now,))
+                self._last_purge = now
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_response_cache (key, text, expires_at) VALUES (?, ?, ?)",
+                (key, text, now + ttl_seconds),
+            )
+
+    def close(self):
+        """Closes the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+@dataclass
+class LLMCacheStats:
+    """
+    Counters for the response cache.
+
+    Attributes:
+        memory_hits (int): Lookups answered by the in-process tier.
+        disk_hits (int): Lookups answered by the SQLite tier.
+        misses (int): Lookups answered by neither tier.
+        stores (int): Responses added to the cache.
+        bytes_stored (int): The UTF-8 size of the stored response texts.
+        bytes_served (int): The UTF-8 size of the response texts served from the cache.
+        disk_errors (int): SQLite operations that failed and were skipped.
+    """
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    bytes_stored: int = 0
+    bytes_served: int = 0
+    disk_errors: int = 0
+
+
+class LLMResponseCache:
+    """
+    An in-process LRU with TTL, backed by an optional SQLite tier.
+
+    Disk hits are copied into memory. If the SQLite tier fails, the cache
+    continues with memory only rather than failing the call.
+
+    Attributes:
+        ttl_seconds (float): How long a response is reused.
+        enabled_agents (frozenset): The agent names whose models use the cache.
+    """
+
+    def __init__(self, enabled_agents: Iterable[str], max_entries: int = 2048,
+                 ttl_seconds: float = 600.0, sqlite_path: Optional[str] = None):
+        """
+        Initializes the cache.
+
+        Args:
+            enabled_agents: The agent names (as passed to `create_ai_model`)
+                            whose models use the cache.
+            max_entries: The capacity of the in-process tier.
+            ttl_seconds: How long a response is reused.
+            sqlite_path: The path of an optional SQLite tier.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.enabled_agents = frozenset(enabled_agents)
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._disk: Optional[SQLiteResponseStore] = None
+        if sqlite_path:
+            try:
+                self._disk = SQLiteResponseStore(sqlite_path)
+                logger.info(f"🗄️ LLM response cache is backed by SQLite at {sqlite_path}.")
+            except (sqlite3.Error, OSError) as e:
+                logger.error(f"Could not open the LLM cache SQLite store at {sqlite_path}; using memory only: {e}")
+        self._stats = LLMCacheStats()
+        self._lock = threading.Lock()
+
+    def is_enabled_for(self, agent_name: str) -> bool:
+        """Returns True if models created for `agent_name` use the cache."""
+        return agent_name in self.enabled_agents
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """
+        Looks a key up in memory, then on disk.
+
+        Args:
+            key: A key from `build_cache_key`.
+
+        Returns:
+            A `CachedResponse`, or None on a miss.
+        """
+        text = self._memory.get(key)
+        tier = 'memory'
+        if text is None and self._disk is not None:
+            try:
+                text = self._disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache SQLite lookup failed; skipping the disk tier: {e}")
+                with self._lock:
+                    self._stats.disk_errors += 1
+            if text is not None:
+                tier = 'disk'
+                self._memory.set(key, text)
+
+        with self._lock:
+            if text is None:
+                self._stats.misses += 1
+                return None
+            if tier == 'memory':
+                self._stats.memory_hits += 1
+            else:
+                self._stats.disk_hits += 1
+            self._stats.bytes_served += len(text.encode('utf-8'))
+        return CachedResponse(text=text)
+
+    def set(self, key: str, text: str):
+        """
+        Stores a response text in both tiers.
+
+        Args:
+            key: A key from `build_cache_key`.
+            text: The response text. Empty texts are not cached.
+        """
+        if not text:
+            return
+        self._memory.set(key, text)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, text, self.ttl_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"LLM cache SQLite write failed; keeping the response in memory only: {e}")
+                with self._lock:
+                    self._stats.disk_errors += 1
+        with self._lock:
+            self._stats.stores += 1
+            self._stats.bytes_stored += len(text.encode('utf-8'))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+            A dictionary of counters plus `hit_rate`, `enabled_agents`, whether
+            a disk tier is in use, and the in-process tier's statistics.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        stats['enabled_agents'] = sorted(self.enabled_agents)
+        stats['disk_tier'] = self._disk is not None
+        stats['memory'] = self._memory.get_stats()
+        return stats
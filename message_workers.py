@@ -0,0 +1,446 @@
+"""
+Background Message Processing for the WhatsApp Webhook.
+
+This module lets the webhook acknowledge a message right away instead of
+holding the HTTP request open for the entire multi-agent pipeline. The webhook
+validates and enqueues an `InboundMessage`, and a `MessageWorkerPool` runs
+`TodowaApp.process_message_async` in the background, delivering the final
+reply through the Fonnte service.
+
+Key Components:
+- `InboundMessage`: A data class describing a single validated message.
+- `WorkerPoolStats`: A data class holding throughput and failure counters.
+- `UserMessageDispatcher`: Per-user FIFO queues that hand out at most one
+  message per user at a time, so a user's messages are processed in order
+  while different users run in parallel.
+- `MessageWorkerPool`: A pool of worker threads, each owning its own asyncio
+  event loop, that consumes messages from the dispatcher.
+
+The pool is intended for long-running server deployments. Serverless platforms
+may freeze background threads once the HTTP response has been sent, so the
+feature is disabled by default (see `config.ASYNC_WEBHOOK_ENABLED`).
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, asdict
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Set, Tuple
+
+import services
+from reply_streaming import ReplyStream
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InboundMessage:
+    """
+    A validated, authenticated message waiting to be processed.
+
+    Attributes:
+        sender_phone (str): The phone number the reply should be sent to.
+        message_text (str): The raw text of the user's message.
+        user_id (str): The UUID of the registered user.
+        user_supabase_client (Any): The RLS-enabled Supabase client for the user.
+        received_at (float): The UNIX timestamp at which the webhook accepted the message.
+    """
+    sender_phone: str
+    message_text: str
+    user_id: str
+    user_supabase_client: Any
+    received_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class WorkerPoolStats:
+    """
+    Holds throughput and failure counters for a `MessageWorkerPool`.
+
+    Attributes:
+        submitted (int): The number of messages accepted onto the queue.
+        rejected (int): The number of messages refused because the queue was full.
+        processed (int): The number of messages that completed successfully.
+        failed (int): The number of messages whose processing raised an exception.
+        total_processing_time (float): The cumulative seconds spent processing messages.
+        total_queue_wait_time (float): The cumulative seconds messages spent waiting in the queue.
+    """
+    submitted: int = 0
+    rejected: int = 0
+    processed: int = 0
+    failed: int = 0
+    total_processing_time: float = 0.0
+    total_queue_wait_time: float = 0.0
+
+
+class UserMessageDispatcher:
+    """
+    Serializes messages per user while letting different users run in parallel.
+
+    Every user key owns a FIFO queue. A user becomes "ready" when it has
+    pending messages and no message in flight; `acquire` hands out the oldest
+    message of the next ready user and marks that user active until `release`
+    is called. This guarantees that two messages from the same sender never
+    race (conversation turns and agent state written by one message are
+    visible to the next), without a global lock. Ready users are served
+    round-robin, one message per turn, so a chatty user cannot starve others.
+
+    Attributes:
+        max_active_users (int): The maximum number of users with a message in flight.
+        max_queue_depth_per_user (int): The maximum number of pending messages per user.
+        max_pending_total (int): The maximum number of pending messages across all users.
+    """
+
+    def __init__(self, max_active_users: int, max_queue_depth_per_user: int = 20, max_pending_total: int = 1000):
+        """
+        Initializes an empty dispatcher.
+
+        Args:
+            max_active_users: The bound on concurrently processed users.
+            max_queue_depth_per_user: The bound on each user's pending queue.
+            max_pending_total: The bound on pending messages across all users.
+
+        Raises:
+            ValueError: If `max_active_users` is less than 1.
+        """
+        if max_active_users < 1:
+            raise ValueError("UserMessageDispatcher requires at least one active user slot.")
+
+        self.max_active_users = max_active_users
+        self.max_queue_depth_per_user = max_queue_depth_per_user
+        self.max_pending_total = max_pending_total
+        self._pending: Dict[Hashable, Deque[Any]] = {}
+        self._ready: Deque[Hashable] = deque()
+        self._active: Set[Hashable] = set()
+        self._pending_total = 0
+        self._peak_pending_total = 0
+        self._peak_user_depth = 0
+        self._rejected = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def submit(self, user_key: Hashable, item: Any) -> bool:
+        """
+        Appends an item to a user's queue.
+
+        Args:
+            user_key: The key messages are serialized on (user ID or sender phone).
+            item: The item to process.
+
+        Returns:
+            True if the item was queued, False if the dispatcher is closed or
+            the per-user or global bound has been reached.
+        """
+        with self._condition:
+            user_queue = self._pending.get(user_key)
+            depth = len(user_queue) if user_queue else 0
+            if (self._closed or depth >= self.max_queue_depth_per_user
+                    or self._pending_total >= self.max_pending_total):
+                self._rejected += 1
+                return False
+
+            if user_queue is None:
+                user_queue = self._pending[user_key] = deque()
+            user_queue.append(item)
+            self._pending_total += 1
+            self._peak_pending_total = max(self._peak_pending_total, self._pending_total)
+            self._peak_user_depth = max(self._peak_user_depth, len(user_queue))
+
+            # A user that is neither in flight nor already waiting becomes ready.
+            if depth == 0 and user_key not in self._active:
+                self._ready.append(user_key)
+                self._condition.notify()
+            return True
+
+    def has_capacity(self, user_key: Hashable) -> bool:
+        """
+        Returns True if `submit` would currently accept an item for the user.
+
+        Args:
+            user_key: The key messages are serialized on (user ID or sender phone).
+        """
+        with self._condition:
+            user_queue = self._pending.get(user_key)
+            depth = len(user_queue) if user_queue else 0
+            return (not self._closed and depth < self.max_queue_depth_per_user
+                    and self._pending_total < self.max_pending_total)
+
+    def acquire(self) -> Optional[Tuple[Hashable, Any]]:
+        """
+        Blocks until a message can be processed and claims it.
+
+        Returns:
+            A `(user_key, item)` tuple, or None once the dispatcher has been
+            closed and every pending message has been handed out.
+        """
+        with self._condition:
+            while True:
+                if self._ready and len(self._active) < self.max_active_users:
+                    user_key = self._ready.popleft()
+                    item = self._pending[user_key].popleft()
+                    self._pending_total -= 1
+                    self._active.add(user_key)
+                    return user_key, item
+                if self._closed and not self._ready:
+                    return None
+                self._condition.wait()
+
+    def release(self, user_key: Hashable):
+        """
+        Marks a user's in-flight message as finished.
+
+        If the user has more pending messages it goes to the back of the ready
+        queue; otherwise its empty queue is discarded.
+
+        Args:
+            user_key: The key returned alongside the item by `acquire`.
+        """
+        with self._condition:
+            self._active.discard(user_key)
+            if self._pending.get(user_key):
+                self._ready.append(user_key)
+            else:
+                self._pending.pop(user_key, None)
+            self._condition.notify_all()
+
+    def close(self):
+        """Stops accepting new items and wakes waiting workers so they can drain and exit."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns queue-depth metrics for monitoring.
+
+        Returns:
+            A dictionary with the total pending messages, the number of
+            waiting and active users, the deepest current user queue, peak
+            values, and the number of rejected submissions.
+        """
+        with self._condition:
+            return {
+                'pending_messages': self._pending_total,
+                'waiting_users': len(self._ready),
+                'active_users': len(self._active),
+                'max_user_queue_depth': max((len(q) for q in self._pending.values()), default=0),
+                'peak_pending_messages': self._peak_pending_total,
+                'peak_user_queue_depth': self._peak_user_depth,
+                'rejected': self._rejected,
+            }
+
+
+class MessageWorkerPool:
+    """
+    Runs the message-processing pipeline on a pool of background workers.
+
+    Each worker is a daemon thread that owns a private asyncio event loop. A
+    worker claims one `InboundMessage` at a time from a `UserMessageDispatcher`,
+    awaits `process_message_async` on its own loop, and sends the reply.
+    Because the agents still perform blocking I/O, giving every worker its own
+    loop means a slow LLM call only ever stalls the message it belongs to.
+    Messages are serialized per `user_id`, so at most one message per user is
+    ever in flight.
+
+    Attributes:
+        app: The initialized `TodowaApp` instance used to process messages.
+        worker_count (int): The number of worker threads in the pool.
+        max_queue_size (int): The maximum number of messages waiting to be processed.
+        dispatcher (UserMessageDispatcher): The per-user queues feeding the workers.
+    """
+
+    def __init__(self, app: Any, worker_count: int = 4, max_queue_size: int = 1000,
+                 max_queue_depth_per_user: int = 20, max_active_users: Optional[int] = None,
+                 send_reply: Callable[[str, str], Any] = services.send_fonnte_message,
+                 stream_replies: bool = False, stream_chunk_chars: Tuple[int, int] = (200, 1500)):
+        """
+        Initializes the pool without starting any threads.
+
+        Args:
+            app: An initialized `TodowaApp` instance.
+            worker_count: The number of worker threads to run.
+            max_queue_size: The capacity of the pending-message queues across all users.
+            max_queue_depth_per_user: The capacity of each user's pending queue.
+            max_active_users: The maximum number of users processed at once.
+                              Defaults to `worker_count`.
+            send_reply: The function used to deliver replies, called as
+                        `send_reply(target, message)`.
+            stream_replies: If True, long AI-synthesized replies are sent
+                            paragraph by paragraph while they are generated.
+            stream_chunk_chars: The `(min_chars, max_chars)` of a streamed chunk.
+
+        Raises:
+            ValueError: If `worker_count` is less than 1.
+        """
+        if worker_count < 1:
+            raise ValueError("MessageWorkerPool requires at least one worker.")
+
+        self.app = app
+        self.worker_count = worker_count
+        self.max_queue_size = max_queue_size
+        self.dispatcher = UserMessageDispatcher(
+            max_active_users=min(max_active_users or worker_count, worker_count),
+            max_queue_depth_per_user=max_queue_depth_per_user,
+            max_pending_total=max_queue_size,
+        )
+        self._send_reply = send_reply
+        self.stream_replies = stream_replies
+        self._stream_chunk_chars = stream_chunk_chars
+        self._threads: List[threading.Thread] = []
+        self._stats = WorkerPoolStats()
+        self._stats_lock = threading.Lock()
+        self._lifecycle_lock = threading.Lock()
+        self._running = False
+
+    @property
+    def is_running(self) -> bool:
+        """Returns True while the worker threads are accepting messages."""
+        return self._running
+
+    def start(self):
+        """
+        Starts the worker threads. Calling `start` on a running pool is a no-op.
+        """
+        with self._lifecycle_lock:
+            if self._running:
+                return
+            self._running = True
+            for index in range(self.worker_count):
+                thread = threading.Thread(
+                    target=self._worker_main,
+                    name=f"todowa-worker-{index + 1}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"🧵 MessageWorkerPool started with {self.worker_count} worker(s) and a queue of {self.max_queue_size}.")
+
+    def has_capacity(self, user_id: str) -> bool:
+        """
+        Returns True if a message from the user would currently be queued.
+
+        The webhook checks this before metering usage, so a message that would
+        be turned away is not charged. `submit` may still refuse it if the
+        queue fills up in between.
+
+        Args:
+            user_id: The user's ID.
+        """
+        return self._running and self.dispatcher.has_capacity(user_id)
+
+    def submit(self, message: InboundMessage) -> bool:
+        """
+        Enqueues a message on its user's queue without blocking.
+
+        Args:
+            message: The validated message to process.
+
+        Returns:
+            True if the message was queued, False if the pool is not running
+            or the user's queue or the global queue is full.
+        """
+        if not self._running:
+            return False
+        if not self.dispatcher.submit(message.user_id, message):
+            with self._stats_lock:
+                self._stats.rejected += 1
+            logger.warning(f"Worker queues are full; could not enqueue message from {message.sender_phone}.")
+            return False
+        with self._stats_lock:
+            self._stats.submitted += 1
+        return True
+
+    def stop(self, timeout: Optional[float] = None):
+        """
+        Stops the pool gracefully, letting queued messages finish first.
+
+        Args:
+            timeout: The maximum number of seconds to wait for each worker
+                     thread to exit. None waits indefinitely.
+        """
+        with self._lifecycle_lock:
+            if not self._running:
+                return
+            self._running = False
+            self.dispatcher.close()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+        logger.info("🧵 MessageWorkerPool stopped.")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of the pool's counters and the dispatcher's queue depths.
+
+        Returns:
+            A dictionary of counters, `worker_count`, the average processing
+            and queue-wait times in seconds, and a nested `dispatcher` entry
+            with per-user queue-depth metrics.
+        """
+        with self._stats_lock:
+            stats = asdict(self._stats)
+        completed = stats['processed'] + stats['failed']
+        stats['average_processing_time'] = stats['total_processing_time'] / completed if completed else 0.0
+        stats['average_queue_wait_time'] = stats['total_queue_wait_time'] / completed if completed else 0.0
+        stats['worker_count'] = self.worker_count
+        stats['dispatcher'] = self.dispatcher.get_stats()
+        return stats
+
+    def _worker_main(self):
+        """The body of each worker thread: a private event loop draining the dispatcher."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            while True:
+                claimed = self.dispatcher.acquire()
+                if claimed is None:
+                    return
+                user_key, message = claimed
+                try:
+                    self._handle(loop, message)
+                finally:
+                    self.dispatcher.release(user_key)
+        finally:
+            loop.close()
+
+    def _handle(self, loop: asyncio.AbstractEventLoop, message: InboundMessage):
+        """
+        Processes a single message on the worker's loop and delivers the reply.
+
+        Args:
+            loop: The worker thread's private event loop.
+            message: The message to process.
+        """
+        started_at = time.time()
+        success = False
+        try:
+            reply_stream = None
+            if self.stream_replies:
+                min_chars, max_chars = self._stream_chunk_chars
+                reply_stream = ReplyStream(lambda text: self._send_reply(message.sender_phone, text),
+                                           min_chars=min_chars, max_chars=max_chars)
+            response_text = loop.run_until_complete(
+                self.app.process_message_async(message.message_text, message.user_id, message.user_supabase_client,
+                                               started_at=started_at, reply_stream=reply_stream)
+            )
+            if reply_stream is not None:
+                reply_stream.finish(response_text)
+            else:
+                self._send_reply(message.sender_phone, response_text)
+            success = True
+        except Exception as e:
+            logger.critical(f"!!! UNHANDLED ERROR IN MESSAGE WORKER for {message.sender_phone}: {e}", exc_info=True)
+            try:
+                self._send_reply(message.sender_phone, "I ran into an unexpected problem and my developers have been notified.")
+            except Exception:
+                logger.exception("Failed to deliver the error reply from the message worker.")
+        finally:
+            finished_at = time.time()
+            with self._stats_lock:
+                if success:
+                    self._stats.processed += 1
+                else:
+                    self._stats.failed += 1
+                self._stats.total_processing_time += finished_at - started_at
+                self._stats.total_queue_wait_time += started_at - message.received_at
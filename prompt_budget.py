@@ -0,0 +1,254 @@
+"""
+Token budgets for the variable-size parts of agent prompts.
+
+Some agent prompts embed a list of the user's own data: the FindingAgent's
+candidate items, the JournalAgent's titles and categories, and the TaskAgent's
+todo tasks. Without a bound, these prompts (and their latency and cost) grow
+with the user's data. A `PromptBudget` caps each list at a number of tokens:
+items are ranked by how well they match the query, long fields are clipped,
+and only the items that fit are sent. Ties keep their original order (newest
+first), and the kept items are returned in that order.
+
+Key Components:
+- `count_tokens`: Estimates the tokens of a prompt fragment.
+- `rank_by_relevance`: Orders items by how many of the query's words they contain.
+- `BudgetStats`: A data class of counters for one agent's budget.
+- `PromptBudget`: The budget of one agent.
+- `PromptBudgets`: The budgets of every agent, by agent name.
+"""
+import logging
+import re
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from rate_limiter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimates the tokens of a prompt fragment.
+
+    Args:
+        text: The text as it will appear in the prompt.
+
+    Returns:
+        The estimated token count, at least 1.
+    """
+    return estimate_tokens(text)
+
+
+def rank_by_relevance(query: str, items: Sequence[Dict[str, Any]], fields: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Orders items by how many of the query's words appear in their fields.
+
+    Args:
+        query: The user's query or filter description.
+        items: The candidate items, in their preferred order (e.g. newest first).
+        fields: The item fields to match against.
+
+    Returns:
+        The items, best match first. Items with the same score keep their order.
+    """
+    words = {word for word in _WORD_PATTERN.findall(query.lower()) if len(word) > 1}
+    if not words:
+        return list(items)
+    fields = tuple(fields)
+
+    def score(item: Dict[str, Any]) -> int:
+        text = ' '.join(str(item.get(field) or '') for field in fields).lower()
+        return sum(1 for word in words if word in text)
+
+    # `sorted` is stable, also with reverse=True, so equal scores keep their order.
+    return sorted(items, key=score, reverse=True)
+
+
+@dataclass
+class BudgetStats:
+    """
+    Counters for one agent's prompt budget.
+
+    Attributes:
+        calls (int): Lists fitted to the budget.
+        truncated_calls (int): Lists that had items dropped.
+        chunked_calls (int): Lists split over several prompts by `chunk`.
+        items_before (int): Items offered, across all calls.
+        items_after (int): Items kept, across all calls.
+        tokens_before (int): Estimated tokens of the offered items.
+        tokens_after (int): Estimated tokens of the kept items.
+    """
+    calls: int = 0
+    truncated_calls: int = 0
+    chunked_calls: int = 0
+    items_before: int = 0
+    items_after: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+
+class PromptBudget:
+    """
+    Caps the lists one agent embeds in its prompts at a number of tokens.
+
+    Attributes:
+        agent_name (str): The agent the budget belongs to, for logging.
+        max_tokens (int): The most tokens a list may take in one prompt.
+        max_field_chars (int): The longest a clipped text field may be.
+    """
+
+    def __init__(self, agent_name: str, max_tokens: int, max_field_chars: int = 200):
+        """
+        Initializes the budget.
+
+        Args:
+            agent_name: The agent the budget belongs to.
+            max_tokens: The most tokens a list may take in one prompt.
+            max_field_chars: The longest a clipped text field may be.
+        """
+        self.agent_name = agent_name
+        self.max_tokens = max_tokens
+        self.max_field_chars = max_field_chars
+        self._stats = BudgetStats()
+        self._lock = threading.Lock()
+
+    def clip(self, item: Dict[str, Any], fields: Iterable[str]) -> Dict[str, Any]:
+        """
+        Returns a copy of an item with long text fields shortened.
+
+        Args:
+            item: The item.
+            fields: The fields to clip to `max_field_chars`.
+        """
+        clipped = dict(item)
+        for field in fields:
+            value = clipped.get(field)
+            if isinstance(value, str) and len(value) > self.max_field_chars:
+                clipped[field] = value[:self.max_field_chars].rstrip() + '…'
+        return clipped
+
+    def fit(self, items: Sequence[Dict[str, Any]], render: Callable[[Dict[str, Any]], str],
+            query: str = "", match_fields: Iterable[str] = ('title',)) -> List[Dict[str, Any]]:
+        """
+        Returns the items that fit the budget, preferring those that match the query.
+
+        Args:
+            items: The candidate items, in their preferred order (e.g. newest first).
+            render: Returns an item as it will appear in the prompt.
+            query: The user's query; matching items are kept first.
+            match_fields: The item fields matched against the query.
+
+        Returns:
+            The kept items, in their original order.
+        """
+        ranked = rank_by_relevance(query, items, match_fields) if query else list(items)
+        kept_ids, used, offered = set(), 0, 0
+        for item in ranked:
+            cost = count_tokens(render(item))
+            offered += cost
+            if used + cost <= self.max_tokens:
+                kept_ids.add(id(item))
+                used += cost
+        kept = [item for item in items if id(item) in kept_ids]
+
+        with self._lock:
+            self._stats.calls += 1
+            self._stats.items_before += len(items)
+            self._stats.items_after += len(kept)
+            self._stats.tokens_before += offered
+            self._stats.tokens_after += used
+            if len(kept) < len(items):
+                self._stats.truncated_calls += 1
+        if len(kept) < len(items):
+            logger.info(f"✂️ {self.agent_name}: kept {len(kept)} of {len(items)} items (~{used} of ~{offered} tokens) to fit its prompt budget.")
+        return kept
+
+    def chunk(self, items: Sequence[Dict[str, Any]], render: Callable[[Dict[str, Any]], str]) -> List[List[Dict[str, Any]]]:
+        """
+        Splits items into consecutive chunks that each fit the budget, dropping none.
+
+        Use this instead of `fit` when every item must be considered, e.g. when
+        a prompt selects the items an operation applies to. An item larger than
+        the budget gets a chunk of its own.
+
+        Args:
+            items: The items, in their preferred order.
+            render: Returns an item as it will appear in the prompt.
+
+        Returns:
+            The chunks, in order. Empty if there are no items.
+        """
+        chunks: List[List[Dict[str, Any]]] = []
+        current: List[Dict[str, Any]] = []
+        used = 0
+        for item in items:
+            cost = count_tokens(render(item))
+            if current and used + cost > self.max_tokens:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(item)
+            used += cost
+        if current:
+            chunks.append(current)
+
+        if len(chunks) > 1:
+            with self._lock:
+                self._stats.chunked_calls += 1
+            logger.info(f"🧩 {self.agent_name}: split {len(items)} items over {len(chunks)} prompts to fit its prompt budget.")
+        return chunks
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the budget's counters.
+
+        Returns:
+            A dictionary of counters plus `max_tokens`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+        stats['max_tokens'] = self.max_tokens
+        return stats
+
+
+class PromptBudgets:
+    """
+    The prompt budgets of every agent, by agent name.
+
+    Attributes:
+        default_tokens (int): The budget of agents without their own.
+    """
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, default_tokens: int = 2000,
+                 max_field_chars: int = 200):
+        """
+        Initializes the budgets.
+
+        Args:
+            budgets: Token budgets by agent name (e.g. "finding_agent").
+            default_tokens: The budget of agents without their own.
+            max_field_chars: The longest a clipped text field may be.
+        """
+        self.default_tokens = default_tokens
+        self._budgets = {
+            name: PromptBudget(name, tokens, max_field_chars)
+            for name, tokens in (budgets or {}).items()
+        }
+        self._max_field_chars = max_field_chars
+        self._lock = threading.Lock()
+
+    def get(self, agent_name: str) -> PromptBudget:
+        """Returns an agent's budget, creating one with the default size on first use."""
+        with self._lock:
+            budget = self._budgets.get(agent_name)
+            if budget is None:
+                budget = self._budgets[agent_name] = PromptBudget(agent_name, self.default_tokens, self._max_field_chars)
+            return budget
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Returns each agent's budget counters, by agent name."""
+        with self._lock:
+            budgets = dict(self._budgets)
+        return {name: budget.get_stats() for name, budget in budgets.items()}
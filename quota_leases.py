@@ -0,0 +1,127 @@
+"""
+In-process leases on users' daily message quota.
+
+With `claim_message_quota` (see `sql/usage_metering_schema.sql`), metering a
+message is one database call. A `QuotaLeases` makes most messages skip even
+that: the first message of a burst claims a small lease of several messages
+at once, and the following messages are counted against the lease in memory.
+
+A lease counts as used in the database as soon as it is claimed, so a user
+may be refused up to `lease_size - 1` messages early when their unused lease
+is lost (it expires, the day changes, or the process exits), and each
+instance holds its own leases. Keep leases small compared to the daily limit.
+
+Key Components:
+- `LeaseStats`: A data class of counters for the leases.
+- `QuotaLeases`: The remaining leased messages of each user.
+"""
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LeaseStats:
+    """
+    Counters for quota leases.
+
+    Attributes:
+        local_hits (int): Messages counted against a lease without a database call.
+        claims (int): Leases claimed from the database.
+        messages_claimed (int): Messages granted by those claims.
+        expired_unused (int): Leased messages that expired or were dropped unused.
+    """
+    local_hits: int = 0
+    claims: int = 0
+    messages_claimed: int = 0
+    expired_unused: int = 0
+
+
+class QuotaLeases:
+    """
+    A thread-safe table of each user's remaining leased messages.
+
+    A lease is only valid on the day it was claimed and for `ttl_seconds`.
+
+    Attributes:
+        lease_size (int): The messages claimed at once.
+        ttl_seconds (float): How long an unused lease stays valid.
+    """
+
+    def __init__(self, lease_size: int = 5, ttl_seconds: float = 300.0):
+        """
+        Initializes an empty table.
+
+        Args:
+            lease_size: The messages claimed at once.
+            ttl_seconds: How long an unused lease stays valid.
+        """
+        self.lease_size = max(1, lease_size)
+        self.ttl_seconds = ttl_seconds
+        # user_id -> (day, remaining messages, expires_at as time.monotonic())
+        self._leases: Dict[str, Tuple[str, int, float]] = {}
+        self._stats = LeaseStats()
+        self._lock = threading.Lock()
+
+    def consume(self, user_id: str, today: str) -> bool:
+        """
+        Counts one message against the user's lease.
+
+        Args:
+            user_id: The user's ID.
+            today: The current day as an ISO date.
+
+        Returns:
+            True if the lease covered the message, False if a claim is needed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leases.get(user_id)
+            if lease is None:
+                return False
+            day, remaining, expires_at = lease
+            if day != today or expires_at <= now:
+                del self._leases[user_id]
+                self._stats.expired_unused += remaining
+                return False
+            if remaining <= 1:
+                del self._leases[user_id]
+            else:
+                self._leases[user_id] = (day, remaining - 1, expires_at)
+            self._stats.local_hits += 1
+            return True
+
+    def grant(self, user_id: str, today: str, granted: int):
+        """
+        Records a claim, of which the current message uses one.
+
+        Args:
+            user_id: The user's ID.
+            today: The day the claim was made for, as an ISO date.
+            granted: The messages the database granted.
+        """
+        with self._lock:
+            self._stats.claims += 1
+            self._stats.messages_claimed += granted
+            if granted > 1:
+                previous = self._leases.get(user_id)
+                if previous is not None:
+                    self._stats.expired_unused += previous[1]
+                self._leases[user_id] = (today, granted - 1, time.monotonic() + self.ttl_seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the lease counters.
+
+        Returns:
+            A dictionary of counters plus `active_leases` and `lease_size`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+            stats['active_leases'] = len(self._leases)
+        stats['lease_size'] = self.lease_size
+        return stats
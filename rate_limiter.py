@@ -0,0 +1,239 @@
+"""
+Per-key request and token rate limiting for Gemini calls.
+
+Gemini enforces requests-per-minute (RPM) and tokens-per-minute (TPM) quotas
+per API key. Instead of every agent sleeping a fixed two seconds before each
+call, one `KeyRateLimiter` is shared by all `ResilientGeminiModel` instances
+(through the `ApiKeyManager`). It keeps a token bucket for each quota of each
+key and delays a call only when that key is actually near its limit.
+
+Calls reserve capacity up front, so concurrent callers queue fairly behind one
+another instead of all waking at once. The token estimate made before a call
+is corrected with the usage Gemini reports afterwards.
+
+Key Components:
+- `TokenBucket`: A continuously refilling bucket that supports reservations.
+- `RateLimiterStats`: A data class of counters for the limiter.
+- `KeyRateLimiter`: RPM and TPM buckets per API key.
+- `estimate_tokens`: A cheap estimate of the tokens in a prompt.
+"""
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Roughly four characters per token for English and Indonesian text.
+CHARS_PER_TOKEN = 4
+
+# Output tokens reserved per call before the real usage is known.
+EXPECTED_OUTPUT_TOKENS = 256
+
+
+def estimate_tokens(contents: Any) -> int:
+    """
+    Estimates the number of input tokens in a `generate_content` payload.
+
+    Args:
+        contents: A prompt string, or a list of strings / parts.
+
+    Returns:
+        The estimated token count, at least 1.
+    """
+    if isinstance(contents, str):
+        characters = len(contents)
+    elif isinstance(contents, (list, tuple)):
+        characters = sum(len(part) if isinstance(part, str) else len(str(part)) for part in contents)
+    else:
+        characters = len(str(contents))
+    return max(1, characters // CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously up to `capacity` per minute.
+
+    `reserve` always takes the tokens, letting the balance go negative, and
+    returns how long the caller must wait until the reservation is covered.
+    This makes the order of waiters fair without a separate queue.
+
+    Attributes:
+        capacity (float): The bucket size, equal to the per-minute limit.
+        rate (float): The refill rate in tokens per second.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Initializes a full bucket.
+
+        Args:
+            per_minute: The limit per minute.
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        """Adds the tokens accrued since the last update."""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """
+        Takes `amount` tokens and returns the seconds to wait before using them.
+
+        Args:
+            amount: The tokens to take. Amounts above capacity are capped.
+            now: The current `time.monotonic()` value.
+        """
+        self._refill(now)
+        self._tokens -= min(amount, self.capacity)
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float, now: float):
+        """
+        Returns (positive) or charges (negative) tokens after the fact.
+
+        Args:
+            amount: The correction in tokens.
+            now: The current `time.monotonic()` value.
+        """
+        self._refill(now)
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+    def available(self, now: float) -> float:
+        """Returns the tokens currently available (negative while reservations are pending)."""
+        self._refill(now)
+        return self._tokens
+
+
+@dataclass
+class RateLimiterStats:
+    """
+    Counters for the rate limiter.
+
+    Attributes:
+        reservations (int): The number of calls that reserved capacity.
+        delayed (int): The number of calls that had to wait.
+        total_wait_seconds (float): The total time callers were asked to wait.
+        estimated_tokens (int): The sum of the pre-call token estimates.
+        reported_tokens (int): The sum of the token counts reported by Gemini.
+    """
+    reservations: int = 0
+    delayed: int = 0
+    total_wait_seconds: float = 0.0
+    estimated_tokens: int = 0
+    reported_tokens: int = 0
+
+
+class KeyRateLimiter:
+    """
+    RPM and TPM token buckets for every API key, shared across all models.
+
+    Attributes:
+        requests_per_minute (int): The RPM quota of each key.
+        tokens_per_minute (int): The TPM quota of each key.
+        max_wait_seconds (float): The longest a single call is delayed. Calls
+            that would have to wait longer proceed after this delay and rely on
+            the model's key rotation if Gemini rejects them.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, max_wait_seconds: float = 10.0):
+        """
+        Initializes the limiter.
+
+        Args:
+            requests_per_minute: The RPM quota of each key.
+            tokens_per_minute: The TPM quota of each key.
+            max_wait_seconds: The longest a single call is delayed.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_wait_seconds = max_wait_seconds
+        self._buckets: Dict[str, Dict[str, TokenBucket]] = {}
+        self._stats = RateLimiterStats()
+        self._lock = threading.Lock()
+
+    def _buckets_for(self, api_key: str) -> Dict[str, TokenBucket]:
+        """Returns a key's buckets, creating them on first use. Must hold the lock."""
+        buckets = self._buckets.get(api_key)
+        if buckets is None:
+            buckets = {
+                'requests': TokenBucket(self.requests_per_minute),
+                'tokens': TokenBucket(self.tokens_per_minute),
+            }
+            self._buckets[api_key] = buckets
+        return buckets
+
+    def reserve(self, api_key: str, estimated_tokens: int) -> float:
+        """
+        Reserves one request and `estimated_tokens` tokens on a key.
+
+        Args:
+            api_key: The key the call will use.
+            estimated_tokens: The estimated input and output tokens of the call.
+
+        Returns:
+            The seconds the caller should wait before making the call (0 if none).
+        """
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._buckets_for(api_key)
+            wait = max(buckets['requests'].reserve(1, now), buckets['tokens'].reserve(estimated_tokens, now))
+            wait = min(wait, self.max_wait_seconds)
+            self._stats.reservations += 1
+            self._stats.estimated_tokens += estimated_tokens
+            if wait > 0:
+                self._stats.delayed += 1
+                self._stats.total_wait_seconds += wait
+        if wait > 0:
+            logger.info(f"🚦 Key ending in ...{api_key[-4:]} is near its quota; delaying the call by {wait:.2f}s.")
+        return wait
+
+    def record_usage(self, api_key: str, estimated_tokens: int, response: Any):
+        """
+        Corrects a reservation with the token count Gemini reported.
+
+        Args:
+            api_key: The key the call used.
+            estimated_tokens: The estimate passed to `reserve`.
+            response: The Gemini response; its `usage_metadata.total_token_count` is used if present.
+        """
+        actual_tokens = self._reported_tokens(response)
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._buckets_for(api_key)['tokens'].adjust(estimated_tokens - actual_tokens, time.monotonic())
+            self._stats.reported_tokens += actual_tokens
+
+    @staticmethod
+    def _reported_tokens(response: Any) -> Optional[int]:
+        """Returns the total token count reported in a response, or None."""
+        usage = getattr(response, 'usage_metadata', None)
+        total = getattr(usage, 'total_token_count', None) if usage is not None else None
+        return total if isinstance(total, int) and total > 0 else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the limiter's counters and each key's remaining capacity.
+
+        Returns:
+            A dictionary of counters plus `keys`, mapping the last four
+            characters of each key to its available requests and tokens.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = asdict(self._stats)
+            stats['keys'] = {
+                f"...{api_key[-4:]}": {
+                    'available_requests': round(buckets['requests'].available(now), 2),
+                    'available_tokens': round(buckets['tokens'].available(now)),
+                }
+                for api_key, buckets in self._buckets.items()
+            }
+        stats['requests_per_minute'] = self.requests_per_minute
+        stats['tokens_per_minute'] = self.tokens_per_minute
+        return stats
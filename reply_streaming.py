@@ -0,0 +1,176 @@
+"""
+Early, chunked delivery of long replies.
+
+A long synthesized answer used to be generated in full before the first
+WhatsApp message was sent. With a `ReplyStream`, the AnsweringAgent streams
+its output from Gemini and the stream splits the text at paragraph
+boundaries, sending each chunk as soon as it is complete. The user sees the
+first paragraph while the rest is still being written.
+
+Key Components:
+- `ParagraphChunker`: Splits streamed text into message-sized chunks at
+  paragraph boundaries.
+- `ReplyStream`: Sends the chunks through a reply function and, once the
+  pipeline has finished, sends whatever part of the final reply has not been
+  delivered yet.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ParagraphChunker:
+    """
+    Accumulates streamed text and cuts it into chunks at paragraph boundaries.
+
+    A chunk is emitted at the first blank line after at least `min_chars`
+    characters, so the first message goes out quickly without sending
+    one-line fragments. Text that grows past `max_chars` without a paragraph
+    break is cut at the last line or sentence break instead.
+
+    Attributes:
+        min_chars (int): The smallest chunk cut at a paragraph boundary.
+        max_chars (int): The largest chunk; longer text is cut at a line or sentence break.
+    """
+
+    def __init__(self, min_chars: int = 200, max_chars: int = 1500):
+        """
+        Initializes an empty chunker.
+
+        Args:
+            min_chars: The smallest chunk cut at a paragraph boundary.
+            max_chars: The largest chunk.
+        """
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        Adds streamed text and returns the chunks it completed.
+
+        Args:
+            text: The next piece of streamed text.
+
+        Returns:
+            The completed chunks, stripped, in order. Often empty.
+        """
+        self._buffer += text
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                return chunks
+            chunk, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip('\n')
+            if chunk:
+                chunks.append(chunk)
+
+    def flush(self) -> Optional[str]:
+        """Returns the remaining text as a final chunk, or None if there is none."""
+        chunk, self._buffer = self._buffer.strip(), ""
+        return chunk or None
+
+    def _find_cut(self) -> Optional[int]:
+        """Returns where the buffer should be cut, or None to wait for more text."""
+        boundary = self._buffer.find('\n\n', self.min_chars)
+        if boundary != -1 and boundary <= self.max_chars:
+            return boundary
+        if len(self._buffer) <= self.max_chars:
+            return None
+        window = self._buffer[:self.max_chars]
+        for separator in ('\n', '. '):
+            position = window.rfind(separator, self.min_chars)
+            if position != -1:
+                return position + len(separator)
+        return self.max_chars
+
+
+class ReplyStream:
+    """
+    Sends a reply to the user in chunks while it is being generated.
+
+    The pipeline writes streamed text with `write` and ends the stream with
+    `flush`. The caller then passes the pipeline's final reply to `finish`,
+    which sends only what has not been delivered: nothing if the whole reply
+    was streamed, the full reply if nothing was (e.g. a templated reply), or
+    the reply as-is if it differs from what was streamed (e.g. an apology
+    after the stream failed midway).
+
+    Attributes:
+        started_at (float): The `time.monotonic()` value when the stream was created.
+        first_chunk_seconds (Optional[float]): The delay before the first chunk was sent.
+    """
+
+    def __init__(self, send: Callable[[str], Any], min_chars: int = 200, max_chars: int = 1500):
+        """
+        Initializes the stream.
+
+        Args:
+            send: The blocking function that delivers one message to the user.
+            min_chars: The smallest chunk cut at a paragraph boundary.
+            max_chars: The largest chunk.
+        """
+        self._send = send
+        self._chunker = ParagraphChunker(min_chars=min_chars, max_chars=max_chars)
+        self._sent: List[str] = []
+        self._lock = threading.Lock()
+        self.started_at = time.monotonic()
+        self.first_chunk_seconds: Optional[float] = None
+
+    @property
+    def chunks_sent(self) -> int:
+        """The number of messages sent so far."""
+        with self._lock:
+            return len(self._sent)
+
+    async def write(self, text: str):
+        """Adds streamed text and sends every chunk it completes."""
+        for chunk in self._chunker.feed(text):
+            await self._send_chunk(chunk)
+
+    async def flush(self):
+        """Sends the text still buffered after the model has finished."""
+        chunk = self._chunker.flush()
+        if chunk:
+            await self._send_chunk(chunk)
+
+    async def _send_chunk(self, chunk: str):
+        """Delivers one chunk without blocking the event loop."""
+        await asyncio.to_thread(self._send, chunk)
+        with self._lock:
+            self._sent.append(chunk)
+            if self.first_chunk_seconds is None:
+                self.first_chunk_seconds = time.monotonic() - self.started_at
+                logger.info(f"📤 Sent the first reply chunk after {self.first_chunk_seconds:.2f}s.")
+
+    def finish(self, final_text: str):
+        """
+        Sends whatever part of the final reply has not been delivered yet.
+
+        Args:
+            final_text: The reply returned by the pipeline.
+        """
+        with self._lock:
+            sent = list(self._sent)
+        if not sent:
+            if final_text:
+                self._send(final_text)
+            return
+
+        final_text = (final_text or "").strip()
+        remainder = final_text
+        for chunk in sent:
+            position = remainder.find(chunk)
+            if position == -1 or remainder[:position].strip():
+                # The final reply is not the streamed text (e.g. an error message); send it as-is.
+                remainder = final_text
+                break
+            remainder = remainder[position + len(chunk):]
+        remainder = remainder.strip()
+        if remainder:
+            self._send(remainder)
+        logger.info(f"📤 Delivered the reply in {len(sent) + (1 if remainder else 0)} message(s).")
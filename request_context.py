@@ -0,0 +1,112 @@
+"""
+Per-message context, fetched once and concurrently.
+
+A message used to trigger several independent Supabase reads one after
+another: the conversation history, the `ai_brain_memories` used as agent
+context, and (inside the AnsweringAgent) the `communication_style` memory.
+This module issues those reads concurrently when a message starts and keeps
+the results in one object that every stage of the pipeline reads from.
+
+Key Components:
+- `RequestContext`: A data class holding everything fetched for one message.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# The number of ai_brain memories included in the agents' user context.
+AI_BRAIN_CONTEXT_LIMIT = 10
+
+
+@dataclass
+class RequestContext:
+    """
+    Everything read from the database once at the start of a message.
+
+    Attributes:
+        user_id (str): The UUID of the user.
+        conversation_history (List[Dict[str, Any]]): Recent turns, oldest first.
+        ai_brain (List[Dict[str, Any]]): The user's most relevant `ai_brain_memories` rows.
+        communication_style (Dict[str, Any]): The `content_json` of the user's
+            `communication_style` memory, or an empty dict if they have none.
+        timezone (str): The user's timezone label.
+        prefetch_seconds (float): The wall-clock time spent on the concurrent reads.
+    """
+    user_id: str
+    conversation_history: List[Dict[str, Any]] = field(default_factory=list)
+    ai_brain: List[Dict[str, Any]] = field(default_factory=list)
+    communication_style: Dict[str, Any] = field(default_factory=dict)
+    timezone: str = 'GMT+7'
+    prefetch_seconds: float = 0.0
+
+    @classmethod
+    async def prefetch(cls, user_id: str, supabase_client: Any, history_manager: Any) -> 'RequestContext':
+        """
+        Issues all per-message reads concurrently and collects the results.
+
+        Each read runs in a worker thread (the Supabase client is synchronous) and
+        failures are isolated: a failed read leaves its field at its default.
+
+        Args:
+            user_id: The UUID of the user.
+            supabase_client: The user's RLS-enabled Supabase client.
+            history_manager: The `DatabaseConversationHistory` for the user.
+
+        Returns:
+            A populated `RequestContext`.
+        """
+        started = time.perf_counter()
+        history, ai_brain, style = await asyncio.gather(
+            asyncio.to_thread(history_manager.get_recent_context),
+            asyncio.to_thread(cls._fetch_ai_brain, supabase_client, user_id),
+            asyncio.to_thread(cls._fetch_communication_style, supabase_client, user_id),
+            return_exceptions=True,
+        )
+
+        context = cls(user_id=user_id)
+        if isinstance(history, BaseException):
+            logger.warning(f"Could not prefetch conversation history: {history}")
+        else:
+            context.conversation_history = history or []
+        if isinstance(ai_brain, BaseException):
+            logger.warning(f"Could not prefetch ai_brain context from database: {ai_brain}")
+        else:
+            context.ai_brain = ai_brain
+        if isinstance(style, BaseException):
+            logger.warning(f"Could not prefetch communication style: {style}")
+        else:
+            context.communication_style = style
+
+        context.prefetch_seconds = time.perf_counter() - started
+        logger.info(f"📥 Prefetched request context for '{user_id}' in {context.prefetch_seconds:.3f}s.")
+        return context
+
+    @staticmethod
+    def _fetch_ai_brain(supabase_client: Any, user_id: str) -> List[Dict[str, Any]]:
+        """Reads the user's ai_brain memories used as agent context."""
+        result = supabase_client.table('ai_brain_memories').select('*').eq('user_id', user_id).limit(AI_BRAIN_CONTEXT_LIMIT).execute()
+        return result.data or []
+
+    @staticmethod
+    def _fetch_communication_style(supabase_client: Any, user_id: str) -> Dict[str, Any]:
+        """Reads the content of the user's communication_style memory."""
+        result = supabase_client.table('ai_brain_memories').select('content_json').eq('user_id', user_id).eq('brain_data_type', 'communication_style').execute()
+        if not result.data:
+            return {}
+        return result.data[0].get('content_json') or {}
+
+    def to_user_context(self) -> Dict[str, Any]:
+        """
+        Returns the `user_context` dictionary passed to the specialist agents.
+
+        Returns:
+            A dictionary with `user_info` (timezone and user ID) and `ai_brain`.
+        """
+        return {
+            'user_info': {'timezone': self.timezone, 'user_id': self.user_id},
+            'ai_brain': self.ai_brain,
+        }
@@ -0,0 +1,63 @@
+-- Server-assigned conversation turns for the conversation_history table
+-- Turn numbers used to be computed by the application (read the highest turn,
+-- insert the next), so two concurrent messages could take the same turn. Each
+-- user's last turn now lives in a counter row that is incremented under its
+-- row lock, and whole batches of history rows are inserted in one call.
+
+CREATE TABLE IF NOT EXISTS conversation_turn_counters (
+    user_id UUID PRIMARY KEY,
+    last_turn INTEGER NOT NULL
+);
+
+-- Only the service role reads and writes the counters.
+ALTER TABLE conversation_turn_counters ENABLE ROW LEVEL SECURITY;
+
+-- Inserts a JSON array of conversation_history rows (each with user_id,
+-- user_input, system_action, entity_data and created_at), giving each the
+-- next turn of its user in array order. Returns the number of rows inserted.
+CREATE OR REPLACE FUNCTION append_conversation_turns(p_rows JSONB)
+RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_row JSONB;
+    v_user_id UUID;
+    v_turn INTEGER;
+    v_count INTEGER := 0;
+BEGIN
+    FOR v_row IN SELECT value FROM jsonb_array_elements(p_rows)
+    LOOP
+        v_user_id := (v_row->>'user_id')::UUID;
+
+        -- The first call for a user continues from the turns already stored.
+        INSERT INTO conversation_turn_counters (user_id, last_turn)
+        VALUES (
+            v_user_id,
+            COALESCE((SELECT MAX(conversation_turn) FROM conversation_history WHERE user_id = v_user_id), 0) + 1
+        )
+        ON CONFLICT (user_id) DO UPDATE
+            SET last_turn = conversation_turn_counters.last_turn + 1
+        RETURNING last_turn INTO v_turn;
+
+        INSERT INTO conversation_history (user_id, user_input, system_action, conversation_turn, entity_data, created_at)
+        VALUES (
+            v_user_id,
+            v_row->>'user_input',
+            v_row->>'system_action',
+            v_turn,
+            COALESCE(v_row->'entity_data', '{}'::JSONB),
+            COALESCE((v_row->>'created_at')::TIMESTAMPTZ, NOW())
+        );
+
+        v_count := v_count + 1;
+    END LOOP;
+
+    RETURN v_count;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION append_conversation_turns FROM PUBLIC, anon, authenticated;
+
+COMMENT ON TABLE conversation_turn_counters IS 'The last conversation turn assigned to each user.';
+COMMENT ON FUNCTION append_conversation_turns IS 'Inserts a batch of conversation_history rows with server-assigned, per-user turn numbers.';
@@ -0,0 +1,56 @@
+-- Schema for the gemini_key_health table
+-- Shared Gemini API key health, so every serverless instance knows which keys
+-- are cooling down or broken. Keys are stored as SHA-256 hashes only.
+CREATE TABLE gemini_key_health (
+    key_hash TEXT PRIMARY KEY,
+    cooldown_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+    quota_errors INTEGER NOT NULL DEFAULT 0,
+    is_broken BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at DOUBLE PRECISION NOT NULL DEFAULT 0,
+    requests BIGINT NOT NULL DEFAULT 0,
+    failures BIGINT NOT NULL DEFAULT 0
+);
+
+-- Only the service role reads and writes key health.
+ALTER TABLE gemini_key_health ENABLE ROW LEVEL SECURITY;
+
+-- Adds usage counters atomically and, if requested, replaces the key's state.
+CREATE OR REPLACE FUNCTION record_gemini_key_health(
+    p_key_hash TEXT,
+    p_requests BIGINT,
+    p_failures BIGINT,
+    p_update_state BOOLEAN,
+    p_cooldown_until DOUBLE PRECISION,
+    p_quota_errors INTEGER,
+    p_is_broken BOOLEAN,
+    p_updated_at DOUBLE PRECISION
+) RETURNS VOID
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    INSERT INTO gemini_key_health (key_hash, requests, failures)
+    VALUES (p_key_hash, p_requests, p_failures)
+    ON CONFLICT (key_hash) DO UPDATE
+        SET requests = gemini_key_health.requests + EXCLUDED.requests,
+            failures = gemini_key_health.failures + EXCLUDED.failures;
+
+    IF p_update_state THEN
+        UPDATE gemini_key_health
+        SET cooldown_until = p_cooldown_until,
+            quota_errors = p_quota_errors,
+            is_broken = p_is_broken,
+            updated_at = p_updated_at
+        WHERE key_hash = p_key_hash;
+    END IF;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION record_gemini_key_health FROM PUBLIC, anon, authenticated;
+
+-- Add comments to explain the table and columns
+COMMENT ON TABLE gemini_key_health IS 'Health of each Gemini API key, shared by all application instances.';
+COMMENT ON COLUMN gemini_key_health.key_hash IS 'The first 32 hex characters of the SHA-256 digest of the API key.';
+COMMENT ON COLUMN gemini_key_health.cooldown_until IS 'Unix time until which the key should not be used after a quota error.';
+COMMENT ON COLUMN gemini_key_health.quota_errors IS 'Consecutive quota errors since the key last succeeded.';
+COMMENT ON COLUMN gemini_key_health.updated_at IS 'Unix time the state columns were last written.';
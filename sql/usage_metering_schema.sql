@@ -0,0 +1,55 @@
+-- Atomic daily message metering for the user_whatsapp table
+-- Replaces the read-then-update in database.check_and_update_usage with one
+-- call that locks the user's row, resets the counter on a new day, and
+-- grants as many of the requested messages as the limit allows. Two
+-- concurrent messages can no longer both pass a limit that has room for one.
+
+-- Claims up to p_amount messages of the user's daily quota and returns how
+-- many were granted (0 means the limit is reached). p_today is the caller's
+-- date, so the day boundary matches the application's clock.
+CREATE OR REPLACE FUNCTION claim_message_quota(
+    p_user_id UUID,
+    p_limit INTEGER,
+    p_today DATE,
+    p_amount INTEGER DEFAULT 1
+) RETURNS INTEGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_count INTEGER;
+    v_last DATE;
+    v_granted INTEGER;
+BEGIN
+    SELECT COALESCE(daily_message_count, 0), last_message_date::DATE
+    INTO v_count, v_last
+    FROM user_whatsapp
+    WHERE user_id = p_user_id
+    FOR UPDATE;
+
+    -- Like the previous check, a user without a usage row is not metered.
+    IF NOT FOUND THEN
+        RETURN p_amount;
+    END IF;
+
+    IF v_last IS DISTINCT FROM p_today THEN
+        v_count := 0;
+    END IF;
+
+    v_granted := LEAST(p_amount, GREATEST(p_limit - v_count, 0));
+
+    IF v_granted > 0 OR v_last IS DISTINCT FROM p_today THEN
+        UPDATE user_whatsapp
+        SET daily_message_count = v_count + v_granted,
+            last_message_date = p_today
+        WHERE user_id = p_user_id;
+    END IF;
+
+    RETURN v_granted;
+END;
+$$;
+
+-- Only the service role meters usage.
+REVOKE EXECUTE ON FUNCTION claim_message_quota FROM PUBLIC, anon, authenticated;
+
+COMMENT ON FUNCTION claim_message_quota IS 'Atomically resets or increments a user''s daily message count and returns the number of messages granted.';
@@ -10,18 +10,23 @@ standard safety guidelines to every response.
 
 Key Responsibilities:
 - Consolidate outputs from single or multiple specialist agents.
+- Render simple single-agent outcomes from deterministic templates, skipping
+  the LLM call when the user's communication style allows it.
 - Fetch and apply user-specific communication styles from the database.
 - Convert UTC timestamps to the user's local timezone.
-- Generate a final, coherent, and safe response for the user.
+- Generate a final, coherent, and safe response for the user, optionally
+  streaming it to the user paragraph by paragraph as it is generated.
 - Format error messages and clarification requests.
 """
 
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import re
 from datetime import datetime, timezone, timedelta
 
+from .response_templates import ResponseTemplateRenderer
+
 logger = logging.getLogger(__name__)
 
 class AnsweringAgent:
@@ -37,19 +42,24 @@ class AnsweringAgent:
         supabase: The Supabase client for database interactions.
         default_timezone_offset (int): The default timezone offset to use if
                                        the user's timezone is not available.
+        template_renderer (Optional[ResponseTemplateRenderer]): Renders simple
+            outcomes without the AI model, or None to always use the AI model.
     """
     
-    def __init__(self, ai_model, supabase=None):
+    def __init__(self, ai_model, supabase=None, use_templates: bool = True):
         """
         Initializes the AnsweringAgent.
 
         Args:
             ai_model: An instance of a generative AI model.
             supabase: An optional Supabase client instance.
+            use_templates: If True, simple single-agent outcomes are rendered
+                           from templates instead of calling the AI model.
         """
         self.ai_model = ai_model
         self.supabase = supabase
         self.default_timezone_offset = 7  # GMT+7 (Jakarta)
+        self.template_renderer = ResponseTemplateRenderer() if use_templates else None
         logger.info("🤖 AnsweringAgent initialized")
     
     # --- NEW METHOD: process_multi_response ---
@@ -63,17 +73,58 @@ class AnsweringAgent:
 
         Args:
             context: A dictionary containing the results of the execution, including
-                     'agent_responses', 'original_command', and 'user_context'.
+                     'agent_responses', 'original_command', and 'user_context'. An
+                     optional 'communication_style' holds the prefetched style memory,
+                     saving a database read.
 
         Returns:
             A single, coherent, user-friendly response string.
         """
         logger.info("📝 AnsweringAgent processing multi-response with direct JSON injection...")
         
+        direct_response, information = self._prepare_multi_response(context)
+        if direct_response is not None:
+            return direct_response
+
+        # Now, use the standard processing pipeline with this consolidated data.
+        return self.process_response(information, communication_style=context.get("communication_style"))
+
+    async def process_multi_response_async(self, context: Dict[str, Any], reply_stream: Optional[Any] = None) -> str:
+        """
+        Awaitable version of `process_multi_response` that does not block the event loop.
+
+        Args:
+            context: The same execution context as `process_multi_response`.
+            reply_stream: An optional `ReplyStream`. AI-synthesized replies are
+                          streamed to it; direct and templated replies are only returned.
+
+        Returns:
+            A single, coherent, user-friendly response string.
+        """
+        logger.info("📝 AnsweringAgent processing multi-response with direct JSON injection...")
+
+        direct_response, information = self._prepare_multi_response(context)
+        if direct_response is not None:
+            return direct_response
+
+        return await self.process_response_async(information, communication_style=context.get("communication_style"),
+                                                 reply_stream=reply_stream)
+
+    def _prepare_multi_response(self, context: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        """
+        Returns either a reply that needs no AI call, or the consolidated information to synthesize.
+
+        Returns:
+            A `(direct_response, information)` tuple where exactly one item is not None.
+        """
         agent_responses = context.get('agent_responses', [])
         
         if not agent_responses:
-            return "I've processed your request, but there's nothing specific to report back."
+            return "I've processed your request, but there's nothing specific to report back.", None
+
+        templated_response = self._render_from_template(context)
+        if templated_response:
+            return templated_response, None
 
         # CONSOLIDATE ALWAYS, REMOVING THE BUGGY `if len == 1` check.
         consolidated_info = {
@@ -83,14 +134,13 @@ class AnsweringAgent:
             "raw_agent_responses": agent_responses # Optional, but good for debugging
         }
 
-        # Now, use the standard processing pipeline with this consolidated data.
-        return self.process_response({
+        return None, {
             "source": "MultiAgentExecution",
             "message": "Synthesize the following outcomes into a single, user-friendly summary.",
             "processing_context": consolidated_info,
             "user_context": context.get("user_context")
 
-        })
+        }
 
     # --- NEW METHOD: process_error ---
     def process_error(self, error_message: str) -> str:
@@ -111,7 +161,7 @@ class AnsweringAgent:
         # For reliability, a static message is often safer.
         return "I seem to have run into an unexpected problem. My developers have been notified and are looking into it."
 
-    def process_response(self, information: Dict[str, Any]) -> str:
+    def process_response(self, information: Dict[str, Any], communication_style: Optional[Dict[str, Any]] = None) -> str:
         """
         Processes information and generates the final user response.
 
@@ -122,41 +172,101 @@ class AnsweringAgent:
         Args:
             information: A dictionary containing the context and data to be
                          synthesized into a response.
+            communication_style: The prefetched `communication_style` memory
+                                 (empty if the user has none). If None, it is
+                                 fetched from the database.
 
         Returns:
             The final, formatted response string for the user.
         """
         try:
-            logger.info("📝 AnsweringAgent processing information with direct JSON injection...")
-            user_context = information.get('user_context', {})            
-            user_info = user_context.get('user_info', {}) 
-            user_id = user_info.get('user_id', 'unknown')
-            if user_id == 'unknown':
-                logger.warning("CRITICAL: user_id is 'unknown' in AnsweringAgent.")
-            
-            user_timezone_info = self._extract_timezone_info(user_context)
-            timezone_string = user_timezone_info.get('timezone', 'GMT+7')
-
-            comm_preferences = self._get_communication_preferences(user_id)
-            
-            # Use the entire information dictionary as the context for the AI
-            info_text = json.dumps(information, indent=2, ensure_ascii=False, default=str)
-            info_text = self._convert_utc_to_user_timezone(info_text, user_timezone_info)
-            
-            prompt = self._build_standard_prompt(comm_preferences, timezone_string, info_text)
+            prompt = self._build_response_prompt(information, communication_style)
             
             logger.info("🤖 Generating final response using AI with direct injection prompt...")
             response = self.ai_model.generate_content(prompt)
-            
-            formatted_response = response.text.strip() if hasattr(response, 'text') else str(response).strip()
-            
-            logger.info("✅ AnsweringAgent generated response with direct JSON injection.")
-            return formatted_response
+            return self._finish_response(response)
             
         except Exception as e:
-            logger.error(f"❌ Error in AnsweringAgent process_response: {e}", exc_info=True)
-            fallback_message = information.get('message', 'your request could not be completed.')
-            return f"I apologize, there was an error processing your request. Here's a summary: {fallback_message}"
+            return self._response_error_fallback(information, e)
+
+    async def process_response_async(self, information: Dict[str, Any], communication_style: Optional[Dict[str, Any]] = None,
+                                     reply_stream: Optional[Any] = None) -> str:
+        """
+        Awaitable version of `process_response` that does not block the event loop.
+
+        Args:
+            information: A dictionary containing the context and data to be
+                         synthesized into a response.
+            communication_style: The prefetched `communication_style` memory
+                                 (empty if the user has none). If None, it is
+                                 fetched from the database.
+            reply_stream: An optional `ReplyStream`. If given, and the model
+                          supports streaming, each paragraph is sent to the
+                          user as soon as it has been generated.
+
+        Returns:
+            The final, formatted response string for the user, including any
+            part that was already streamed.
+        """
+        try:
+            prompt = self._build_response_prompt(information, communication_style)
+
+            if reply_stream is not None and hasattr(self.ai_model, 'generate_content_stream_async'):
+                return await self._stream_response(prompt, reply_stream)
+
+            logger.info("🤖 Generating final response using AI with direct injection prompt...")
+            response = await self.ai_model.generate_content_async(prompt)
+            return self._finish_response(response)
+
+        except Exception as e:
+            return self._response_error_fallback(information, e)
+
+    def _build_response_prompt(self, information: Dict[str, Any], communication_style: Optional[Dict[str, Any]]) -> str:
+        """Resolves the user's preferences and timezone and builds the synthesis prompt."""
+        logger.info("📝 AnsweringAgent processing information with direct JSON injection...")
+        user_context = information.get('user_context', {})            
+        user_info = user_context.get('user_info', {}) 
+        user_id = user_info.get('user_id', 'unknown')
+        if user_id == 'unknown':
+            logger.warning("CRITICAL: user_id is 'unknown' in AnsweringAgent.")
+        
+        user_timezone_info = self._extract_timezone_info(user_context)
+        timezone_string = user_timezone_info.get('timezone', 'GMT+7')
+
+        comm_preferences = self._get_communication_preferences(user_id, communication_style)
+        
+        # Use the entire information dictionary as the context for the AI
+        info_text = json.dumps(information, indent=2, ensure_ascii=False, default=str)
+        info_text = self._convert_utc_to_user_timezone(info_text, user_timezone_info)
+        
+        return self._build_standard_prompt(comm_preferences, timezone_string, info_text)
+
+    async def _stream_response(self, prompt: str, reply_stream: Any) -> str:
+        """Streams the reply into `reply_stream` and returns the full text."""
+        logger.info("🤖 Streaming final response using AI with direct injection prompt...")
+        parts = []
+        async for piece in self.ai_model.generate_content_stream_async(prompt):
+            parts.append(piece)
+            await reply_stream.write(piece)
+        await reply_stream.flush()
+
+        logger.info(f"✅ AnsweringAgent streamed response in {reply_stream.chunks_sent} chunk(s).")
+        return "".join(parts).strip()
+
+    @staticmethod
+    def _finish_response(response: Any) -> str:
+        """Extracts the reply text from a model response."""
+        formatted_response = response.text.strip() if hasattr(response, 'text') else str(response).strip()
+        
+        logger.info("✅ AnsweringAgent generated response with direct JSON injection.")
+        return formatted_response
+
+    @staticmethod
+    def _response_error_fallback(information: Dict[str, Any], error: Exception) -> str:
+        """Logs a synthesis failure and returns a safe summary for the user."""
+        logger.error(f"❌ Error in AnsweringAgent process_response: {error}", exc_info=True)
+        fallback_message = information.get('message', 'your request could not be completed.')
+        return f"I apologize, there was an error processing your request. Here's a summary: {fallback_message}"
 
     def process_context_clarification(self, clarification_request: str) -> str:
         """
@@ -170,7 +280,37 @@ class AnsweringAgent:
         """
         return f"I need a bit more information. Could you please clarify what you mean by '{clarification_request}'? 🤔"
 
-    # --- PRIVATE HELPER METHODS (Unchanged) ---
+    # --- PRIVATE HELPER METHODS ---
+
+    def _render_from_template(self, context: Dict[str, Any]) -> Optional[str]:
+        """
+        Renders a deterministic reply for a simple single-agent outcome.
+
+        Args:
+            context: The same context dictionary passed to `process_multi_response`.
+
+        Returns:
+            The reply with times in the user's timezone, or None if the outcome
+            (or the user's communication style) requires AI synthesis.
+        """
+        if self.template_renderer is None:
+            return None
+        try:
+            user_context = context.get('user_context') or {}
+            user_id = user_context.get('user_info', {}).get('user_id', 'unknown')
+            style = context.get('communication_style')
+            if style is None:
+                style = self._fetch_communication_style(user_id)
+            rendered = self.template_renderer.render(
+                context.get('agent_responses', []), context.get('execution_result'), style
+            )
+            if rendered is None:
+                return None
+            return self._convert_utc_to_user_timezone(rendered, self._extract_timezone_info(user_context))
+        except Exception as e:
+            logger.warning(f"Template rendering failed; using AI synthesis instead: {e}")
+            return None
+
 
     def _convert_utc_to_user_timezone(self, text_content: str, user_timezone_info: dict) -> str:
         """
@@ -208,28 +348,22 @@ class AnsweringAgent:
         
         return re.sub(utc_pattern, convert_match, text_content)
 
-    def _get_communication_preferences(self, user_id: str) -> Dict[str, str]:
+    def _get_communication_preferences(self, user_id: str, prefetched_style: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
         """
-        Fetches communication style preferences from the database.
+        Builds the communication style instructions, fetching the style from the
+        database unless it was prefetched.
 
         Args:
             user_id: The UUID of the user.
+            prefetched_style: The already-fetched style memory, or None to query it.
 
         Returns:
             A dictionary containing the response style and safety guidelines.
         """
         try:
-            if not self.supabase:
-                raise ConnectionError("Supabase client not configured.")
-
-            result = self.supabase.table('ai_brain_memories').select('content_json').eq('user_id', user_id).eq('brain_data_type', 'communication_style').execute()
-            
-            if not result.data:
-                raise ValueError(f"No communication preferences found for user {user_id}.")
-
-            content_json = result.data[0].get('content_json')
+            content_json = prefetched_style if prefetched_style is not None else self._fetch_communication_style(user_id)
             if not content_json:
-                raise ValueError("Database record is missing the 'content_json' field.")
+                raise ValueError(f"No communication preferences found for user {user_id}.")
 
             preferences_json_string = json.dumps(content_json, indent=2)
             
@@ -248,6 +382,27 @@ class AnsweringAgent:
             logger.error(f"Could not get valid communication preferences due to '{e}'. Using emergency fallback.")
             return self._get_emergency_fallback_preferences()
 
+    def _fetch_communication_style(self, user_id: str) -> Dict[str, Any]:
+        """
+        Fetches the raw `communication_style` memory for a user.
+
+        Args:
+            user_id: The UUID of the user.
+
+        Returns:
+            The memory's `content_json`, or an empty dictionary if the user has none.
+
+        Raises:
+            ConnectionError: If no Supabase client is configured.
+        """
+        if not self.supabase:
+            raise ConnectionError("Supabase client not configured.")
+
+        result = self.supabase.table('ai_brain_memories').select('content_json').eq('user_id', user_id).eq('brain_data_type', 'communication_style').execute()
+        if not result.data:
+            return {}
+        return result.data[0].get('content_json') or {}
+
     def _get_standard_safety_guidelines(self) -> str:
         """Returns the standardized safety guidelines for all AI prompts."""
         return (
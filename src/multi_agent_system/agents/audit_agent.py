@@ -1,6 +1,10 @@
 import json
+import logging
+from functools import cached_property
 from typing import Dict, Any
 
+logger = logging.getLogger(__name__)
+
 # ======================================================================================
 # ==  PROMPT BUILDER: The tool that constructs the agent's instructions for the AI  ==
 # ======================================================================================
@@ -50,6 +54,8 @@ You are a world-class AI Master Router and Intelligent Planner. Your function is
 4.  **VERBATIM COMMAND INTEGRITY:** You MUST pass the user's exact wording to the specialist agent in the `clarified_command` field. Do not rephrase, summarize, or extract parameters. The specialist agent is the expert.
 
 5.  **PRODUCE A SUGGESTION (Justify Your Routing):** For every sub-task, you MUST provide a high-level `suggestion` that explains *why* you chose that specific agent based on your goal analysis.
+
+6.  **MARK DEPENDENCIES:** Sub-tasks run in parallel unless told otherwise. Set `depends_on_previous` to `true` ONLY when a sub-task needs the result of the sub-task directly before it (e.g., "find my notes on the proposal and then add a task to review them"). Otherwise set it to `false`.
 """
 
     def _get_agent_roster(self) -> str:
@@ -78,7 +84,8 @@ You are a world-class AI Master Router and Intelligent Planner. Your function is
     {
       "route_to": "SelectedAgentName",
       "suggestion": "(Suggestion: I am routing this because...)",
-      "clarified_command": "The original, verbatim segment of the user's command for this agent."
+      "clarified_command": "The original, verbatim segment of the user's command for this agent.",
+      "depends_on_previous": false
     }
   ]
 }
@@ -86,7 +93,7 @@ You are a world-class AI Master Router and Intelligent Planner. Your function is
 """
 
     def _get_examples(self) -> str:
-        """Provides expert examples demonstrating the 5 core rules."""
+        """Provides expert examples demonstrating the core rules."""
         return """
 ### **EXPERT EXAMPLES**
 
@@ -145,27 +152,51 @@ JSON Output:
 ```json
 { "sub_tasks": [{"route_to": "GuideAgent", "suggestion": "(Suggestion: I'm routing this to the GuideAgent because the user is asking for help.)", "clarified_command": "get help on how to use the app"}]}
 ```
+
+**Example 9: Marking a DEPENDENT Sub-task**
+Resolved Command: "find my notes on the Q3 proposal and then add a task to review them"
+JSON Output:
+```json
+{ "sub_tasks": [{"route_to": "FindingAgent", "suggestion": "(Suggestion: I'm routing the first part to the FindingAgent to search your notes.)", "clarified_command": "find my notes on the Q3 proposal", "depends_on_previous": false}, {"route_to": "TaskAgent", "suggestion": "(Suggestion: I'm routing the second part to the TaskAgent; it relies on the notes found first.)", "clarified_command": "add a task to review them", "depends_on_previous": true}]}
+```
 """
 
-    def build(self, resolved_command: str, conversation_history: list = None) -> str:
-        """Assembles the complete Audit & Planning prompt."""
+    @cached_property
+    def static_prefix(self) -> str:
+        """
+        The instructions, roster, response format and examples, built once.
+
+        They never change between calls, so they form the start of every
+        prompt; only the history and the command follow them.
+        """
         prompt_parts = [
             self._get_header(),
-            self._get_conversation_history_section(conversation_history or []),
             self._get_core_mission_and_rules(),
             self._get_agent_roster(),
             self._get_response_format(),
             "---",
+            self._get_examples(),
+            "---",
+        ]
+
+        return "\n".join(prompt_parts)
+
+    def build_dynamic_suffix(self, resolved_command: str, conversation_history: list = None) -> str:
+        """Assembles the per-call part of the prompt: the history, the command and the final instruction."""
+        prompt_parts = [
+            self._get_conversation_history_section(conversation_history or []),
             "### **CLARIFIED COMMAND TO BE PLANNED**",
             f'"{resolved_command}"',
             "---",
-            self._get_examples(),
-            "---",
-            "Now, create the execution plan based on the 5 core rules. Provide a suggestion for each routing decision. Respond with NOTHING but the JSON object."
+            "Now, create the execution plan based on the 6 core rules. Provide a suggestion for each routing decision. Respond with NOTHING but the JSON object."
         ]
-        
+
         return "\n".join(prompt_parts)
 
+    def build(self, resolved_command: str, conversation_history: list = None) -> str:
+        """Assembles the complete Audit & Planning prompt: the static prefix, then the per-call suffix."""
+        return f"{self.static_prefix}\n{self.build_dynamic_suffix(resolved_command, conversation_history)}"
+
 
 # ======================================================================================
 # == AUDIT AGENT: The class that uses the builder and the AI model to create plans ==
@@ -183,6 +214,10 @@ class AuditAgent:
         
         self.ai_model = ai_model
         self.prompt_builder = AuditPlannerPromptBuilder()
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(self.prompt_builder.static_prefix)
 
     def create_execution_plan(self, resolved_command: str, conversation_history: list = None) -> Dict[str, Any]:
         """
@@ -199,16 +234,39 @@ class AuditAgent:
         
         try:
             response = self.ai_model.generate_content(prompt_string)
-            cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-            
-            plan = json.loads(cleaned_response_text)
-            
-            if 'sub_tasks' not in plan or not isinstance(plan['sub_tasks'], list):
-                # Using print for debugging in case logging isn't set up
-                print(f"ERROR: AuditAgent produced malformed plan. Output: {plan}")
-                return {"sub_tasks": []}
-            return plan
+            return self._parse_plan(response)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            logger.error(f"❌ AuditAgent failed to parse AI response. Error: {e}")
+            return {"sub_tasks": []}
+
+    async def create_execution_plan_async(self, resolved_command: str, conversation_history: list = None) -> Dict[str, Any]:
+        """
+        Awaitable version of `create_execution_plan` that does not block the event loop.
+
+        Args:
+            resolved_command: A clean, unambiguous command from the ContextResolutionAgent.
+            conversation_history: A list of recent conversation turns for context.
+
+        Returns:
+            The same plan dictionary as `create_execution_plan`.
+        """
+        prompt_string = self.prompt_builder.build(resolved_command, conversation_history)
 
+        try:
+            response = await self.ai_model.generate_content_async(prompt_string)
+            return self._parse_plan(response)
         except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
-            print(f"ERROR: AuditAgent failed to parse AI response. Error: {e}")
-            return {"sub_tasks": []}
\ No newline at end of file
+            logger.error(f"❌ AuditAgent failed to parse AI response. Error: {e}")
+            return {"sub_tasks": []}
+
+    @staticmethod
+    def _parse_plan(response: Any) -> Dict[str, Any]:
+        """Parses and checks the AI's plan, returning an empty plan if it is malformed."""
+        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+        
+        plan = json.loads(cleaned_response_text)
+        
+        if 'sub_tasks' not in plan or not isinstance(plan['sub_tasks'], list):
+            logger.warning(f"⚠️ AuditAgent produced malformed plan. Output: {plan}")
+            return {"sub_tasks": []}
+        return plan
@@ -10,7 +10,6 @@ CORE PURPOSE:
 
 import json
 import logging
-import time
 from typing import Dict, Any, Optional
 
 # We assume ai_tools is available for fetching memories.
@@ -24,8 +23,6 @@ class BrainAgent:
     def __init__(self, ai_model=None, api_key_manager=None):
         self.ai_model = ai_model
         self.api_key_manager = api_key_manager
-        self.last_api_call = 0
-        self.rate_limit_seconds = 2
 
     def process_command(self, user_command: str, user_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -65,12 +62,6 @@ class BrainAgent:
             logger.error("AI model is not available for the BrainAgent.")
             return None
         try:
-            # Enforce rate limit
-            time_since_call = time.time() - self.last_api_call
-            if time_since_call < self.rate_limit_seconds:
-                time.sleep(self.rate_limit_seconds - time_since_call)
-            self.last_api_call = time.time()
-            
             response = self.ai_model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
@@ -0,0 +1,248 @@
+import json
+import logging
+from functools import cached_property
+from typing import List, Dict, Any, Optional
+
+from .context_resolution_agent import ContextResolverPromptBuilder
+from .audit_agent import AuditPlannerPromptBuilder
+
+logger = logging.getLogger(__name__)
+
+# The agent names the orchestrator can route to. Must match the AuditAgent roster.
+ROUTABLE_AGENTS = frozenset({
+    "TaskAgent", "ScheduleAgent", "JournalAgent", "FinancialAgent", "FindingAgent",
+    "BrainAgent", "GeneralFallback", "TechSupportAgent", "GuideAgent",
+})
+
+# ======================================================================================
+# ==  PROMPT BUILDER: Fuses the context-resolution and planning instructions         ==
+# ======================================================================================
+
+class ContextPlanningPromptBuilder:
+    """
+    Constructs a single prompt that resolves the user's command AND plans its
+    routing in one pass.
+
+    It reuses the rule, roster and example sections of the
+    `ContextResolverPromptBuilder` and `AuditPlannerPromptBuilder`, so the fused
+    stage always follows the same rules as the two-call path.
+    """
+
+    def __init__(self):
+        self.context_builder = ContextResolverPromptBuilder()
+        self.audit_builder = AuditPlannerPromptBuilder()
+
+    def _get_header(self) -> str:
+        """Returns the introductory part of the prompt, describing the two-step job."""
+        return """
+You are a Context Clarification Agent AND a Master Router for a personal productivity app. You do two jobs in order, in a single response:
+
+**STEP 1 - RESOLVE:** Turn the user's messy, conversational message into a single, unambiguous, self-contained `resolved_command`, following the Context Clarification rules.
+**STEP 2 - PLAN:** Split or group that `resolved_command` into `sub_tasks` routed to the correct specialist agents, following the Routing rules.
+
+🌍 **LANGUAGE EXPERTISE**: You are a master of English, Indonesian/Bahasa, and Spanish, including all forms of slang, colloquialisms, and mixed-language use.
+"""
+
+    def _get_response_format(self) -> str:
+        """Returns the fused JSON response format."""
+        return """
+### **RESPONSE FORMAT (JSON ONLY)**
+You MUST respond with ONLY a single JSON object.
+
+**If the command is clear and valid:**
+```json
+{
+  "status": "SUCCESS",
+  "resolved_command": "Your final, clarified, and synthesized command goes here.",
+  "sub_tasks": [
+    {
+      "route_to": "SelectedAgentName",
+      "suggestion": "(Suggestion: I am routing this because...)",
+      "clarified_command": "The verbatim segment of the resolved_command for this agent.",
+      "depends_on_previous": false
+    }
+  ]
+}
+```
+
+**If the command is invalid or ambiguous (no sub_tasks needed):**
+```json
+{
+  "status": "NEEDS_CLARIFICATION",
+  "reason": "Explain why the command is invalid (e.g., The reminder has no specific object)."
+}
+```
+"""
+
+    @cached_property
+    def static_prefix(self) -> str:
+        """
+        The fused instructions, roster, response format and examples, built once.
+
+        They never change between calls, so they form the start of every
+        prompt; only the history and the command follow them.
+        """
+        prompt_parts = [
+            self._get_header(),
+            "## STEP 1 - CONTEXT CLARIFICATION RULES",
+            self.context_builder._get_core_mission_and_rules(),
+            "## STEP 2 - ROUTING RULES",
+            self.audit_builder._get_core_mission_and_rules(),
+            self.audit_builder._get_agent_roster(),
+            self._get_response_format(),
+            "---",
+            "## STEP 1 EXAMPLES (resolving the command)",
+            self.context_builder._get_examples(),
+            "## STEP 2 EXAMPLES (planning the resolved command)",
+            self.audit_builder._get_examples(),
+            "---",
+        ]
+
+        return "\n".join(prompt_parts)
+
+    def build_dynamic_suffix(self, user_command: str, conversation_history: str) -> str:
+        """Assembles the per-call part of the prompt: the history, the command and the final instruction."""
+        prompt_parts = [
+            "### CONVERSATION HISTORY (Your Context Source)",
+            conversation_history if conversation_history else "No conversation history available.",
+            "---",
+            "### CURRENT USER COMMAND (To Be Resolved and Planned)",
+            f'"{user_command}"',
+            "---",
+            "Now, resolve the command using its history, then plan the resolved command. Respond with NOTHING but the JSON object."
+        ]
+
+        return "\n".join(prompt_parts)
+
+    def build(self, user_command: str, conversation_history: str) -> str:
+        """Assembles the complete fused prompt: the static prefix, then the per-call suffix."""
+        return f"{self.static_prefix}\n{self.build_dynamic_suffix(user_command, conversation_history)}"
+
+
+# ======================================================================================
+# == CONTEXT PLANNING AGENT: One Gemini round trip for resolution + planning         ==
+# ======================================================================================
+
+class ContextPlanningAgent:
+    """
+    Resolves the user's command and creates the execution plan in a single AI
+    call, replacing back-to-back calls to the ContextResolutionAgent and the
+    AuditAgent.
+
+    The output is validated strictly. Anything the orchestrator could not use
+    as-is makes `resolve_and_plan` return None, and the orchestrator falls back
+    to the two-call path.
+    """
+
+    def __init__(self, ai_model: Any):
+        """
+        Initializes the agent.
+
+        Args:
+            ai_model: A pre-configured AI model instance configured for JSON output.
+        """
+        if not ai_model:
+            raise ValueError("An AI model instance must be provided to the ContextPlanningAgent.")
+
+        self.ai_model = ai_model
+        self.prompt_builder = ContextPlanningPromptBuilder()
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(self.prompt_builder.static_prefix)
+
+    def resolve_and_plan(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Resolves and plans the user's command in one AI call.
+
+        Args:
+            user_command: The raw string command from the user.
+            conversation_history: A list of conversation turn dictionaries from the history manager.
+
+        Returns:
+            A dictionary with a 'status' and either a 'resolved_command' plus
+            'sub_tasks', or a 'reason'. Returns None if the AI response fails
+            validation, in which case the caller should use the two-call path.
+        """
+        prompt_string = self._build_prompt(user_command, conversation_history)
+
+        try:
+            response = self.ai_model.generate_content(prompt_string)
+        except Exception as e:
+            logger.warning(f"ContextPlanningAgent AI call failed; falling back to two calls. Error: {e}")
+            return None
+        return self._parse_and_validate(response)
+
+    async def resolve_and_plan_async(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Awaitable version of `resolve_and_plan` that does not block the event loop.
+
+        Args:
+            user_command: The raw string command from the user.
+            conversation_history: A list of conversation turn dictionaries from the history manager.
+
+        Returns:
+            The same result as `resolve_and_plan`, or None to use the two-call path.
+        """
+        prompt_string = self._build_prompt(user_command, conversation_history)
+
+        try:
+            response = await self.ai_model.generate_content_async(prompt_string)
+        except Exception as e:
+            logger.warning(f"ContextPlanningAgent AI call failed; falling back to two calls. Error: {e}")
+            return None
+        return self._parse_and_validate(response)
+
+    def _build_prompt(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> str:
+        """Builds the fused prompt from the command and the structured history."""
+        history_str = "\n".join([
+            f"USER: {turn.get('user_input', '')}\nASSISTANT: {turn.get('response', '')}"
+            for turn in conversation_history
+        ])
+        return self.prompt_builder.build(user_command, history_str)
+
+    def _parse_and_validate(self, response: Any) -> Optional[Dict[str, Any]]:
+        """Parses and validates the fused response, returning None if it cannot be used."""
+        try:
+            cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+            result = json.loads(cleaned_response_text)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            logger.warning(f"ContextPlanningAgent failed to parse AI response; falling back to two calls. Error: {e}")
+            return None
+
+        problem = self._validate(result)
+        if problem:
+            logger.warning(f"ContextPlanningAgent output failed validation ({problem}); falling back to two calls.")
+            return None
+        return result
+
+    @staticmethod
+    def _validate(result: Any) -> Optional[str]:
+        """Returns a description of the first problem in a fused result, or None if it is usable."""
+        if not isinstance(result, dict):
+            return "response is not a JSON object"
+
+        status = result.get("status")
+        if status == "NEEDS_CLARIFICATION":
+            return None if isinstance(result.get("reason"), str) and result["reason"].strip() else "missing reason"
+        if status != "SUCCESS":
+            return f"unexpected status {status!r}"
+
+        resolved_command = result.get("resolved_command")
+        if not isinstance(resolved_command, str) or not resolved_command.strip():
+            return "missing resolved_command"
+
+        sub_tasks = result.get("sub_tasks")
+        if not isinstance(sub_tasks, list) or not sub_tasks:
+            return "missing sub_tasks"
+        for task in sub_tasks:
+            if not isinstance(task, dict):
+                return "sub_task is not an object"
+            if task.get("route_to") not in ROUTABLE_AGENTS:
+                return f"unknown route_to {task.get('route_to')!r}"
+            clarified_command = task.get("clarified_command")
+            if not isinstance(clarified_command, str) or not clarified_command.strip():
+                return "sub_task missing clarified_command"
+            if not isinstance(task.get("depends_on_previous", False), bool):
+                return "depends_on_previous is not a boolean"
+        return None
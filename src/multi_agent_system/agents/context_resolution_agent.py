@@ -1,4 +1,5 @@
 import json
+from functools import cached_property
 from typing import List, Dict, Any
 
 # ======================================================================================
@@ -150,26 +151,43 @@ JSON: {"status": "SUCCESS", "resolved_command": "get help on how to use the app"
 // Rationale: Recognized a request for help and converted it into a structured command.
 """
 
-    def build(self, user_command: str, conversation_history: str) -> str:
-        """Assembles the complete Context Resolution prompt."""
+    @cached_property
+    def static_prefix(self) -> str:
+        """
+        The instructions, response format and examples, built once.
+
+        They never change between calls, so they form the start of every
+        prompt; only the history and the command follow them.
+        """
         prompt_parts = [
             self._get_header(),
             self._get_core_mission_and_rules(),
             self._get_response_format(),
             "---",
+            self._get_examples(),
+            "---",
+        ]
+
+        return "\n".join(prompt_parts)
+
+    def build_dynamic_suffix(self, user_command: str, conversation_history: str) -> str:
+        """Assembles the per-call part of the prompt: the history, the command and the final instruction."""
+        prompt_parts = [
             "### CONVERSATION HISTORY (Your Context Source)",
             conversation_history if conversation_history else "No conversation history available.",
             "---",
             "### CURRENT USER COMMAND (To Be Resolved)",
             f'"{user_command}"',
             "---",
-            self._get_examples(),
-            "---",
             "Now, analyze the command and its history. Produce the single, resolved command or a clarification request in the specified JSON format. Respond with NOTHING but the JSON object."
         ]
-        
+
         return "\n".join(prompt_parts)
 
+    def build(self, user_command: str, conversation_history: str) -> str:
+        """Assembles the complete Context Resolution prompt: the static prefix, then the per-call suffix."""
+        return f"{self.static_prefix}\n{self.build_dynamic_suffix(user_command, conversation_history)}"
+
 
 # ======================================================================================
 # == CONTEXT RESOLUTION AGENT: The class that uses the builder and the AI model ==
@@ -195,6 +213,10 @@ class ContextResolutionAgent:
         
         self.ai_model = ai_model
         self.prompt_builder = ContextResolverPromptBuilder()
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(self.prompt_builder.static_prefix)
 
     def resolve_context(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
@@ -209,6 +231,35 @@ class ContextResolutionAgent:
             Example success: {"status": "SUCCESS", "resolved_command": "add task to call mom"}
             Example failure: {"status": "NEEDS_CLARIFICATION", "reason": "The reminder has no object."}
         """
+        prompt_string = self._build_prompt(user_command, conversation_history)
+        
+        # Call the AI model to get the clarified command
+        try:
+            response = self.ai_model.generate_content(prompt_string)
+            return self._parse_response(response)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            return self._parse_error(e)
+
+    async def resolve_context_async(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Awaitable version of `resolve_context` that does not block the event loop.
+
+        Args:
+            user_command: The raw string command from the user.
+            conversation_history: A list of conversation turn dictionaries from the history manager.
+
+        Returns:
+            The same dictionary as `resolve_context`.
+        """
+        prompt_string = self._build_prompt(user_command, conversation_history)
+        try:
+            response = await self.ai_model.generate_content_async(prompt_string)
+            return self._parse_response(response)
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+            return self._parse_error(e)
+
+    def _build_prompt(self, user_command: str, conversation_history: List[Dict[str, Any]]) -> str:
+        """Builds the resolution prompt from the command and the structured history."""
         # Convert the structured history list into a flat string for the prompt
         history_str = "\n".join([
             f"USER: {turn.get('user_input', '')}\nASSISTANT: {turn.get('response', '')}"
@@ -216,22 +267,20 @@ class ContextResolutionAgent:
         ])
 
         # Use the builder to construct the full, detailed prompt
-        prompt_string = self.prompt_builder.build(user_command, history_str)
-        
-        # Call the AI model to get the clarified command
-        try:
-            response = self.ai_model.generate_content(prompt_string)
-            
-            # Robustly parse the AI's response, cleaning up potential markdown
-            # This handles cases where the AI wraps its response in ```json ... ```
-            cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-            
-            return json.loads(cleaned_response_text)
-
-        except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
-            # If the AI response is malformed or parsing fails, return a standard error
-            # This ensures the system doesn't crash on an unexpected AI output
-            return {
-                "status": "ERROR",
-                "reason": f"Failed to parse AI response. Error: {e}"
-            }
\ No newline at end of file
+        return self.prompt_builder.build(user_command, history_str)
+
+    @staticmethod
+    def _parse_response(response: Any) -> Dict[str, Any]:
+        """Parses the AI's JSON response, cleaning up potential markdown."""
+        # This handles cases where the AI wraps its response in ```json ... ```
+        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+        return json.loads(cleaned_response_text)
+
+    @staticmethod
+    def _parse_error(error: Exception) -> Dict[str, Any]:
+        """Returns the standard error result for a malformed AI response."""
+        # This ensures the system doesn't crash on an unexpected AI output
+        return {
+            "status": "ERROR",
+            "reason": f"Failed to parse AI response. Error: {error}"
+        }
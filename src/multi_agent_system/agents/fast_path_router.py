@@ -0,0 +1,211 @@
+import logging
+import re
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from .task_management_agent import FUNCTION_MAPPINGS, SCHEDULING_KEYWORD_PATTERNS, detect_scheduling_intent
+
+logger = logging.getLogger(__name__)
+
+# ======================================================================================
+# ==  ROUTING RULES: Precompiled, multilingual (English + Indonesian) patterns        ==
+# ======================================================================================
+
+def _aliases_for(category: str) -> str:
+    """Builds a regex alternation of the spoken forms of a FUNCTION_MAPPINGS category's aliases."""
+    words = set()
+    for func_info in FUNCTION_MAPPINGS.values():
+        if func_info['category'] == category:
+            for alias in func_info.get('aliases', []):
+                words.add(alias.replace('_', ' '))
+    return "|".join(re.escape(word) for word in sorted(words, key=len, reverse=True))
+
+
+# Each rule is (name, target agent, confidence, pattern). Patterns are anchored at
+# the start of the command so that only direct, imperative commands match.
+ROUTING_RULES: List[Tuple[str, str, float, Pattern]] = [
+    ("guide_request", "GuideAgent", 0.97, re.compile(
+        r"^(get help on how to use the app|how (do i|to) use (this|the) app|bantuan|cara pakai)\b")),
+    ("reminder_create", "ScheduleAgent", 0.92, re.compile(
+        r"^(remind me|set (a |an )?reminder|ingatkan( saya| aku)?|pengingat)\b")),
+    ("schedule_create", "ScheduleAgent", 0.9, re.compile(
+        r"^(schedule|jadwalkan|buat (schedule|jadwal)|create (a )?schedule)\b")),
+    ("task_create", "TaskAgent", 0.93, re.compile(
+        r"^(add|create|make|new|tambah(kan)?|buat(kan)?)\s+(a\s+|an\s+|new\s+)*(task|todo|to-do|tugas)s?\b")),
+    ("task_list", "TaskAgent", 0.93, re.compile(
+        r"^((show|list|view|display|get)( me)?( all)?( my)?|what are my|lihat|tampilkan|tunjukkan|cek)\s+"
+        r"(semua\s+)?(tasks|todos|to-dos|tugas)\b")),
+    ("task_alias", "TaskAgent", 0.88, re.compile(
+        r"^(" + _aliases_for('task_management') + r")\b")),
+    ("task_modify", "TaskAgent", 0.88, re.compile(
+        r"^(complete|finish|mark|delete|remove|update|edit|selesaikan|hapus|ubah)\s+(the\s+)?(task|tugas)\b")),
+    ("journal_create", "JournalAgent", 0.9, re.compile(
+        r"^((add|create|write|new|make)\s+(a\s+)?(journal|note|diary)( entry)?|catat|tulis (jurnal|catatan))\b")),
+    ("journal_alias", "JournalAgent", 0.8, re.compile(
+        r"^(" + _aliases_for('journal_management') + r")\b")),
+]
+
+# Words that refer back to earlier turns; such commands need the LLM's context handling.
+REFERENTIAL_PATTERN = re.compile(
+    r"\b(it|its|that|them|they|those|the last one|the same|same one|itu|tersebut|tadi|yang tadi)\b")
+
+# Conjunctions and separators that usually join more than one intent.
+MULTI_INTENT_PATTERN = re.compile(
+    r"\b(and|then|also|plus|as well as|dan|lalu|kemudian|terus|juga|serta)\b|[;&]|,")
+
+# Money terms and amounts. "catat pengeluaran 50rb" is a financial record, not a
+# journal entry, and the FinancialAgent has no rule here, so such commands go to the planner.
+FINANCE_PATTERN = re.compile(
+    r"\b(pengeluaran|pemasukan|expenses?|income|bayar|belanja|gaji|budget|anggaran|spent|paid|rp)\b"
+    r"|\b\d[\d.,]*\s*(rb|ribu|k|jt|juta|rp|idr|usd)\b"
+    r"|\brp\.?\s*\d|\$\s*\d|\b\d{1,3}([.,]\d{3})+\b")
+
+# Very long commands tend to carry several details; they are penalized.
+LONG_COMMAND_CHARS = 160
+
+
+@dataclass
+class FastPathDecision:
+    """
+    A routing decision made without an LLM call.
+
+    Attributes:
+        route_to (str): The specialist agent name.
+        confidence (float): The rule's confidence, after penalties, in [0, 1].
+        rule (str): The name of the rule that matched.
+    """
+    route_to: str
+    confidence: float
+    rule: str
+
+    def to_sub_task(self, command: str) -> Dict[str, Any]:
+        """Returns the decision as a sub-task in the AuditAgent's plan format."""
+        return {
+            "route_to": self.route_to,
+            "suggestion": f"(Suggestion: Routed by the fast-path rule '{self.rule}'.)",
+            "clarified_command": command,
+            "depends_on_previous": False,
+        }
+
+
+@dataclass
+class FastPathMetrics:
+    """
+    Counters for the fast-path router.
+
+    Attributes:
+        evaluated (int): The number of commands the router looked at.
+        hits (int): The number of commands routed without the LLM planner.
+        misses (Dict[str, int]): Commands sent to the LLM planner, by reason.
+        hits_by_agent (Dict[str, int]): Fast-path hits, by target agent.
+        confidence_sum (float): The sum of the confidence of every matched command.
+        matched (int): The number of commands where at least one rule matched.
+    """
+    evaluated: int = 0
+    hits: int = 0
+    misses: Dict[str, int] = field(default_factory=dict)
+    hits_by_agent: Dict[str, int] = field(default_factory=dict)
+    confidence_sum: float = 0.0
+    matched: int = 0
+
+
+class FastPathRouter:
+    """
+    Routes unambiguous commands straight to a specialist agent, skipping the
+    AuditAgent's LLM planning call.
+
+    The router is deliberately conservative: it only answers when exactly one
+    agent's rule matches, the command has no referential pronouns and no
+    multi-intent conjunctions, and the confidence clears the threshold.
+    Everything else is left to the AuditAgent.
+    """
+
+    def __init__(self, min_confidence: float = 0.85):
+        """
+        Initializes the router.
+
+        Args:
+            min_confidence: The confidence a decision needs to skip the LLM planner.
+        """
+        self.min_confidence = min_confidence
+        self._metrics = FastPathMetrics()
+        self._lock = threading.Lock()
+
+    def route(self, command: str) -> Optional[FastPathDecision]:
+        """
+        Tries to route a command without an LLM call.
+
+        Args:
+            command: The (resolved) user command.
+
+        Returns:
+            A `FastPathDecision` if the command can skip the planner, otherwise None.
+        """
+        text = " ".join(command.lower().split())
+        decision, miss_reason = self._evaluate(text)
+
+        with self._lock:
+            self._metrics.evaluated += 1
+            if decision is not None:
+                self._metrics.matched += 1
+                self._metrics.confidence_sum += decision.confidence
+            if miss_reason is None:
+                self._metrics.hits += 1
+                self._metrics.hits_by_agent[decision.route_to] = self._metrics.hits_by_agent.get(decision.route_to, 0) + 1
+            else:
+                self._metrics.misses[miss_reason] = self._metrics.misses.get(miss_reason, 0) + 1
+
+        if miss_reason is None:
+            logger.info(f"⚡ Fast path: '{command}' → {decision.route_to} (rule '{decision.rule}', confidence {decision.confidence:.2f})")
+            return decision
+        logger.info(f"Fast path skipped ({miss_reason}); using the LLM planner.")
+        return None
+
+    def _evaluate(self, text: str) -> Tuple[Optional[FastPathDecision], Optional[str]]:
+        """Returns the best decision and the reason it cannot be used, or None as the reason on a hit."""
+        matches = [(name, agent, confidence) for name, agent, confidence, pattern in ROUTING_RULES if pattern.search(text)]
+        if not matches:
+            return None, "no_rule"
+
+        name, agent, confidence = max(matches, key=lambda match: match[2])
+        decision = FastPathDecision(route_to=agent, confidence=confidence, rule=name)
+
+        if len({match[1] for match in matches}) > 1:
+            decision.confidence = 0.0
+            return decision, "ambiguous_rules"
+        if REFERENTIAL_PATTERN.search(text):
+            decision.confidence = 0.0
+            return decision, "referential"
+        if MULTI_INTENT_PATTERN.search(text):
+            decision.confidence = 0.0
+            return decision, "multi_intent"
+        if FINANCE_PATTERN.search(text):
+            # Expenses and income belong to the FinancialAgent; let the planner decide.
+            decision.confidence = 0.0
+            return decision, "finance_conflict"
+        if agent != "ScheduleAgent" and (detect_scheduling_intent(text)
+                                         or any(pattern.search(text) for pattern in SCHEDULING_KEYWORD_PATTERNS)):
+            # Recurring or timed work (tiap, setiap, berkala, weekly...) belongs to the ScheduleAgent; let the planner decide.
+            decision.confidence = 0.0
+            return decision, "scheduling_conflict"
+
+        if len(text) > LONG_COMMAND_CHARS:
+            decision.confidence = round(decision.confidence - 0.2, 2)
+        if decision.confidence < self.min_confidence:
+            return decision, "low_confidence"
+        return decision, None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of the router's metrics.
+
+        Returns:
+            A dictionary of counters plus `hit_rate` and `average_confidence`.
+        """
+        with self._lock:
+            stats = asdict(self._metrics)
+        stats['hit_rate'] = stats['hits'] / stats['evaluated'] if stats['evaluated'] else 0.0
+        stats['average_confidence'] = stats['confidence_sum'] / stats['matched'] if stats['matched'] else 0.0
+        stats['min_confidence'] = self.min_confidence
+        return stats
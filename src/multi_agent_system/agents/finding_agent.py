@@ -18,9 +18,13 @@ class FindingAgent:
     search. It always falls back to a web search if its internal search is
     unsuccessful.
     """
-    def __init__(self, ai_model=None, supabase=None):
+    def __init__(self, ai_model=None, supabase=None, prompt_budget=None):
         self.ai_model = ai_model
         self.supabase = supabase
+        # An optional PromptBudget that caps the candidate list sent to the matcher.
+        self.prompt_budget = prompt_budget
+        # Set by the orchestrator to a request-scoped UserDataSnapshot; reads fall back to Supabase when None.
+        self.data_snapshot = None
 
     # --- AI Planning & Matching Methods (Unchanged) ---
     def _create_search_plan(self, user_command: str, all_categories: Dict) -> Dict[str, Any]:
@@ -51,6 +55,11 @@ class FindingAgent:
 
     def _find_semantic_matches(self, search_term: str, candidates: List[Dict]) -> List[Dict]:
         """Second AI Call: Finds the best semantic matches from a candidate list."""
+        if self.prompt_budget is not None:
+            candidates = self.prompt_budget.fit(
+                [self.prompt_budget.clip(item, ('title',)) for item in candidates],
+                render=lambda item: json.dumps(item, indent=2), query=search_term, match_fields=('title', 'category'),
+            )
         prompt = f"""
         You are an expert Semantic Matcher. From the pre-filtered list of items below, find all items that are highly relevant to the user's search term.
 
@@ -72,6 +81,10 @@ class FindingAgent:
         # This method is already efficient and safe. No changes needed.
         categories = {"tasks": [], "journals": []}
         try:
+            if self.data_snapshot is not None:
+                categories["tasks"] = self.data_snapshot.get_categories('tasks')
+                categories["journals"] = self.data_snapshot.get_categories('journals')
+                return categories
             tasks_res = db_manager.supabase.table('tasks').select('category').eq('user_id', db_manager.user_id).execute()
             if tasks_res.data: categories["tasks"] = list(set(t['category'] for t in tasks_res.data if t.get('category')))
             journals_res = db_manager.supabase.table('journals').select('category').eq('user_id', db_manager.user_id).execute()
@@ -87,6 +100,14 @@ class FindingAgent:
         """
         candidates = []
         try:
+            if self.data_snapshot is not None:
+                # The snapshot is ordered newest first, so the same limits select the same rows.
+                limit = CATEGORY_SEARCH_LIMIT if categories else RECENCY_SEARCH_LIMIT
+                for item_type, rows in (('Task', self.data_snapshot.get_tasks(categories=categories or None, limit=limit)),
+                                        ('Journal', self.data_snapshot.get_journals(categories=categories or None, limit=limit))):
+                    for row in rows:
+                        candidates.append({'id': row.get('id'), 'title': row.get('title'), 'category': row.get('category'), 'type': item_type})
+                return candidates
             if categories:
                 # Path A: Category-based search with a limit
                 limit = CATEGORY_SEARCH_LIMIT
@@ -110,8 +131,10 @@ class FindingAgent:
 
     def _fetch_full_details(self, matched_items: List[Dict], db_manager: DatabaseManager) -> List[Dict]:
         """Fetches the full data for the final list of matched item IDs."""
-        # This method is already safe as it only fetches by specific IDs. No changes needed.
-        full_details, task_ids, journal_ids = [], [m['id'] for m in matched_items if m['type'] == 'Task'], [m['id'] for m in matched_items if m['type'] == 'Journal']
+        # This method is already safe as it only fetches by specific IDs. The snapshot holds no journal contents, so it is not used here.
+        full_details = []
+        task_ids = [str(m['id']) for m in matched_items if m.get('type') == 'Task' and m.get('id') is not None]
+        journal_ids = [str(m['id']) for m in matched_items if m.get('type') == 'Journal' and m.get('id') is not None]
         try:
             if task_ids:
                 res = db_manager.supabase.table('tasks').select('*').in_('id', task_ids).execute()
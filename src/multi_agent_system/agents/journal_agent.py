@@ -12,15 +12,17 @@ class JournalAgent:
     This version uses a single, powerful intent model and efficiently batches
     similar actions to minimize API calls. It is ID-aware and has robust fallbacks.
     """
-    def __init__(self, ai_model=None, supabase=None, api_key_manager=None):
+    def __init__(self, ai_model=None, supabase=None, api_key_manager=None, prompt_budget=None):
         self.ai_model = ai_model
         self.supabase = supabase
         self.api_key_manager = api_key_manager
-        self.last_api_call = 0
-        self.rate_limit_seconds = 2
+        # An optional PromptBudget that caps the titles and categories sent to the search filter.
+        self.prompt_budget = prompt_budget
         self.category_cache = {}
         self.default_categories = ['contact', 'location', 'note', 'idea', 'memory']
         self.user_context = None
+        # Set by the orchestrator to a request-scoped UserDataSnapshot; reads fall back to Supabase when None.
+        self.data_snapshot = None
 
     # --------------------------------------------------------------------------
     # Core Agent Logic
@@ -218,6 +220,13 @@ class JournalAgent:
         except (json.JSONDecodeError, TypeError): return [{'category': 'note', 'title': 'Journal Entry'}] * len(contents)
 
     def _find_matching_entries_for_search(self, query: str, entries: List[Dict[str, str]]) -> List[str]:
+        if self.prompt_budget is not None:
+            # Titles are not clipped: the model must return them exactly.
+            entries = self.prompt_budget.fit(
+                entries,
+                render=lambda entry: f"- Title: \"{entry['title']}\", Category: \"{entry['category']}\"",
+                query=query, match_fields=('title', 'category'),
+            )
         prompt = self._build_journal_search_filter_prompt(query, entries)
         response_text = self._make_ai_request_sync(prompt)
         try:
@@ -239,6 +248,12 @@ class JournalAgent:
     # --------------------------------------------------------------------------
 
     def _get_user_custom_categories(self, user_id: str) -> List[str]:
+        if self.data_snapshot is not None:
+            try:
+                return self.data_snapshot.get_categories('journals')
+            except Exception as e:
+                logger.error(f"Error reading custom journal categories from the snapshot: {e}")
+                return []
         cache_key = f"journal_categories_{user_id}"
         if cache_key in self.category_cache and time.time() - self.category_cache[cache_key][0] < 300: return self.category_cache[cache_key][1]
         try:
@@ -253,6 +268,8 @@ class JournalAgent:
 
     def _get_all_titles_and_categories(self, user_id: str) -> List[Dict[str, str]]:
         try:
+            if self.data_snapshot is not None:
+                return [{'title': entry.get('title'), 'category': entry.get('category')} for entry in self.data_snapshot.get_journals()]
             if not self.supabase: return []
             result = self.supabase.table('journals').select('title, category').eq('user_id', user_id).execute()
             return result.data if result.data else []
@@ -261,6 +278,7 @@ class JournalAgent:
 
     def _get_journal_details_by_titles(self, user_id: str, titles: List[str]) -> List[Dict[str, str]]:
         try:
+            # The snapshot holds no journal contents, so the matched entries are read directly.
             if not self.supabase: return []
             result = self.supabase.table('journals').select('id, title, content, category').eq('user_id', user_id).in_('title', titles).execute()
             return result.data if result.data else []
@@ -270,18 +288,12 @@ class JournalAgent:
     def _make_ai_request_sync(self, prompt: str) -> Optional[str]:
         if not self.ai_model: return None
         try:
-            self._enforce_rate_limit()
             response = self.ai_model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
             logger.exception(f"AI request failed in JournalAgent: {e}")
             return None
 
-    def _enforce_rate_limit(self):
-        time_since_call = time.time() - self.last_api_call
-        if time_since_call < self.rate_limit_seconds: time.sleep(self.rate_limit_seconds - time_since_call)
-        self.last_api_call = time.time()
-
     def _error_response(self, message: str) -> Dict[str, Any]:
         return {'success': False, 'actions': [], 'response': f"❌ {message}", 'error': message}
 
@@ -0,0 +1,195 @@
+"""
+Response Templates: Deterministic replies for simple, single-agent outcomes.
+
+Most turns end with one specialist doing one thing ("task 'X' created in
+'work'"). Asking Gemini to phrase such a result costs a full round trip and
+adds nothing. This module renders those outcomes from fixed English and
+Indonesian templates. Multi-agent, data-heavy, or unusual results return None
+so the AnsweringAgent falls back to LLM synthesis.
+
+Key Components:
+- `resolve_template_style`: Maps a `communication_style` memory to a template
+  language and emoji setting, or None if the style asks for more than the
+  templates can honor.
+- `ResponseTemplateRenderer`: Renders a single agent's outcome.
+"""
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# communication_style keys the templates know how to honor. Any other key
+# (a tone, a nickname, a persona) requires LLM synthesis.
+SUPPORTED_STYLE_KEYS = frozenset({'language_preference', 'use_emojis'})
+
+# The most actions a templated reply will list before deferring to the LLM.
+MAX_TEMPLATED_ACTIONS = 5
+
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    'en': {
+        'task_created': "Task '{title}' added to '{category}'.",
+        'task_due': " Due {due}.",
+        'task_completed': "Marked '{title}' as done.",
+        'task_deleted': "Deleted the task '{title}'.",
+        'schedule_created': "Scheduled '{what}'. Next run: {next_run}.",
+        'expense_logged': "Logged an expense of {amount} {currency} for '{category}'.",
+        'income_logged': "Logged income of {amount} {currency} for '{category}'.",
+    },
+    'id': {
+        'task_created': "Tugas '{title}' ditambahkan ke kategori '{category}'.",
+        'task_due': " Tenggat: {due}.",
+        'task_completed': "Tugas '{title}' sudah ditandai selesai.",
+        'task_deleted': "Tugas '{title}' sudah dihapus.",
+        'schedule_created': "Jadwal '{what}' sudah dibuat. Berjalan berikutnya: {next_run}.",
+        'expense_logged': "Pengeluaran {amount} {currency} untuk '{category}' sudah dicatat.",
+        'income_logged': "Pemasukan {amount} {currency} untuk '{category}' sudah dicatat.",
+    },
+}
+
+EMOJIS: Dict[str, str] = {
+    'task_created': "✅",
+    'task_completed': "🎉",
+    'task_deleted': "🗑️",
+    'schedule_created': "⏰",
+    'expense_logged': "💸",
+    'income_logged': "💰",
+}
+
+
+def resolve_template_style(style: Optional[Dict[str, Any]]) -> Optional[Tuple[str, bool]]:
+    """
+    Maps a `communication_style` memory to template settings.
+
+    Args:
+        style: The memory's `content_json`, or an empty dict / None if the user
+               has none. Without a memory the assistant speaks Indonesian
+               without emojis, matching the AnsweringAgent's fallback persona.
+
+    Returns:
+        A `(language, use_emojis)` tuple, where language is "en" or "id", or
+        None if the style cannot be honored by a template.
+    """
+    if not style:
+        return 'id', False
+    if not isinstance(style, dict) or set(style) - SUPPORTED_STYLE_KEYS:
+        return None
+
+    language_preference = str(style.get('language_preference', 'Indonesian')).strip().lower()
+    if 'indo' in language_preference or 'bahasa' in language_preference:
+        language = 'id'
+    elif 'english' in language_preference or 'inggris' in language_preference:
+        language = 'en'
+    else:
+        return None
+
+    use_emojis = style.get('use_emojis', False)
+    if isinstance(use_emojis, str):
+        use_emojis = use_emojis.strip().lower() in ('true', 'yes', 'ya', '1')
+    return language, bool(use_emojis)
+
+
+def _format_amount(amount: Any, language: str) -> str:
+    """Formats an amount with thousands separators in the language's convention."""
+    try:
+        value = float(amount)
+    except (TypeError, ValueError):
+        return str(amount)
+    text = f"{value:,.0f}" if value.is_integer() else f"{value:,.2f}"
+    if language == 'id':
+        text = text.replace(',', '_').replace('.', ',').replace('_', '.')
+    return text
+
+
+class ResponseTemplateRenderer:
+    """
+    Renders deterministic replies for common single-agent outcomes: creating,
+    completing, or deleting tasks, creating schedules, and logging expenses or
+    income.
+    """
+
+    def render(self, agent_responses: List[Dict[str, Any]], execution_result: Optional[Dict[str, Any]],
+               style: Optional[Dict[str, Any]]) -> Optional[str]:
+        """
+        Renders a reply without an LLM call, if the outcome allows it.
+
+        Args:
+            agent_responses: The specialist responses for this turn.
+            execution_result: The result of `_execute_json_actions` for this turn.
+            style: The user's `communication_style` memory (`content_json`).
+
+        Returns:
+            The rendered reply with UTC timestamps left as-is, or None if LLM
+            synthesis is required.
+        """
+        if len(agent_responses) != 1:
+            return None
+        agent_response = agent_responses[0]
+        if agent_response.get('success') is False or agent_response.get('requires_clarification'):
+            return None
+        if agent_response.get('execution_result'):
+            return None
+
+        actions = agent_response.get('actions') or []
+        if not actions or len(actions) > MAX_TEMPLATED_ACTIONS:
+            return None
+
+        results = (execution_result or {}).get('results') or []
+        if len(results) != len(actions):
+            return None
+        if any(not isinstance(result, dict) or result.get('success') is False or 'error' in result for result in results):
+            return None
+
+        resolved_style = resolve_template_style(style)
+        if resolved_style is None:
+            return None
+        language, use_emojis = resolved_style
+
+        lines = []
+        for action, result in zip(actions, results):
+            line = self._render_action(action, result, agent_response, language)
+            if line is None:
+                return None
+            kind, text = line
+            lines.append(f"{EMOJIS[kind]} {text}" if use_emojis else text)
+
+        logger.info(f"🧾 Rendered a templated reply for {len(lines)} action(s); skipping LLM synthesis.")
+        return "\n".join(lines)
+
+    def _render_action(self, action: Dict[str, Any], result: Dict[str, Any], agent_response: Dict[str, Any],
+                       language: str) -> Optional[Tuple[str, str]]:
+        """Returns `(kind, text)` for one executed action, or None if it has no template."""
+        templates = TEMPLATES[language]
+        action_type = action.get('type')
+        data = result.get('data') if isinstance(result.get('data'), dict) else {}
+
+        if action_type == 'create_task' and action.get('title'):
+            text = templates['task_created'].format(title=action['title'], category=action.get('category') or 'general')
+            if action.get('due_date'):
+                text += templates['task_due'].format(due=action['due_date'])
+            return 'task_created', text
+
+        if action_type == 'update_task' and action.get('patch') == {'status': 'done'}:
+            title = data.get('title') or agent_response.get('task_title')
+            return ('task_completed', templates['task_completed'].format(title=title)) if title else None
+
+        if action_type == 'delete_task':
+            title = agent_response.get('task_title')
+            return ('task_deleted', templates['task_deleted'].format(title=title)) if title else None
+
+        if action_type == 'create_schedule' and action.get('next_run_at'):
+            payload = action.get('action_payload') or {}
+            what = payload.get('message') or payload.get('title')
+            if not what:
+                return None
+            return 'schedule_created', templates['schedule_created'].format(what=what, next_run=action['next_run_at'])
+
+        if action_type == 'create_financial_transaction' and action.get('amount'):
+            kind = 'expense_logged' if action.get('transaction_type') == 'expense' else 'income_logged'
+            return kind, templates[kind].format(
+                amount=_format_amount(action['amount'], language),
+                currency=action.get('currency', 'USD'),
+                category=action.get('category', 'Uncategorized'),
+            )
+
+        return None
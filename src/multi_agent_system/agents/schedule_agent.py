@@ -26,7 +26,6 @@ time-based action, from simple reminders to complex, recurring AI-driven tasks.
 
 import json
 import logging
-import time
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional, List
 
@@ -36,6 +35,70 @@ import dateparser
 logger = logging.getLogger(__name__)
 
 ISO_UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# The static part of the schedule intent prompt. It comes first and never changes, so
+# every intent call shares the same prompt prefix; only the command is appended.
+SCHEDULE_INTENT_INSTRUCTIONS = """You are an expert at analyzing user commands for a scheduling system. Your goal is to determine the user's intent and extract all necessary details into a single, structured JSON object.
+
+---
+### 1. Possible Intents
+You must choose one of the following for the `intent` key:
+- `create_schedule`: For any new one-time or recurring action.
+- `list_schedules`: When the user wants to see their existing schedules.
+- `find_schedule`: When the user is asking for details about a specific schedule.
+- `update_schedule`: When the user wants to change an existing schedule.
+- `delete_schedule`: When the user wants to cancel or remove an existing schedule.
+
+---
+### 2. CRITICAL SAFETY RULE FOR RECURRING SCHEDULES
+- This rule **ONLY** applies to schedules that repeat (using words like 'every', 'each', 'daily').
+- If a **recurring** schedule is more frequent than once per day (e.g., "every hour"), you **MUST** set `"is_valid": false` and provide a clear reason.
+- **One-time schedules (e.g., "in 20 minutes") are ALWAYS valid.**
+
+---
+### 3. Extraction Logic & Details
+
+**A. For `intent: "create_schedule"`:**
+- `is_valid`: (boolean) Must be `false` if the safety rule is violated.
+- `reason`: (string) If invalid, explain why.
+- `action_type`: (string) Choose ONE of `send_notification`, `create_task`, `execute_prompt`, or `daily_summary`.
+- `action_payload`: (JSON object) The payload for the action. For `daily_summary`, this is an empty object `{}`.
+- `schedule_str`: (string) The natural language description of the schedule (e.g., "every morning at 8am").
+
+**B. For `intent: "list_schedules"`:**
+- No other details are needed.
+
+**C. For `intent: "find_schedule"`, `intent: "update_schedule"`, or `intent: "delete_schedule"`:**
+- `schedule_description`: (string) The user's description of the schedule to find.
+- `patch`: (JSON object) For `update_schedule` only, this contains the changes.
+
+---
+### 4. EXAMPLES (Follow these patterns closely)
+
+- **Command:** "remind me to take a bath in 1 hour"
+  **Response:** `{"intent": "create_schedule", "is_valid": true, "action_type": "send_notification", "action_payload": {"message": "Take a bath"}, "schedule_str": "in 1 hour"}`
+
+- **Command:** "schedule a work task to prepare the weekly report every Friday morning"
+  **Response:** `{"intent": "create_schedule", "is_valid": true, "action_type": "create_task", "action_payload": {"title": "Prepare Weekly Report", "description": "Compile and send the weekly performance report.", "category": "work", "priority": "medium"}, "schedule_str": "every Friday morning"}`
+
+- **Command:** "send me my daily summary every morning at 8am"
+  **Response:** `{"intent": "create_schedule", "is_valid": true, "action_type": "daily_summary", "action_payload": {}, "schedule_str": "every morning at 8am"}`
+
+- **Command:** "when is my swimming schedule?"
+  **Response:** `{"intent": "find_schedule", "schedule_description": "swimming schedule"}`
+
+- **Command:** "cancel my daily poem reminder"
+  **Response:** `{"intent": "delete_schedule", "schedule_description": "my daily poem reminder"}`
+
+- **Command:** "show me my schedules"
+  **Response:** `{"intent": "list_schedules"}`
+
+- **Command:** "run a check every hour"
+  **Response:** `{"intent": "create_schedule", "is_valid": false, "reason": "For your safety, I can only schedule actions that occur daily or less frequently."}`
+
+---
+"""
+
 MAX_SCHEDULES_PER_USER = 10
 
 class ScheduleAgent:
@@ -43,8 +106,12 @@ class ScheduleAgent:
         self.ai_model = ai_model
         self.supabase = supabase # The agent needs direct Supabase access for internal checks
         self.api_key_manager = api_key_manager
-        self.last_api_call = 0
-        self.rate_limit_seconds = 2
+        # Set by the orchestrator to a request-scoped UserDataSnapshot; reads fall back to Supabase when None.
+        self.data_snapshot = None
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(SCHEDULE_INTENT_INSTRUCTIONS)
 
     def process_command(self, user_command: str, user_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         if not self.ai_model or not self.supabase:
@@ -200,6 +267,8 @@ class ScheduleAgent:
 
     def _get_all_user_schedules(self, user_id: str) -> List[Dict]:
         try:
+            if self.data_snapshot is not None:
+                return self.data_snapshot.get_schedules(status="active")
             res = self.supabase.table("scheduled_actions").select("*").eq("user_id", user_id).eq("status", "active").execute()
             return res.data if res.data else []
         except Exception as e:
@@ -210,87 +279,22 @@ class ScheduleAgent:
     def _make_ai_request_sync(self, prompt: str) -> Optional[str]:
         if not self.ai_model: return None
         try:
-            self._enforce_rate_limit()
             response = self.ai_model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
             logger.exception(f"AI request failed in ScheduleAgent: {e}")
             return None
 
-    def _enforce_rate_limit(self):
-        time_since_call = time.time() - self.last_api_call
-        if time_since_call < self.rate_limit_seconds:
-            time.sleep(self.rate_limit_seconds - time_since_call)
-        self.last_api_call = time.time()
-        
     def _error_response(self, message: str) -> Dict[str, Any]:
         return {'success': False, 'actions': [], 'response': f"❌ {message}", 'error': message}
 
     # --- Prompt Templates ---
 
     def _build_schedule_intent_prompt(self, user_command: str) -> str:
-        return f"""You are an expert at analyzing user commands for a scheduling system. Your goal is to determine the user's intent and extract all necessary details into a single, structured JSON object.
-
+        return f"""{SCHEDULE_INTENT_INSTRUCTIONS}
 **User Command:** "{user_command}"
 
----
-### 1. Possible Intents
-You must choose one of the following for the `intent` key:
-- `create_schedule`: For any new one-time or recurring action.
-- `list_schedules`: When the user wants to see their existing schedules.
-- `find_schedule`: When the user is asking for details about a specific schedule.
-- `update_schedule`: When the user wants to change an existing schedule.
-- `delete_schedule`: When the user wants to cancel or remove an existing schedule.
-
----
-### 2. CRITICAL SAFETY RULE FOR RECURRING SCHEDULES
-- This rule **ONLY** applies to schedules that repeat (using words like 'every', 'each', 'daily').
-- If a **recurring** schedule is more frequent than once per day (e.g., "every hour"), you **MUST** set `"is_valid": false` and provide a clear reason.
-- **One-time schedules (e.g., "in 20 minutes") are ALWAYS valid.**
-
----
-### 3. Extraction Logic & Details
-
-**A. For `intent: "create_schedule"`:**
-- `is_valid`: (boolean) Must be `false` if the safety rule is violated.
-- `reason`: (string) If invalid, explain why.
-- `action_type`: (string) Choose ONE of `send_notification`, `create_task`, `execute_prompt`, or `daily_summary`.
-- `action_payload`: (JSON object) The payload for the action. For `daily_summary`, this is an empty object `{{}}`.
-- `schedule_str`: (string) The natural language description of the schedule (e.g., "every morning at 8am").
-
-**B. For `intent: "list_schedules"`:**
-- No other details are needed.
-
-**C. For `intent: "find_schedule"`, `intent: "update_schedule"`, or `intent: "delete_schedule"`:**
-- `schedule_description`: (string) The user's description of the schedule to find.
-- `patch`: (JSON object) For `update_schedule` only, this contains the changes.
-
----
-### 4. EXAMPLES (Follow these patterns closely)
-
-- **Command:** "remind me to take a bath in 1 hour"
-  **Response:** `{{"intent": "create_schedule", "is_valid": true, "action_type": "send_notification", "action_payload": {{"message": "Take a bath"}}, "schedule_str": "in 1 hour"}}`
-
-- **Command:** "schedule a work task to prepare the weekly report every Friday morning"
-  **Response:** `{{"intent": "create_schedule", "is_valid": true, "action_type": "create_task", "action_payload": {{"title": "Prepare Weekly Report", "description": "Compile and send the weekly performance report.", "category": "work", "priority": "medium"}}, "schedule_str": "every Friday morning"}}`
-
-- **Command:** "send me my daily summary every morning at 8am"
-  **Response:** `{{"intent": "create_schedule", "is_valid": true, "action_type": "daily_summary", "action_payload": {{}}, "schedule_str": "every morning at 8am"}}`
-
-- **Command:** "when is my swimming schedule?"
-  **Response:** `{{"intent": "find_schedule", "schedule_description": "swimming schedule"}}`
-
-- **Command:** "cancel my daily poem reminder"
-  **Response:** `{{"intent": "delete_schedule", "schedule_description": "my daily poem reminder"}}`
-
-- **Command:** "show me my schedules"
-  **Response:** `{{"intent": "list_schedules"}}`
-
-- **Command:** "run a check every hour"
-  **Response:** `{{"intent": "create_schedule", "is_valid": false, "reason": "For your safety, I can only schedule actions that occur daily or less frequently."}}`
-
----
-Now, analyze the "{user_command}" and respond with ONLY a valid JSON object.
+Now, analyze the command and respond with ONLY a valid JSON object.
 """
 
     def _build_schedule_parsing_prompt(self, schedule_str: str, user_context: Dict) -> str:
@@ -12,15 +12,84 @@ logger = logging.getLogger(__name__)
 # This is the standard ISO 8601 UTC format we will use for all timestamps.
 ISO_UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
+# Appended to a batch reply when some candidate tasks could not be checked.
+INCOMPLETE_BATCH_NOTE = "(I couldn't check all of your tasks just now, so this may not be all of them.)"
+
+# The static part of the intent prompt. It comes first and never changes, so every
+# intent call shares the same prompt prefix; only the command is appended.
+INTENT_DETERMINATION_INSTRUCTIONS = """Analyze the user's command for task management and extract a structured JSON object.
+
+**CRITICAL GOAL:** Your most important job is to distinguish between a command for a SINGLE task versus a command for MULTIPLE tasks (a "batch_operation"). Commands that list several items separated by commas or "and", or use words like "all" or "every", are almost always a 'batch_operation'.
+
+**Definitions:**
+- `intent`: One of 'create_task', 'list_tasks', 'update_task', 'complete_task', 'delete_task', 'batch_operation'.
+- `title`: (For create_task) The main subject.
+- `title_match`: (For single task ops) The title of the task to modify.
+- `patch`: (For update_task) A dictionary of changes.
+- `operation`: (For batch) The action: 'create', 'delete', 'complete', or 'update'.
+- `tasks_to_create`: (For batch create) A list of new task objects, each with a 'title' and optional 'due_date'.
+- `filters`: A dictionary with a `description` of the tasks to find.
+
+---
+**EXAMPLES**
+---
+
+### --- BATCH CREATION (Multiple Tasks) ---
+# Note: These commands create several tasks at once.
+
+# Implicit batch creation with deadlines (the original problem case)
+- "test 1 deadline hari ini, test 2 deadline besok, test 3 deadline lusa" -> {"intent": "batch_operation", "operation": "create", "tasks_to_create": [{"title": "test 1", "due_date": "hari ini"}, {"title": "test 2", "due_date": "besok"}, {"title": "test 3", "due_date": "lusa"}]}
+
+# Explicit batch creation with natural language
+- "add two tasks: schedule the annual review and book a flight to Jakarta" -> {"intent": "batch_operation", "operation": "create", "tasks_to_create": [{"title": "schedule the annual review"}, {"title": "book a flight to Jakarta"}]}
+
+# Simple implicit list
+- "buy milk, walk the dog, pay the electricity bill" -> {"intent": "batch_operation", "operation": "create", "tasks_to_create": [{"title": "buy milk"}, {"title": "walk the dog"}, {"title": "pay the electricity bill"}]}
+
+### --- BATCH MODIFICATION (Multiple Tasks) ---
+# Note: These commands modify existing tasks that match a description.
+
+# Batch deletion using a filter
+- "delete all the tasks that contain the word 'Project'" -> {"intent": "batch_operation", "operation": "delete", "filters": {"description": "all tasks that contain the word 'Project'", "status": "todo"}}
+
+# Batch completion using a filter
+- "finish all my tasks for the 'Website Launch' initiative" -> {"intent": "batch_operation", "operation": "complete", "filters": {"description": "tasks for the 'Website Launch' initiative", "status": "todo"}}
+
+# Intricate batch update using a filter
+- "change all my 'work' tasks to the 'project-alpha' category" -> {"intent": "batch_operation", "operation": "update", "filters": {"description": "all 'work' tasks"}, "patch": {"category": "project-alpha"}}
+
+### --- SINGLE TASK OPERATIONS ---
+# Note: These commands target only one specific task.
+
+# Simple single task creation
+- "remind me to call the doctor's office tomorrow at 10am" -> {"intent": "create_task", "title": "call the doctor's office", "due_date": "tomorrow at 10am"}
+
+# Complex single task update with a clear title match
+- "update the deadline for 'Submit Q3 Financial Report' to next Friday EOD" -> {"intent": "update_task", "title_match": "Submit Q3 Financial Report", "patch": {"due_date": "next Friday EOD"}}
+
+# Single task completion
+- "mark 'Finalize presentation slides' as done" -> {"intent": "complete_task", "title_match": "Finalize presentation slides"}
+
+# Listing tasks (always a single operation, but can return multiple results)
+- "show me my high priority tasks for this week" -> {"intent": "list_tasks", "filters": {"description": "high priority tasks for this week", "status": "todo"}}
+---
+"""
+
 class TaskAgent:
-    def __init__(self, ai_model=None, supabase=None, api_key_manager=None):
+    def __init__(self, ai_model=None, supabase=None, api_key_manager=None, prompt_budget=None):
         self.ai_model = ai_model
         self.supabase = supabase
         self.api_key_manager = api_key_manager
-        self.last_api_call = 0
-        self.rate_limit_seconds = 2
+        # An optional PromptBudget that caps the task lists sent to the matching prompts.
+        self.prompt_budget = prompt_budget
         self.category_cache = {}
         self.base_categories = ['work', 'personal', 'health', 'finance', 'home', 'learning', 'shopping']
+        # Set by the orchestrator to a request-scoped UserDataSnapshot; reads fall back to Supabase when None.
+        self.data_snapshot = None
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(INTENT_DETERMINATION_INSTRUCTIONS)
 
     def process_command(self, user_command: str, user_context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
@@ -76,13 +145,17 @@ class TaskAgent:
 
         if filter_description:
             # AI-powered smart search branch
-            task_ids_to_list = self._find_matching_tasks_for_batch_op(filter_description, user_id, user_context, status=status_filter)
+            task_ids_to_list, complete = self._find_matching_tasks_for_batch_op(filter_description, user_id, user_context, status=status_filter)
 
             if not task_ids_to_list:
+                if not complete:
+                    return self._error_response(f"I couldn't check all of your {status_filter} tasks right now. Please try again in a moment.")
                 return {'success': True, 'actions': [], 'response': f"I couldn't find any {status_filter} tasks matching your description."}
 
             list_action = {'type': 'get_tasks', 'task_ids': task_ids_to_list, 'order_by': 'due_date', 'ascending': True}
             response = f"Here are the {status_filter} tasks I found related to your request..."
+            if not complete:
+                response += f" {INCOMPLETE_BATCH_NOTE}"
         else:
             # Default behavior: list recent tasks with the specified or default status
             list_action = {'type': 'get_tasks', 'status': status_filter, 'limit': 15, 'order_by': 'due_date', 'ascending': True}
@@ -126,7 +199,7 @@ class TaskAgent:
         else:
             return self._error_response("Invalid modification action.")
 
-        return {'success': True, 'actions': [action], 'response': response}
+        return {'success': True, 'actions': [action], 'response': response, 'task_title': matched_task['title']}
     
     def _handle_batch_operation(self, user_id: str, intent_details: Dict, user_context: Dict) -> Dict[str, Any]:
         operation = intent_details.get('operation')
@@ -159,9 +232,11 @@ class TaskAgent:
         if operation == 'complete' and status_filter != 'todo':
             return self._error_response("You can only mark active (todo) tasks as complete.")
         
-        task_ids_to_modify = self._find_matching_tasks_for_batch_op(filter_description, user_id, user_context, status=status_filter)
+        task_ids_to_modify, complete = self._find_matching_tasks_for_batch_op(filter_description, user_id, user_context, status=status_filter)
 
         if not task_ids_to_modify:
+            if not complete:
+                return self._error_response(f"I couldn't check all of your {status_filter} tasks right now. Please try again in a moment.")
             return self._error_response(f"I couldn't find any {status_filter} tasks that match your criteria.")
 
         task_count = len(task_ids_to_modify)
@@ -183,7 +258,9 @@ class TaskAgent:
             
         else:
             return self._error_response(f"The batch operation '{operation}' is not supported for existing tasks.")
-            
+
+        if not complete:
+            response += f" {INCOMPLETE_BATCH_NOTE}"
         return {'success': True, 'actions': actions, 'response': response}
 
     def _determine_intent(self, user_command: str) -> Dict[str, Any]:
@@ -244,6 +321,12 @@ class TaskAgent:
             return None, None
 
     def _get_user_custom_categories(self, user_id: str) -> List[str]:
+        if self.data_snapshot is not None:
+            try:
+                return self.data_snapshot.get_categories('tasks', status='todo')
+            except Exception as e:
+                logger.error(f"Error reading custom task categories from the snapshot: {e}")
+                return []
         cache_key = f"task_categories_{user_id}"
         if cache_key in self.category_cache and time.time() - self.category_cache[cache_key][0] < 300:
             return self.category_cache[cache_key][1]
@@ -258,13 +341,30 @@ class TaskAgent:
             logger.error(f"Error fetching custom task categories: {e}")
         return []
 
+    def _get_tasks(self, user_id: str, status: str, columns: str, complete: bool = False) -> List[Dict]:
+        """
+        Returns the user's tasks with `status`, limited to `columns`, from the snapshot when one is bound.
+
+        With `complete`, a snapshot slice that was truncated at its row limit is
+        bypassed and every matching task is read from the database.
+        """
+        if self.data_snapshot is not None and (not complete or self.data_snapshot.is_complete('tasks', status)):
+            fields = [column.strip() for column in columns.split(',')]
+            return [{field: task.get(field) for field in fields} for task in self.data_snapshot.get_tasks(status=status)]
+        if not self.supabase: return []
+        res = self.supabase.table('tasks').select(columns).eq('user_id', user_id).eq('status', status).execute()
+        return res.data or []
+
     def _find_best_task_match(self, query: str, user_id: str) -> Dict:
         # This function is for modification, so it should ONLY ever search 'todo' tasks.
         try:
-            if not self.supabase: return {'found': False}
-            res = self.supabase.table('tasks').select('id, title, category').eq('user_id', user_id).eq('status', 'todo').execute()
-            candidate_tasks = res.data or []
+            candidate_tasks = self._get_tasks(user_id, 'todo', 'id, title, category')
             if not candidate_tasks: return {'found': False}
+            if self.prompt_budget is not None:
+                candidate_tasks = self.prompt_budget.fit(
+                    candidate_tasks, render=lambda task: f"- Title: \"{task['title']}\", Category: \"{task['category']}\"",
+                    query=query, match_fields=('title', 'category'),
+                )
 
             prompt = self._build_find_task_prompt(query, candidate_tasks)
             response_text = self._make_ai_request_sync(prompt)
@@ -282,25 +382,53 @@ class TaskAgent:
             logger.error(f"Error during intelligent task search: {e}")
             return {'found': False}
 
-    def _find_matching_tasks_for_batch_op(self, filter_description: str, user_id: str, user_context: dict, status: str = 'todo') -> List[int]:
-        """Uses AI to find all tasks matching a natural language description and a given status."""
-        try:
-            if not self.supabase: return []
-            # UPDATED: The query now uses the 'status' parameter.
-            res = self.supabase.table('tasks').select('id, title, category, description').eq('user_id', user_id).eq('status', status).execute()
-            candidate_tasks = res.data or []
-            if not candidate_tasks: return []
+    def _find_matching_tasks_for_batch_op(self, filter_description: str, user_id: str, user_context: dict, status: str = 'todo') -> Tuple[List[int], bool]:
+        """
+        Uses AI to find all tasks matching a natural language description and a given status.
 
-            prompt = self._build_batch_filter_prompt(filter_description, candidate_tasks, user_context)
-            response_text = self._make_ai_request_sync(prompt)
-            
-            if not response_text: return []
+        Every candidate is considered: with a prompt budget, the candidates are
+        split over as many AI calls as needed instead of being truncated.
 
-            result = json.loads(response_text.strip().replace('```json', '').replace('```', ''))
-            return result.get('task_ids', [])
-        except (json.JSONDecodeError, TypeError, Exception) as e:
-            logger.error(f"Error during AI-powered batch filtering: {e}")
-            return []
+        Returns:
+            The matching task IDs, and False if some candidates could not be
+            checked (an AI call failed), so the result may be incomplete.
+        """
+        try:
+            # UPDATED: The query now uses the 'status' parameter.
+            candidate_tasks = self._get_tasks(user_id, status, 'id, title, category, description', complete=True)
+        except Exception as e:
+            logger.error(f"Error fetching candidates for AI-powered batch filtering: {e}")
+            return [], False
+        if not candidate_tasks: return [], True
+
+        if self.prompt_budget is not None:
+            chunks = self.prompt_budget.chunk(
+                [self.prompt_budget.clip(task, ('title', 'description')) for task in candidate_tasks],
+                render=lambda task: json.dumps(task, indent=2),
+            )
+        else:
+            chunks = [candidate_tasks]
+
+        matched_ids, complete = [], True
+        for chunk in chunks:
+            # Only IDs offered in this chunk are accepted, compared as strings.
+            offered_ids = {str(task.get('id')): task.get('id') for task in chunk}
+            try:
+                prompt = self._build_batch_filter_prompt(filter_description, chunk, user_context)
+                response_text = self._make_ai_request_sync(prompt)
+                if not response_text:
+                    complete = False
+                    continue
+                result = json.loads(response_text.strip().replace('```json', '').replace('```', ''))
+                for task_id in result.get('task_ids', []):
+                    if str(task_id) in offered_ids and offered_ids[str(task_id)] not in matched_ids:
+                        matched_ids.append(offered_ids[str(task_id)])
+            except (json.JSONDecodeError, TypeError, Exception) as e:
+                logger.error(f"Error during AI-powered batch filtering: {e}")
+                complete = False
+        if not complete:
+            logger.warning(f"⚠️ Batch filtering for user '{user_id}' could not check every {status} task; the result may be incomplete.")
+        return matched_ids, complete
 
     def _analyze_priority_heuristically(self, title: str, description: str, due_date: Optional[str]) -> str:
         content = f"{title} {description}".lower()
@@ -311,82 +439,19 @@ class TaskAgent:
     def _make_ai_request_sync(self, prompt: str) -> Optional[str]:
         if not self.ai_model: return None
         try:
-            self._enforce_rate_limit()
             response = self.ai_model.generate_content(prompt)
             return response.text.strip()
         except Exception as e:
             logger.exception(f"AI request failed in TaskAgent: {e}")
             return None
 
-    def _enforce_rate_limit(self):
-        time_since_call = time.time() - self.last_api_call
-        if time_since_call < self.rate_limit_seconds:
-            time.sleep(self.rate_limit_seconds - time_since_call)
-        self.last_api_call = time.time()
-        
     def _error_response(self, message: str) -> Dict[str, Any]:
         return {'success': False, 'actions': [], 'response': f"❌ {message}", 'error': message}
 
     def _build_intent_determination_prompt(self, user_command: str) -> str:
-        return f"""Analyze the user's command for task management and extract a structured JSON object.
-
+        return f"""{INTENT_DETERMINATION_INSTRUCTIONS}
 User Command: "{user_command}"
 
-**CRITICAL GOAL:** Your most important job is to distinguish between a command for a SINGLE task versus a command for MULTIPLE tasks (a "batch_operation"). Commands that list several items separated by commas or "and", or use words like "all" or "every", are almost always a 'batch_operation'.
-
-**Definitions:**
-- `intent`: One of 'create_task', 'list_tasks', 'update_task', 'complete_task', 'delete_task', 'batch_operation'.
-- `title`: (For create_task) The main subject.
-- `title_match`: (For single task ops) The title of the task to modify.
-- `patch`: (For update_task) A dictionary of changes.
-- `operation`: (For batch) The action: 'create', 'delete', 'complete', or 'update'.
-- `tasks_to_create`: (For batch create) A list of new task objects, each with a 'title' and optional 'due_date'.
-- `filters`: A dictionary with a `description` of the tasks to find.
-
----
-**EXAMPLES**
----
-
-### --- BATCH CREATION (Multiple Tasks) ---
-# Note: These commands create several tasks at once.
-
-# Implicit batch creation with deadlines (the original problem case)
-- "test 1 deadline hari ini, test 2 deadline besok, test 3 deadline lusa" -> {{"intent": "batch_operation", "operation": "create", "tasks_to_create": [{{"title": "test 1", "due_date": "hari ini"}}, {{"title": "test 2", "due_date": "besok"}}, {{"title": "test 3", "due_date": "lusa"}}]}}
-
-# Explicit batch creation with natural language
-- "add two tasks: schedule the annual review and book a flight to Jakarta" -> {{"intent": "batch_operation", "operation": "create", "tasks_to_create": [{{"title": "schedule the annual review"}}, {{"title": "book a flight to Jakarta"}}]}}
-
-# Simple implicit list
-- "buy milk, walk the dog, pay the electricity bill" -> {{"intent": "batch_operation", "operation": "create", "tasks_to_create": [{{"title": "buy milk"}}, {{"title": "walk the dog"}}, {{"title": "pay the electricity bill"}}]}}
-
-### --- BATCH MODIFICATION (Multiple Tasks) ---
-# Note: These commands modify existing tasks that match a description.
-
-# Batch deletion using a filter
-- "delete all the tasks that contain the word 'Project'" -> {{"intent": "batch_operation", "operation": "delete", "filters": {{"description": "all tasks that contain the word 'Project'", "status": "todo"}}}}
-
-# Batch completion using a filter
-- "finish all my tasks for the 'Website Launch' initiative" -> {{"intent": "batch_operation", "operation": "complete", "filters": {{"description": "tasks for the 'Website Launch' initiative", "status": "todo"}}}}
-
-# Intricate batch update using a filter
-- "change all my 'work' tasks to the 'project-alpha' category" -> {{"intent": "batch_operation", "operation": "update", "filters": {{"description": "all 'work' tasks"}}, "patch": {{"category": "project-alpha"}}}}
-
-### --- SINGLE TASK OPERATIONS ---
-# Note: These commands target only one specific task.
-
-# Simple single task creation
-- "remind me to call the doctor's office tomorrow at 10am" -> {{"intent": "create_task", "title": "call the doctor's office", "due_date": "tomorrow at 10am"}}
-
-# Complex single task update with a clear title match
-- "update the deadline for 'Submit Q3 Financial Report' to next Friday EOD" -> {{"intent": "update_task", "title_match": "Submit Q3 Financial Report", "patch": {{"due_date": "next Friday EOD"}}}}
-
-# Single task completion
-- "mark 'Finalize presentation slides' as done" -> {{"intent": "complete_task", "title_match": "Finalize presentation slides"}}
-
-# Listing tasks (always a single operation, but can return multiple results)
-- "show me my high priority tasks for this week" -> {{"intent": "list_tasks", "filters": {{"description": "high priority tasks for this week", "status": "todo"}}}}
----
-
 Now, analyze the user's command carefully based on these detailed examples. Respond with ONLY a valid JSON object.
 """
 
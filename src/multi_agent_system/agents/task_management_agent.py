@@ -46,156 +46,225 @@ logging.basicConfig(level=logging.INFO)
 
 ISO_UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
+# ---------------------- Shared intent knowledge ----------------------
+# These tables are module-level (and the patterns precompiled) so that other
+# components, such as the FastPathRouter, can reuse them without building an agent.
+
+# Keywords that indicate scheduling/recurring tasks anywhere in an action type.
+SCHEDULING_KEYWORD_PATTERNS = [re.compile(pattern) for pattern in (
+    # English scheduling keywords
+    r'\b(schedule|recurring|daily|weekly|monthly|repeat|automation|every day|every week)\b',
+    # Indonesian scheduling keywords
+    r'\b(jadwal|schedule|tiap hari|setiap hari|tiap|setiap|berkala|otomatis|buat schedule|jadwalkan)\b',
+    # Time frequency patterns
+    r'\b(every \d+|tiap \d+|setiap \d+)\b',
+    # Action + frequency patterns
+    r'\b(buat.*tiap|create.*daily|make.*weekly)\b',
+)]
+
+# Strong scheduling indicators in a full command.
+SCHEDULING_STRONG_PATTERNS = [re.compile(pattern) for pattern in (
+    r'buat schedule',
+    r'create schedule',
+    r'jadwalkan',
+    r'tiap hari',
+    r'setiap hari',
+    r'every day',
+    r'daily',
+    r'recurring',
+    r'otomatis',
+    r'automation',
+)]
+
+# Medium scheduling indicators, only meaningful together with a creation word.
+SCHEDULING_CREATE_WORDS = ('buat', 'create', 'make', 'add')
+SCHEDULING_MEDIUM_PATTERNS = [re.compile(pattern) for pattern in (
+    r'\d+\s*(jam|hour|pukul)',  # time indicators
+    r'tiap',
+    r'setiap',
+    r'berkala',
+)]
+
+# Semantic mapping of user intents to actual available functions in ai_tools.py.
+FUNCTION_MAPPINGS: Dict[str, Dict[str, Any]] = {
+    # TASK MANAGEMENT - map to actual functions in ai_tools.py
+    'create_task': {
+        'function': 'create_task',
+        'aliases': ['add_task', 'new_task', 'make_task', 'task_add', 'task_create'],
+        'semantic_intents': ['add', 'create', 'make', 'new', 'insert', 'start'],
+        'category': 'task_management'
+    },
+    'get_tasks': {
+        'function': 'get_tasks', 
+        'aliases': ['list_tasks', 'show_tasks', 'all_tasks', 'tasks_list', 'view_tasks', 'display_tasks'],
+        'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display', 'find', 'search'],
+        'category': 'task_management'
+    },
+    'update_task': {
+        'function': 'update_task',
+        'aliases': ['modify_task', 'edit_task', 'change_task', 'task_update', 'task_modify'],
+        'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
+        'category': 'task_management'
+    },
+    'delete_task': {
+        'function': 'delete_task',
+        'aliases': ['remove_task', 'task_delete', 'task_remove'],
+        'semantic_intents': ['delete', 'remove', 'destroy', 'eliminate'],
+        'category': 'task_management'
+    },
+    # REMINDER MANAGEMENT
+    'create_reminder': {
+        'function': 'create_reminder',
+        'aliases': ['set_reminder', 'add_reminder', 'new_reminder', 'make_reminder'],
+        'semantic_intents': ['set', 'create', 'add', 'make', 'schedule'],
+        'category': 'reminder_management'
+    },
+    'get_reminders': {
+        'function': 'get_reminders',
+        'aliases': ['list_reminders', 'show_reminders', 'all_reminders', 'view_reminders'],
+        'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display'],
+        'category': 'reminder_management'
+    },
+    'update_reminder': {
+        'function': 'update_reminder',
+        'aliases': ['modify_reminder', 'edit_reminder', 'change_reminder'],
+        'semantic_intents': ['update', 'modify', 'edit', 'change'],
+        'category': 'reminder_management'
+    },
+    'delete_reminder': {
+        'function': 'delete_reminder',
+        'aliases': ['remove_reminder', 'cancel_reminder'],
+        'semantic_intents': ['delete', 'remove', 'cancel', 'destroy'],
+        'category': 'reminder_management'
+    },
+    
+    # AI ACTIONS / SCHEDULING - for recurring and automated tasks
+    'create_ai_action': {
+        'function': 'create_ai_action',
+        'aliases': ['schedule', 'recurring_task', 'automated_task', 'schedule_task', 'daily_task', 'recurring', 'automation', 'create_schedule', 'buat_schedule', 'jadwalkan'],
+        'semantic_intents': ['schedule', 'recurring', 'daily', 'weekly', 'monthly', 'repeat', 'automate', 'automation', 'tiap', 'setiap', 'berkala', 'otomatis'],
+        'category': 'ai_actions',
+        'keywords': ['tiap hari', 'setiap hari', 'daily', 'every day', 'recurring', 'schedule', 'jadwal', 'automation', 'repeat']
+    },
+    'get_ai_actions': {
+        'function': 'get_ai_actions',
+        'aliases': ['list_ai_actions', 'show_schedules', 'list_schedules', 'show_ai_actions', 'view_schedules', 'automations'],
+        'semantic_intents': ['list', 'show', 'get', 'view', 'display'],
+        'category': 'ai_actions'
+    },
+    'update_ai_action': {
+        'function': 'update_ai_action',
+        'aliases': ['modify_ai_action', 'edit_schedule', 'change_schedule', 'update_schedule'],
+        'semantic_intents': ['update', 'modify', 'edit', 'change'],
+        'category': 'ai_actions'
+    },
+    'delete_ai_action': {
+        'function': 'delete_ai_action',
+        'aliases': ['remove_ai_action', 'cancel_schedule', 'delete_schedule', 'stop_automation'],
+        'semantic_intents': ['delete', 'remove', 'cancel', 'stop'],
+        'category': 'ai_actions'
+    },
+    
+    # JOURNAL MANAGEMENT - Updated to match actual ai_tools.py functions
+    'create_journal_entry': {
+        'function': 'create_journal_entry',
+        'aliases': ['add_journal', 'create_journal', 'new_journal', 'write_journal', 'journal_entry', 'diary_entry', 'note', 'write_note', 'save_note', 'record', 'log_entry', 'create_note', 'make_note', 'tulis_jurnal', 'catat'],
+        'semantic_intents': ['write', 'create', 'add', 'new', 'journal', 'diary', 'note', 'record', 'log', 'save'],
+        'category': 'journal_management'
+    },
+    'search_journal_entries': {
+        'function': 'search_journal_entries', 
+        'aliases': ['list_journal', 'get_journals', 'show_journals', 'my_journals', 'view_journals', 'list_notes', 'get_notes', 'show_notes', 'my_notes', 'view_notes', 'all_journals', 'all_notes', 'search_journals', 'find_journals'],
+        'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display', 'my', 'search', 'find'],
+        'category': 'journal_management'
+    },
+    'update_journal_entry': {
+        'function': 'update_journal_entry',
+        'aliases': ['update_journal', 'edit_journal', 'modify_journal', 'change_journal', 'edit_note', 'update_note', 'modify_note', 'change_note'],
+        'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
+        'category': 'journal_management'
+    },
+    'delete_journal_entry': {
+        'function': 'delete_journal_entry',
+        'aliases': ['delete_journal', 'remove_journal', 'delete_note', 'remove_note', 'hapus_jurnal'],
+        'semantic_intents': ['delete', 'remove', 'destroy', 'eliminate'],
+        'category': 'journal_management'
+    },
+    'get_journal_categories': {
+        'function': 'get_journal_categories',
+        'aliases': ['list_categories', 'show_categories', 'journal_categories', 'note_categories'],
+        'semantic_intents': ['categories', 'list', 'show', 'get'],
+        'category': 'journal_management'
+    },
+    
+    # AI BRAIN MEMORY MANAGEMENT
+    'add_ai_brain': {
+        'function': 'add_ai_brain',
+        'aliases': ['add_memory', 'save_memory', 'remember', 'learn', 'store_info', 'save_info', 'add_knowledge', 'save_knowledge', 'create_memory', 'store_knowledge', 'memorize', 'keep_in_mind', 'ingat', 'simpan_info', 'pelajari'],
+        'semantic_intents': ['remember', 'learn', 'save', 'store', 'add', 'memorize', 'keep', 'knowledge'],
+        'category': 'ai_brain_management'
+    },
+    'search_ai_brain': {
+        'function': 'search_ai_brain',
+        'aliases': ['search_memory', 'find_memory', 'recall', 'lookup', 'search_knowledge', 'find_knowledge', 'what_do_you_know', 'what_do_you_remember', 'cari_ingatan', 'temukan_info'],
+        'semantic_intents': ['search', 'find', 'recall', 'lookup', 'what', 'remember', 'know'],
+        'category': 'ai_brain_management'
+    },
+    'update_ai_brain': {
+        'function': 'update_ai_brain',
+        'aliases': ['update_memory', 'edit_memory', 'modify_memory', 'change_memory', 'update_knowledge', 'edit_knowledge', 'modify_knowledge'],
+        'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
+        'category': 'ai_brain_management'
+    },
+    'delete_ai_brain': {
+        'function': 'delete_ai_brain',
+        'aliases': ['delete_memory', 'remove_memory', 'forget', 'delete_knowledge', 'remove_knowledge', 'erase_memory', 'clear_memory', 'lupa', 'hapus_ingatan'],
+        'semantic_intents': ['delete', 'remove', 'forget', 'erase', 'clear', 'destroy'],
+        'category': 'ai_brain_management'
+    }
+    # Add more mappings for other functions as needed
+}
+
+
+def detect_scheduling_intent(command: str) -> Optional[str]:
+    """
+    Analyze a full command to detect if it's a scheduling/recurring task request.
+    Returns "recurring_task", "timed_task", or None.
+    """
+    command_lower = command.lower()
+
+    for pattern in SCHEDULING_STRONG_PATTERNS:
+        if pattern.search(command_lower):
+            logger.info(f"Strong scheduling pattern found: '{pattern.pattern}' in command")
+            return "recurring_task"
+
+    if any(create_word in command_lower for create_word in SCHEDULING_CREATE_WORDS):
+        for pattern in SCHEDULING_MEDIUM_PATTERNS:
+            if pattern.search(command_lower):
+                logger.info(f"Medium scheduling pattern found: '{pattern.pattern}' in command")
+                return "timed_task"
+
+    return None
+
 
 class TaskManagementAgent:
     def __init__(self, ai_model=None):
         self.ai_model = ai_model
         # Define actual available functions from ai_tools.py with semantic mappings
         self.function_mappings = self._build_function_mappings()
+        # The system prompt has no per-call data, so it is built once and sent as the prompt prefix
+        self.system_prompt = self._build_system_prompt()
+        # Lets the model serve the unchanging instructions from Gemini's context cache
+        register_prefix = getattr(ai_model, 'register_static_prefix', None)
+        if register_prefix:
+            register_prefix(self.system_prompt)
     
     def _build_function_mappings(self) -> Dict[str, Dict[str, Any]]:
         """
         Build semantic mapping of user intents to actual available functions.
         This replaces hard-coded action validation with intelligent semantic matching.
         """
-        return {
-            # TASK MANAGEMENT - map to actual functions in ai_tools.py
-            'create_task': {
-                'function': 'create_task',
-                'aliases': ['add_task', 'new_task', 'make_task', 'task_add', 'task_create'],
-                'semantic_intents': ['add', 'create', 'make', 'new', 'insert', 'start'],
-                'category': 'task_management'
-            },
-            'get_tasks': {
-                'function': 'get_tasks', 
-                'aliases': ['list_tasks', 'show_tasks', 'all_tasks', 'tasks_list', 'view_tasks', 'display_tasks'],
-                'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display', 'find', 'search'],
-                'category': 'task_management'
-            },
-            'update_task': {
-                'function': 'update_task',
-                'aliases': ['modify_task', 'edit_task', 'change_task', 'task_update', 'task_modify'],
-                'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
-                'category': 'task_management'
-            },
-            'delete_task': {
-                'function': 'delete_task',
-                'aliases': ['remove_task', 'task_delete', 'task_remove'],
-                'semantic_intents': ['delete', 'remove', 'destroy', 'eliminate'],
-                'category': 'task_management'
-            },
-            # REMINDER MANAGEMENT
-            'create_reminder': {
-                'function': 'create_reminder',
-                'aliases': ['set_reminder', 'add_reminder', 'new_reminder', 'make_reminder'],
-                'semantic_intents': ['set', 'create', 'add', 'make', 'schedule'],
-                'category': 'reminder_management'
-            },
-            'get_reminders': {
-                'function': 'get_reminders',
-                'aliases': ['list_reminders', 'show_reminders', 'all_reminders', 'view_reminders'],
-                'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display'],
-                'category': 'reminder_management'
-            },
-            'update_reminder': {
-                'function': 'update_reminder',
-                'aliases': ['modify_reminder', 'edit_reminder', 'change_reminder'],
-                'semantic_intents': ['update', 'modify', 'edit', 'change'],
-                'category': 'reminder_management'
-            },
-            'delete_reminder': {
-                'function': 'delete_reminder',
-                'aliases': ['remove_reminder', 'cancel_reminder'],
-                'semantic_intents': ['delete', 'remove', 'cancel', 'destroy'],
-                'category': 'reminder_management'
-            },
-            
-            # AI ACTIONS / SCHEDULING - for recurring and automated tasks
-            'create_ai_action': {
-                'function': 'create_ai_action',
-                'aliases': ['schedule', 'recurring_task', 'automated_task', 'schedule_task', 'daily_task', 'recurring', 'automation', 'create_schedule', 'buat_schedule', 'jadwalkan'],
-                'semantic_intents': ['schedule', 'recurring', 'daily', 'weekly', 'monthly', 'repeat', 'automate', 'automation', 'tiap', 'setiap', 'berkala', 'otomatis'],
-                'category': 'ai_actions',
-                'keywords': ['tiap hari', 'setiap hari', 'daily', 'every day', 'recurring', 'schedule', 'jadwal', 'automation', 'repeat']
-            },
-            'get_ai_actions': {
-                'function': 'get_ai_actions',
-                'aliases': ['list_ai_actions', 'show_schedules', 'list_schedules', 'show_ai_actions', 'view_schedules', 'automations'],
-                'semantic_intents': ['list', 'show', 'get', 'view', 'display'],
-                'category': 'ai_actions'
-            },
-            'update_ai_action': {
-                'function': 'update_ai_action',
-                'aliases': ['modify_ai_action', 'edit_schedule', 'change_schedule', 'update_schedule'],
-                'semantic_intents': ['update', 'modify', 'edit', 'change'],
-                'category': 'ai_actions'
-            },
-            'delete_ai_action': {
-                'function': 'delete_ai_action',
-                'aliases': ['remove_ai_action', 'cancel_schedule', 'delete_schedule', 'stop_automation'],
-                'semantic_intents': ['delete', 'remove', 'cancel', 'stop'],
-                'category': 'ai_actions'
-            },
-            
-            # JOURNAL MANAGEMENT - Updated to match actual ai_tools.py functions
-            'create_journal_entry': {
-                'function': 'create_journal_entry',
-                'aliases': ['add_journal', 'create_journal', 'new_journal', 'write_journal', 'journal_entry', 'diary_entry', 'note', 'write_note', 'save_note', 'record', 'log_entry', 'create_note', 'make_note', 'tulis_jurnal', 'catat'],
-                'semantic_intents': ['write', 'create', 'add', 'new', 'journal', 'diary', 'note', 'record', 'log', 'save'],
-                'category': 'journal_management'
-            },
-            'search_journal_entries': {
-                'function': 'search_journal_entries', 
-                'aliases': ['list_journal', 'get_journals', 'show_journals', 'my_journals', 'view_journals', 'list_notes', 'get_notes', 'show_notes', 'my_notes', 'view_notes', 'all_journals', 'all_notes', 'search_journals', 'find_journals'],
-                'semantic_intents': ['list', 'show', 'get', 'all', 'view', 'display', 'my', 'search', 'find'],
-                'category': 'journal_management'
-            },
-            'update_journal_entry': {
-                'function': 'update_journal_entry',
-                'aliases': ['update_journal', 'edit_journal', 'modify_journal', 'change_journal', 'edit_note', 'update_note', 'modify_note', 'change_note'],
-                'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
-                'category': 'journal_management'
-            },
-            'delete_journal_entry': {
-                'function': 'delete_journal_entry',
-                'aliases': ['delete_journal', 'remove_journal', 'delete_note', 'remove_note', 'hapus_jurnal'],
-                'semantic_intents': ['delete', 'remove', 'destroy', 'eliminate'],
-                'category': 'journal_management'
-            },
-            'get_journal_categories': {
-                'function': 'get_journal_categories',
-                'aliases': ['list_categories', 'show_categories', 'journal_categories', 'note_categories'],
-                'semantic_intents': ['categories', 'list', 'show', 'get'],
-                'category': 'journal_management'
-            },
-            
-            # AI BRAIN MEMORY MANAGEMENT
-            'add_ai_brain': {
-                'function': 'add_ai_brain',
-                'aliases': ['add_memory', 'save_memory', 'remember', 'learn', 'store_info', 'save_info', 'add_knowledge', 'save_knowledge', 'create_memory', 'store_knowledge', 'memorize', 'keep_in_mind', 'ingat', 'simpan_info', 'pelajari'],
-                'semantic_intents': ['remember', 'learn', 'save', 'store', 'add', 'memorize', 'keep', 'knowledge'],
-                'category': 'ai_brain_management'
-            },
-            'search_ai_brain': {
-                'function': 'search_ai_brain',
-                'aliases': ['search_memory', 'find_memory', 'recall', 'lookup', 'search_knowledge', 'find_knowledge', 'what_do_you_know', 'what_do_you_remember', 'cari_ingatan', 'temukan_info'],
-                'semantic_intents': ['search', 'find', 'recall', 'lookup', 'what', 'remember', 'know'],
-                'category': 'ai_brain_management'
-            },
-            'update_ai_brain': {
-                'function': 'update_ai_brain',
-                'aliases': ['update_memory', 'edit_memory', 'modify_memory', 'change_memory', 'update_knowledge', 'edit_knowledge', 'modify_knowledge'],
-                'semantic_intents': ['update', 'modify', 'edit', 'change', 'alter'],
-                'category': 'ai_brain_management'
-            },
-            'delete_ai_brain': {
-                'function': 'delete_ai_brain',
-                'aliases': ['delete_memory', 'remove_memory', 'forget', 'delete_knowledge', 'remove_knowledge', 'erase_memory', 'clear_memory', 'lupa', 'hapus_ingatan'],
-                'semantic_intents': ['delete', 'remove', 'forget', 'erase', 'clear', 'destroy'],
-                'category': 'ai_brain_management'
-            }
-            # Add more mappings for other functions as needed
-        }
+        return FUNCTION_MAPPINGS
     
     def _semantic_function_match(self, user_action_type: str, scheduling_context: Optional[str] = None) -> Optional[str]:
         """
@@ -245,21 +314,10 @@ class TaskManagementAgent:
         """
         Check if text contains keywords that indicate scheduling/recurring tasks.
         """
-        scheduling_patterns = [
-            # English scheduling keywords
-            r'\b(schedule|recurring|daily|weekly|monthly|repeat|automation|every day|every week)\b',
-            # Indonesian scheduling keywords  
-            r'\b(jadwal|schedule|tiap hari|setiap hari|tiap|setiap|berkala|otomatis|buat schedule|jadwalkan)\b',
-            # Time frequency patterns
-            r'\b(every \d+|tiap \d+|setiap \d+)\b',
-            # Action + frequency patterns
-            r'\b(buat.*tiap|create.*daily|make.*weekly)\b'
-        ]
-        
         text_lower = text.lower()
-        for pattern in scheduling_patterns:
-            if re.search(pattern, text_lower):
-                logger.info(f"Scheduling pattern found: '{pattern}' in '{text}'")
+        for pattern in SCHEDULING_KEYWORD_PATTERNS:
+            if pattern.search(text_lower):
+                logger.info(f"Scheduling pattern found: '{pattern.pattern}' in '{text}'")
                 return True
         return False
     
@@ -303,11 +361,10 @@ class TaskManagementAgent:
         if scheduling_hint:
             logger.info(f"Scheduling intent detected: {scheduling_hint}")
 
-        system_prompt = self._build_system_prompt()
         user_prompt = self._build_user_prompt(clear_command, user_context, scheduling_hint)
 
         try:
-            full_prompt = f"{system_prompt}\n\nHuman: {user_prompt}\n\nAssistant:"
+            full_prompt = f"{self.system_prompt}\n\nHuman: {user_prompt}\n\nAssistant:"
             response = self.ai_model.generate_content(full_prompt)
             response_text = response.text.strip()
 
@@ -354,48 +411,16 @@ class TaskManagementAgent:
         Analyze the full command to detect if it's a scheduling/recurring task request.
         Returns scheduling hint or None.
         """
-        command_lower = command.lower()
-        
-        # Strong scheduling indicators
-        strong_patterns = [
-            r'buat schedule',
-            r'create schedule',
-            r'jadwalkan',
-            r'tiap hari',
-            r'setiap hari',
-            r'every day',
-            r'daily',
-            r'recurring',
-            r'otomatis',
-            r'automation'
-        ]
-        
-        for pattern in strong_patterns:
-            if re.search(pattern, command_lower):
-                logger.info(f"Strong scheduling pattern found: '{pattern}' in command")
-                return "recurring_task"
-        
-        # Medium scheduling indicators (with task creation context)
-        if any(create_word in command_lower for create_word in ['buat', 'create', 'make', 'add']):
-            medium_patterns = [
-                r'\d+\s*(jam|hour|pukul)',  # time indicators
-                r'tiap',
-                r'setiap',
-                r'berkala'
-            ]
-            
-            for pattern in medium_patterns:
-                if re.search(pattern, command_lower):
-                    logger.info(f"Medium scheduling pattern found: '{pattern}' in command")
-                    return "timed_task"
-        
-        return None
+        return detect_scheduling_intent(command)
 
     # ---------------------- Prompt building ----------------------
     def _build_system_prompt(self) -> str:
-        """Enhanced system prompt with goal-oriented workflow and smart context handling"""
-        current_time = datetime.now(timezone.utc).isoformat()
+        """
+        Enhanced system prompt with goal-oriented workflow and smart context handling.
 
+        The prompt is static (the current time is sent in the user prompt), so
+        the agent builds it once in `__init__`.
+        """
         tools_and_constraints = """
 AVAILABLE TOOLS & CAPABILITIES:
 The system intelligently maps your action intents to available functions. Use natural language action types:
@@ -609,13 +634,16 @@ For "rumah dina di bekasi" (Dina's house in Bekasi):
 
 {tools_and_constraints}
 
-CONTEXT: Current UTC time: {current_time}
+CONTEXT: The current UTC time is given as CURRENT_UTC_TIME in the request.
 **ALWAYS prioritize semantic function mapping and intelligent inference over requesting clarification while maintaining JSON format perfection.**
 """
         return system
 
     def _build_user_prompt(self, clear_command: str, user_context: Optional[Dict[str, Any]] = None, scheduling_hint: Optional[str] = None) -> str:
-        parts = [f'CLEAR COMMAND: "{clear_command}"']
+        parts = [
+            f"CURRENT_UTC_TIME: {datetime.now(timezone.utc).isoformat()}",
+            f'CLEAR COMMAND: "{clear_command}"',
+        ]
         
         # Add scheduling hint if detected
         if scheduling_hint:
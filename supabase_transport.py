@@ -0,0 +1,177 @@
+"""
+One pooled HTTP transport shared by every Supabase client.
+
+Each `create_client` call used to open its own HTTP session, so the service
+client and every per-user client kept separate connections to the same
+PostgREST host, and a burst of users meant a burst of TCP and TLS handshakes.
+`SupabaseTransport` owns a single `httpx.Client` with a bounded keep-alive
+pool (HTTP/2 when the `h2` package is installed) and builds all Supabase
+clients on it. The clients only differ in the headers they send: the user's
+JWT travels as the Authorization header of each request, so any connection
+in the pool can serve any user.
+
+Key Components:
+- `TransportStats`: A data class of request and connection counters.
+- `SupabaseTransport`: The shared pooled client and the factory for Supabase clients that use it.
+"""
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional
+
+import httpx
+from supabase import Client, ClientOptions, create_client
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransportStats:
+    """
+    Request and connection counters for the shared transport.
+
+    Attributes:
+        requests (int): Requests sent.
+        http2_responses (int): Responses received over HTTP/2.
+        connections_opened (int): TCP connections opened.
+        tls_handshakes (int): TLS handshakes completed.
+        connection_failures (int): Connections that could not be opened.
+    """
+    requests: int = 0
+    http2_responses: int = 0
+    connections_opened: int = 0
+    tls_handshakes: int = 0
+    connection_failures: int = 0
+
+
+class SupabaseTransport:
+    """
+    A pooled, keep-alive `httpx.Client` shared by all Supabase clients.
+
+    The pool is thread-safe, so the clients may be used from any worker
+    thread. Connection counts come from httpcore's trace events, so they
+    include the connections opened by every client built on the transport.
+
+    Attributes:
+        http2 (bool): Whether the pool negotiates HTTP/2.
+        max_connections (int): The most connections open at once.
+        max_keepalive_connections (int): The most idle connections kept open.
+    """
+
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry_seconds: float = 30.0, timeout_seconds: float = 120.0,
+                 http2: bool = True):
+        """
+        Initializes the pool. No connection is opened until the first request.
+
+        Args:
+            max_connections: The most connections open at once.
+            max_keepalive_connections: The most idle connections kept open.
+            keepalive_expiry_seconds: How long an idle connection is kept.
+            timeout_seconds: The timeout of each request.
+            http2: Whether to negotiate HTTP/2. Ignored if `h2` is not installed.
+        """
+        if http2:
+            try:
+                import h2  # noqa: F401 -- httpx needs it for HTTP/2.
+            except ImportError:
+                logger.warning("⚠️ The 'h2' package is not installed; Supabase requests use HTTP/1.1.")
+                http2 = False
+        self.http2 = http2
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self._stats = TransportStats()
+        self._lock = threading.Lock()
+        self._client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry_seconds,
+            ),
+            timeout=httpx.Timeout(timeout_seconds),
+            follow_redirects=True,
+            event_hooks={'request': [self._on_request], 'response': [self._on_response]},
+        )
+
+    def create_client(self, supabase_url: str, supabase_key: str) -> Client:
+        """
+        Builds a Supabase client that sends its requests through the shared pool.
+
+        Building a client opens no connection, so it is cheap.
+
+        Args:
+            supabase_url: The Supabase project URL.
+            supabase_key: The service or anon key.
+
+        Returns:
+            The client.
+        """
+        return create_client(supabase_url, supabase_key, options=ClientOptions(httpx_client=self._client))
+
+    @staticmethod
+    def authorize(client: Client, access_token: str):
+        """
+        Makes a client's database requests carry a user JWT.
+
+        The token is sent as the Authorization header of each PostgREST
+        request, which is all Row Level Security needs. Unlike
+        `auth.set_session`, this makes no network call.
+
+        Args:
+            client: A client built by `create_client`.
+            access_token: The user's JWT.
+        """
+        client.postgrest.auth(access_token)
+
+    def _on_request(self, request: httpx.Request):
+        """Counts a request and subscribes to its connection events."""
+        request.extensions['trace'] = self._trace
+        with self._lock:
+            self._stats.requests += 1
+
+    def _on_response(self, response: httpx.Response):
+        """Counts the protocol a response arrived over."""
+        if response.http_version == 'HTTP/2':
+            with self._lock:
+                self._stats.http2_responses += 1
+
+    def _trace(self, event_name: str, info: Dict[str, Any]):
+        """Counts new connections and handshakes from httpcore's trace events."""
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self._stats.connections_opened += 1
+        elif event_name == 'connection.start_tls.complete':
+            with self._lock:
+                self._stats.tls_handshakes += 1
+        elif event_name in ('connection.connect_tcp.failed', 'connection.start_tls.failed'):
+            with self._lock:
+                self._stats.connection_failures += 1
+
+    def _open_connections(self) -> Optional[int]:
+        """Returns the number of connections in the pool, if httpx exposes it."""
+        pool = getattr(getattr(self._client, '_transport', None), '_pool', None)
+        connections = getattr(pool, 'connections', None)
+        return len(connections) if connections is not None else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the transport's counters.
+
+        Returns:
+            A dictionary of counters plus `open_connections`,
+            `requests_per_connection`, `http2` and `max_connections`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+        stats['open_connections'] = self._open_connections()
+        stats['requests_per_connection'] = (
+            stats['requests'] / stats['connections_opened'] if stats['connections_opened'] else None
+        )
+        stats['http2'] = self.http2
+        stats['max_connections'] = self.max_connections
+        return stats
+
+    def close(self):
+        """Closes every pooled connection."""
+        self._client.close()
@@ -0,0 +1,170 @@
+"""
+A small, thread-safe TTL + LRU cache.
+
+The webhook and the agents keep several short-lived lookups in memory (for
+example recently seen message ids). This module provides one bounded store
+for all of them, so the expiry and eviction rules live in a single place.
+
+Key Components:
+- `TTLCache`: An in-memory mapping whose entries expire after a time-to-live
+  and which evicts the least recently used entry once it reaches capacity.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe key/value store with per-entry expiry.
+
+    Entries are kept in an `OrderedDict` in least-recently-used order. Reads
+    refresh an entry's position but never its expiry. Expired entries are
+    dropped lazily when they are read, and when the cache is full.
+
+    Attributes:
+        max_entries (int): The maximum number of entries held at once.
+        ttl_seconds (float): The default lifetime of an entry.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_entries: The capacity of the cache. Must be at least 1.
+            ttl_seconds: The default lifetime of an entry in seconds.
+            clock: The monotonic time source, replaceable for deterministic use.
+
+        Raises:
+            ValueError: If `max_entries` is less than 1.
+        """
+        if max_entries < 1:
+            raise ValueError("TTLCache requires max_entries of at least 1.")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Returns the cached value for a key, or `default` if it is missing or expired.
+
+        Args:
+            key: The cache key.
+            default: The value returned on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self._misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """
+        Stores a value, replacing any existing entry for the key.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl_seconds: The lifetime of this entry. Defaults to the cache's TTL.
+        """
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+
+    def add(self, key: Hashable, value: Any = True, ttl_seconds: Optional[float] = None) -> bool:
+        """
+        Stores a value only if the key is not already present and unexpired.
+
+        The check and the insert happen under one lock, so concurrent callers
+        racing on the same key see exactly one success.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl_seconds: The lifetime of this entry. Defaults to the cache's TTL.
+
+        Returns:
+            True if the value was stored, False if a live entry already existed.
+        """
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return False
+            self._misses += 1
+            self._entries[key] = (now + ttl, value)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+            return True
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Removes a key and returns its value, or `default` if it was not cached."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > self._clock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns a snapshot of the cache's counters.
+
+        Returns:
+            A dictionary with `size`, `max_entries`, `hits`, `misses`,
+            `evictions`, and `hit_rate`.
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'size': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'hit_rate': self._hits / lookups if lookups else 0.0,
+            }
+
+    def _evict_locked(self):
+        """Drops expired entries, then least recently used ones, until within capacity. Caller holds the lock."""
+        if len(self._entries) <= self.max_entries:
+            return
+        now = self._clock()
+        for key in [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]:
+            del self._entries[key]
+            self._evictions += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._evictions += 1
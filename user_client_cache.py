@@ -0,0 +1,214 @@
+"""
+Reusable Row Level Security (RLS) Supabase clients, one per user.
+
+Every message used to sign a new user JWT, build a new Supabase client and
+authorize it, so each message paid for a fresh HTTP session. The
+`UserClientCache` keeps the authorized client of recently active users in a
+bounded LRU. A client's JWT is reused until it is close to expiry, and then
+re-signed and applied to the same client on a background thread, so hot
+users keep their client (and its open connections) and never wait for a
+refresh.
+
+Key Components:
+- `create_user_jwt`: Signs the JWT that authenticates a user for RLS.
+- `UserClientStats`: A data class of counters for the cache.
+- `UserClientCache`: The LRU of authorized per-user clients.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Set
+
+import jwt
+
+logger = logging.getLogger(__name__)
+
+
+def create_user_jwt(user_id: str, jwt_secret: str, ttl_seconds: float = 3600.0) -> str:
+    """
+    Generates a JWT for a given user ID.
+
+    Args:
+        user_id: The user's ID, used as the `sub` claim.
+        jwt_secret: The Supabase JWT secret.
+        ttl_seconds: How long the token is valid.
+
+    Returns:
+        The HS256-signed token.
+    """
+    now = datetime.now(timezone.utc)
+    payload = {
+        "sub": user_id,
+        "role": "authenticated",
+        "aud": "authenticated",
+        "iat": now,
+        "exp": now + timedelta(seconds=ttl_seconds)
+    }
+    return jwt.encode(payload, jwt_secret, algorithm="HS256")
+
+
+@dataclass
+class UserClientStats:
+    """
+    Counters for the per-user client cache.
+
+    Attributes:
+        hits (int): Requests served by a cached client.
+        misses (int): Requests that had to build a client.
+        refreshes (int): JWTs re-signed and applied to a cached client.
+        refresh_failures (int): Background refreshes that failed.
+        build_failures (int): Clients that could not be built.
+        evictions (int): Clients dropped to stay within capacity.
+    """
+    hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    refresh_failures: int = 0
+    build_failures: int = 0
+    evictions: int = 0
+
+
+@dataclass
+class _CachedClient:
+    """A cached client and the expiry (`time.monotonic()`) of the JWT applied to it."""
+    client: Any
+    token_expires_at: float
+
+
+class UserClientCache:
+    """
+    A bounded LRU of RLS-authorized Supabase clients, keyed by user ID.
+
+    The cache signs the JWTs itself. How a client is built and how a token
+    is applied to it are passed in, so the callers decide the transport.
+
+    Attributes:
+        max_entries (int): The most clients kept at once.
+        jwt_ttl_seconds (float): The lifetime of each signed JWT.
+        refresh_margin_seconds (float): How long before expiry a JWT is refreshed.
+    """
+
+    def __init__(self, build_client: Callable[[], Any], apply_token: Callable[[Any, str], None],
+                 jwt_secret: str, max_entries: int = 256, jwt_ttl_seconds: float = 3600.0,
+                 refresh_margin_seconds: float = 300.0):
+        """
+        Initializes an empty cache.
+
+        Args:
+            build_client: Returns a new, unauthenticated Supabase client.
+            apply_token: Authorizes a client with a user JWT.
+            jwt_secret: The Supabase JWT secret.
+            max_entries: The most clients kept at once.
+            jwt_ttl_seconds: The lifetime of each signed JWT.
+            refresh_margin_seconds: How long before expiry a JWT is refreshed.
+        """
+        self.max_entries = max_entries
+        self.jwt_ttl_seconds = jwt_ttl_seconds
+        self.refresh_margin_seconds = min(refresh_margin_seconds, jwt_ttl_seconds / 2)
+        self._build_client = build_client
+        self._apply_token = apply_token
+        self._jwt_secret = jwt_secret
+        self._entries: "OrderedDict[str, _CachedClient]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rls-client-refresh")
+        self._stats = UserClientStats()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[Any]:
+        """
+        Returns the user's authorized client, building it on first use.
+
+        A client whose JWT is about to expire is returned as-is while a fresh
+        JWT is applied in the background. A client whose JWT has expired is
+        re-authorized before it is returned.
+
+        Args:
+            user_id: The user's ID.
+
+        Returns:
+            The client, or None if it could not be built.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry.token_expires_at > now:
+                self._entries.move_to_end(user_id)
+                self._stats.hits += 1
+                if entry.token_expires_at - now <= self.refresh_margin_seconds and user_id not in self._refreshing:
+                    self._refreshing.add(user_id)
+                    self._executor.submit(self._refresh, user_id, entry)
+                return entry.client
+            self._stats.misses += 1
+
+        try:
+            client = entry.client if entry is not None else self._build_client()
+            token_expires_at = self._authorize(client, user_id)
+        except Exception as e:
+            logger.error(f"Error creating user-specific Supabase client for {user_id}: {e}", exc_info=True)
+            with self._lock:
+                self._stats.build_failures += 1
+            return None
+
+        with self._lock:
+            self._entries[user_id] = _CachedClient(client=client, token_expires_at=token_expires_at)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+        logger.info(f"Successfully created RLS-enabled client for user {user_id}")
+        return client
+
+    def _authorize(self, client: Any, user_id: str) -> float:
+        """Signs a new JWT, applies it to the client, and returns its expiry as `time.monotonic()`."""
+        # Count the lifetime from before signing, so the cached expiry is never later than the real one.
+        token_expires_at = time.monotonic() + self.jwt_ttl_seconds
+        self._apply_token(client, create_user_jwt(user_id, self._jwt_secret, self.jwt_ttl_seconds))
+        return token_expires_at
+
+    def _refresh(self, user_id: str, entry: _CachedClient):
+        """Applies a fresh JWT to a cached client (runs on a worker thread)."""
+        try:
+            token_expires_at = self._authorize(entry.client, user_id)
+        except Exception as e:
+            logger.warning(f"Could not refresh the RLS token for user {user_id}; it will be renewed on next use: {e}")
+            with self._lock:
+                self._refreshing.discard(user_id)
+                self._stats.refresh_failures += 1
+            return
+        with self._lock:
+            self._refreshing.discard(user_id)
+            entry.token_expires_at = token_expires_at
+            self._stats.refreshes += 1
+
+    def invalidate(self, user_id: str):
+        """
+        Drops a user's client, e.g. after an authorization error.
+
+        Args:
+            user_id: The user's ID.
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache's counters.
+
+        Returns:
+            A dictionary of counters plus `size`, `max_entries` and `hit_rate`.
+        """
+        with self._lock:
+            stats = asdict(self._stats)
+            stats['size'] = len(self._entries)
+        stats['max_entries'] = self.max_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def shutdown(self):
+        """Stops the refresh threads without waiting for running refreshes."""
+        self._executor.shutdown(wait=False)
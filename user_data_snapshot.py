@@ -0,0 +1,313 @@
+"""
+A request-scoped, lazily loaded copy of the user's tasks, journals and schedules.
+
+Several specialist agents read the same tables while handling one message:
+the TaskAgent reads `tasks` for categories, for matching and for batch
+operations, the JournalAgent reads `journals` for titles and categories, the
+ScheduleAgent reads `scheduled_actions`, and the FindingAgent reads both
+`tasks` and `journals`. This module loads each slice of a table (its rows
+with one status, or all of them) at most once per message, on first use, and
+serves every later read from memory. Write actions executed by the
+orchestrator are applied to the loaded rows in place, so the snapshot stays
+consistent with the database for the rest of the message.
+
+A slice holds only the columns the agents list and match on (journal
+contents, for example, are left out and read by ID) and at most `max_rows`
+of the newest rows. A read filtered by category on a slice that hit that
+limit is answered by its own query, so older rows are still found.
+
+Key Components:
+- `SnapshotStats`: A data class of counters for one snapshot.
+- `UserDataSnapshot`: The per-message snapshot shared by the agents.
+"""
+import logging
+import threading
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# The Supabase table behind each snapshot table, the column rows are ordered
+# by (newest first) or None if the table has no such column, and the columns loaded.
+SNAPSHOT_TABLES: Dict[str, Tuple[str, Optional[str], str]] = {
+    'tasks': ('tasks', 'created_at', 'id, title, description, category, status, priority, due_date, created_at'),
+    'journals': ('journals', 'created_at', 'id, title, category, entry_type, created_at'),
+    'schedules': ('scheduled_actions', None, '*'),
+}
+
+# How each executed action changes the snapshot: (table, operation, ID parameter).
+ACTION_EFFECTS: Dict[str, Tuple[str, str, Optional[str]]] = {
+    'create_task': ('tasks', 'create', None),
+    'update_task': ('tasks', 'update', 'task_id'),
+    'delete_task': ('tasks', 'delete', 'task_id'),
+    'create_journal_entry': ('journals', 'create', None),
+    'update_journal_entry': ('journals', 'update', 'id'),
+    'delete_journal_entry': ('journals', 'delete', 'id'),
+    'create_schedule': ('schedules', 'create', None),
+    'update_schedule': ('schedules', 'update', 'schedule_id'),
+    'delete_schedule': ('schedules', 'delete', 'schedule_id'),
+}
+
+
+@dataclass
+class SnapshotStats:
+    """
+    Counters for one `UserDataSnapshot`.
+
+    Attributes:
+        loads (int): The number of slice loads from Supabase.
+        reads (int): The number of reads served by the snapshot.
+        filtered_queries (int): Reads answered by their own query because the slice was truncated.
+        writes_applied (int): The number of executed actions applied in place.
+    """
+    loads: int = 0
+    reads: int = 0
+    filtered_queries: int = 0
+    writes_applied: int = 0
+
+
+@dataclass
+class _Slice:
+    """The loaded rows of one table with one status (or any status), newest first."""
+    rows: List[Dict[str, Any]]
+    complete: bool
+
+
+class UserDataSnapshot:
+    """
+    The user's tasks, journals and schedules for a single message.
+
+    Each slice is loaded on first access, guarded by a per-table lock so that
+    concurrent sub-tasks trigger a single load. A status read is served from
+    the all-status slice when that slice is loaded and complete. Reads return
+    copies of the rows, so callers may annotate them freely. A failed load
+    raises and is retried on the next access.
+
+    Attributes:
+        supabase (Client): The user's RLS-enabled Supabase client.
+        user_id (str): The UUID of the user.
+        max_rows (int): The most rows loaded into one slice.
+    """
+
+    def __init__(self, supabase: Any, user_id: str, max_rows: int = 500):
+        """
+        Initializes an empty snapshot. Nothing is read until first use.
+
+        Args:
+            supabase: The user's RLS-enabled Supabase client.
+            user_id: The UUID of the user.
+            max_rows: The most rows loaded into one slice.
+        """
+        self.supabase = supabase
+        self.user_id = user_id
+        self.max_rows = max(1, max_rows)
+        # table -> status (None for all statuses) -> slice
+        self._slices: Dict[str, Dict[Optional[str], _Slice]] = {table: {} for table in SNAPSHOT_TABLES}
+        self._locks = {table: threading.Lock() for table in SNAPSHOT_TABLES}
+        self._stats = SnapshotStats()
+        self._stats_lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # Reads
+    # --------------------------------------------------------------------------
+
+    def get_tasks(self, status: Optional[str] = None, categories: Optional[List[str]] = None,
+                  limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the user's tasks, newest first.
+
+        Args:
+            status: If given, only tasks with this status (e.g. "todo").
+            categories: If given, only tasks in one of these categories.
+            limit: If given, at most this many tasks.
+        """
+        return self._read('tasks', status, categories, limit)
+
+    def get_journals(self, categories: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the user's journal entries, newest first, without their content.
+
+        Args:
+            categories: If given, only entries in one of these categories.
+            limit: If given, at most this many entries.
+        """
+        return self._read('journals', None, categories, limit)
+
+    def get_schedules(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Returns the user's scheduled actions.
+
+        Args:
+            status: If given, only schedules with this status (e.g. "active").
+        """
+        return self._read('schedules', status)
+
+    def get_categories(self, table: str, status: Optional[str] = None) -> List[str]:
+        """
+        Returns the distinct, non-empty categories used in a table's loaded rows.
+
+        Args:
+            table: "tasks" or "journals".
+            status: If given, only rows with this status are considered.
+        """
+        rows = self._read(table, status)
+        return list({row['category'] for row in rows if row.get('category')})
+
+    def is_loaded(self, table: str, status: Optional[str] = None) -> bool:
+        """Returns True if the slice of `table` with `status` has already been loaded."""
+        return status in self._slices[table]
+
+    def is_complete(self, table: str, status: Optional[str] = None) -> bool:
+        """
+        Returns True if the slice of `table` with `status` holds all of the user's matching rows.
+
+        Loads the slice if needed. A slice that hit `max_rows` is incomplete.
+        """
+        table_slice, _ = self._ensure_loaded(table, status)
+        return table_slice.complete
+
+    def _read(self, table: str, status: Optional[str] = None, categories: Optional[List[str]] = None,
+              limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Returns copies of a slice's matching rows, loading the slice on first use."""
+        table_slice, filter_status = self._ensure_loaded(table, status)
+        with self._stats_lock:
+            self._stats.reads += 1
+        if categories is not None and not table_slice.complete:
+            return self._query(table, status, categories, limit)
+        wanted = set(categories) if categories is not None else None
+        with self._locks[table]:
+            rows = [dict(row) for row in table_slice.rows
+                    if (filter_status is None or row.get('status') == filter_status)
+                    and (wanted is None or row.get('category') in wanted)]
+        return rows[:limit] if limit is not None else rows
+
+    def _ensure_loaded(self, table: str, status: Optional[str]) -> Tuple[_Slice, Optional[str]]:
+        """
+        Loads a slice once; concurrent callers wait for the first load.
+
+        Returns the slice and the status its rows still have to be filtered by
+        (set when a status read is served from the complete all-status slice).
+        """
+        slices = self._slices[table]
+        with self._locks[table]:
+            if status in slices:
+                return slices[status], None
+            everything = slices.get(None)
+            if status is not None and everything is not None and everything.complete:
+                return everything, status
+            rows = self._query(table, status)
+            slices[status] = _Slice(rows=rows, complete=len(rows) < self.max_rows)
+        with self._stats_lock:
+            self._stats.loads += 1
+        logger.info(f"📸 Snapshot loaded {len(rows)} row(s) from '{SNAPSHOT_TABLES[table][0]}'"
+                    f"{f' with status {status!r}' if status else ''} for user '{self.user_id}'.")
+        return slices[status], None
+
+    def _query(self, table: str, status: Optional[str] = None, categories: Optional[List[str]] = None,
+               limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Reads the newest rows of a table that match the filters, up to `limit` or `max_rows`."""
+        db_table, order_column, columns = SNAPSHOT_TABLES[table]
+        query = self.supabase.table(db_table).select(columns).eq('user_id', self.user_id)
+        if status is not None:
+            query = query.eq('status', status)
+        if categories is not None:
+            query = query.in_('category', list(categories))
+            with self._stats_lock:
+                self._stats.filtered_queries += 1
+        if order_column:
+            query = query.order(order_column, desc=True)
+        return query.limit(min(limit, self.max_rows) if limit is not None else self.max_rows).execute().data or []
+
+    # --------------------------------------------------------------------------
+    # Writes
+    # --------------------------------------------------------------------------
+
+    def apply_action_result(self, action: Dict[str, Any], result: Any):
+        """
+        Applies one executed action to the loaded slices.
+
+        Slices that have not been loaded yet are left alone; they will reflect
+        the write when they are first read. A row whose status changes moves
+        to the slices of its new status. Failed actions are ignored.
+
+        Args:
+            action: The action dictionary passed to the `ActionExecutor`.
+            result: The executor's result for that action (`{'success': True, 'data': ...}`).
+        """
+        effect = ACTION_EFFECTS.get(action.get('type'))
+        if not effect or not isinstance(result, dict) or not result.get('success'):
+            return
+        table, operation, id_param = effect
+        if not self._slices[table]:
+            return
+
+        data = result.get('data')
+        returned_rows = [self._project(table, row) for row in (data if isinstance(data, list) else [data]) if isinstance(row, dict)]
+
+        with self._locks[table]:
+            for status, table_slice in self._slices[table].items():
+                rows = table_slice.rows
+                if operation == 'create':
+                    rows[:0] = [row for row in returned_rows if self._belongs(row, status)]
+                elif operation == 'update':
+                    for returned_row in returned_rows:
+                        index = next((i for i, row in enumerate(rows) if str(row.get('id')) == str(returned_row.get('id'))), None)
+                        if index is None:
+                            if self._belongs(returned_row, status):
+                                self._insert_in_order(table, rows, returned_row)
+                            continue
+                        updated = {**rows[index], **returned_row}
+                        if self._belongs(updated, status):
+                            rows[index] = updated
+                        else:
+                            del rows[index]
+                elif operation == 'delete':
+                    deleted_ids = {row.get('id') for row in returned_rows}
+                    if id_param and action.get(id_param) is not None:
+                        deleted_ids.add(action[id_param])
+                    deleted_ids = {str(row_id) for row_id in deleted_ids if row_id is not None}
+                    rows[:] = [row for row in rows if str(row.get('id')) not in deleted_ids]
+
+        with self._stats_lock:
+            self._stats.writes_applied += 1
+
+    @staticmethod
+    def _belongs(row: Dict[str, Any], status: Optional[str]) -> bool:
+        """Returns True if a row belongs in the slice of `status`."""
+        return status is None or row.get('status') == status
+
+    @staticmethod
+    def _project(table: str, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Keeps only the columns a slice of `table` holds."""
+        columns = SNAPSHOT_TABLES[table][2]
+        if columns == '*':
+            return dict(row)
+        fields = [column.strip() for column in columns.split(',')]
+        return {field: row[field] for field in fields if field in row}
+
+    @staticmethod
+    def _insert_in_order(table: str, rows: List[Dict[str, Any]], new_row: Dict[str, Any]):
+        """Inserts a row that moved into a slice at its newest-first position."""
+        order_column = SNAPSHOT_TABLES[table][1]
+        key = new_row.get(order_column) if order_column else None
+        if key is None:
+            rows.insert(0, new_row)
+            return
+        index = next((i for i, row in enumerate(rows) if (row.get(order_column) or '') < key), len(rows))
+        rows.insert(index, new_row)
+
+    # --------------------------------------------------------------------------
+    # Metrics
+    # --------------------------------------------------------------------------
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the snapshot's counters.
+
+        Returns:
+            A dictionary of counters plus `loaded_slices` ("table:status", or "table:*" for all statuses).
+        """
+        with self._stats_lock:
+            stats = asdict(self._stats)
+        stats['loaded_slices'] = sorted(f"{table}:{status or '*'}" for table, slices in self._slices.items() for status in slices)
+        return stats
@@ -1,14 +1,18 @@
 # --- Standard Library Imports ---
 import os
 import sys
+import hmac
 import logging
 import asyncio
-from datetime import datetime, timezone, timedelta
-from typing import Dict, Any, List, Optional
+import sqlite3
+import atexit
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Mapping, Optional
 
 # --- Third-Party Imports ---
 from flask import Flask, request, jsonify
-import jwt
 
 # --- Project-Specific Imports ---
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -22,34 +26,41 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
 
-def create_user_jwt(user_id: str, jwt_secret: str) -> str:
-    """Generates a JWT for a given user ID."""
-    payload = {
-        "sub": user_id,
-        "role": "authenticated",
-        "aud": "authenticated",
-        "iat": datetime.now(timezone.utc),
-        "exp": datetime.now(timezone.utc) + timedelta(hours=1)
-    }
-    return jwt.encode(payload, jwt_secret, algorithm="HS256")
-
-
 try:
     # --- Core Dependencies ---
-    from supabase import create_client, Client
+    from supabase import Client
 
     # --- Local Module Imports ---
     import config
     import services
     import database
     from api_key_manager import ApiKeyManager
+    from rate_limiter import KeyRateLimiter
+    from key_health_store import SQLiteKeyHealthStore, SupabaseKeyHealthStore
+    from llm_cache import LLMResponseCache
+    from hedging import HedgePolicy
+    from context_cache import GeminiContextCache
+    from prompt_budget import PromptBudget, PromptBudgets
+    from user_client_cache import UserClientCache
+    from supabase_transport import SupabaseTransport
+    from quota_leases import QuotaLeases
+    from history_writer import ConversationHistoryWriter
+    from deadline import Deadline, DeadlineExceeded, deadline_scope, remaining_seconds
+    from reply_streaming import ReplyStream
     from action_executor import ActionExecutor
     from database import DatabaseManager
+    from message_workers import MessageWorkerPool, InboundMessage
+    from dedup_cache import MessageDeduplicator
+    from agent_registry import AgentRegistry
+    from request_context import RequestContext
+    from user_data_snapshot import UserDataSnapshot
     import ai_tools
 
     # --- Agent Imports ---
     from src.multi_agent_system.agents.context_resolution_agent import ContextResolutionAgent
     from src.multi_agent_system.agents.audit_agent import AuditAgent
+    from src.multi_agent_system.agents.context_planning_agent import ContextPlanningAgent
+    from src.multi_agent_system.agents.fast_path_router import FastPathRouter
     from src.multi_agent_system.agents.journal_agent import JournalAgent
     from src.multi_agent_system.agents.brain_agent import BrainAgent
     from src.multi_agent_system.agents.task_agent import TaskAgent
@@ -70,17 +81,33 @@ class DatabaseConversationHistory:
     """
     Manages structured conversation history in a Supabase database.
     It relies on a database trigger to maintain a sliding window of conversations.
+    With a `ConversationHistoryWriter`, turns are numbered by the database and
+    rows the writer has not flushed yet are included in the recent context.
     """
-    def __init__(self, supabase_client: Client, user_id: str, max_history: int = 5):
+    def __init__(self, supabase_client: Client, user_id: str, max_history: int = 5,
+                 writer: Optional[ConversationHistoryWriter] = None):
         self.db: Client = supabase_client
         self.user_id: str = user_id
         self.max_history: int = max_history
+        self.writer: Optional[ConversationHistoryWriter] = writer
 
     def add_interaction(self, user_input: str, clarified_input: str, response: Any):
         """
         Adds a new interaction to the database and relies on a trigger
         to clean up old entries.
         """
+        interaction_record = {
+            'user_id': self.user_id,
+            'user_input': user_input,
+            'system_action': clarified_input,  # Mapping clarified_input to system_action
+            'entity_data': {'response': str(response) if response is not None else ''},
+            'created_at': datetime.now(timezone.utc).isoformat(),
+        }
+        if self.writer is not None:
+            # The writer numbers the turn in the database, in the background with write-behind.
+            self.writer.append(interaction_record)
+            return
+
         try:
             # 1. Get the latest conversation turn number for the user
             result = self.db.table('conversation_history') \
@@ -97,14 +124,7 @@ class DatabaseConversationHistory:
             new_turn = last_turn + 1
 
             # 2. Insert the new record
-            interaction_record = {
-                'user_id': self.user_id,
-                'user_input': user_input,
-                'system_action': clarified_input,  # Mapping clarified_input to system_action
-                'conversation_turn': new_turn,
-                'entity_data': {'response': str(response) if response is not None else ''}
-            }
-            
+            interaction_record['conversation_turn'] = new_turn
             self.db.table('conversation_history').insert(interaction_record).execute()
             logger.info(f"Logged interaction turn {new_turn} for user '{self.user_id}' to database.")
 
@@ -123,7 +143,9 @@ class DatabaseConversationHistory:
                 .limit(self.max_history) \
                 .execute()
 
-            if not result.data:
+            rows = list(reversed(result.data or []))
+            rows += self._unflushed_rows(rows)
+            if not rows:
                 return []
 
             # Reformat to match the structure expected by the context agent
@@ -134,7 +156,7 @@ class DatabaseConversationHistory:
                     'clarified_input': row['system_action'],
                     'response': row.get('entity_data', {}).get('response', ''),
                     'timestamp': row['created_at']
-                } for row in reversed(result.data)
+                } for row in rows[-self.max_history:]
             ]
             return history
 
@@ -142,6 +164,20 @@ class DatabaseConversationHistory:
             logger.error(f"❌ Failed to get conversation history from DB for user '{self.user_id}': {e}", exc_info=True)
             return []
 
+    def _unflushed_rows(self, stored_rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Returns the writer's queued rows for this user that are newer than the newest stored row."""
+        if self.writer is None:
+            return []
+        pending = self.writer.pending_for(self.user_id)
+        if not pending or not stored_rows:
+            return pending
+        # A row written between the query and this call is in both; keep only the queued rows after it.
+        try:
+            newest_stored = datetime.fromisoformat(stored_rows[-1]['created_at'])
+            return [row for row in pending if datetime.fromisoformat(row['created_at']) > newest_stored]
+        except (KeyError, TypeError, ValueError):
+            return pending
+
 
 class TodowaApp:
     def __init__(self):
@@ -150,6 +186,8 @@ class TodowaApp:
         # --- Agent Placeholders ---
         self.context_agent: ContextResolutionAgent = None
         self.audit_agent: AuditAgent = None
+        self.context_planning_agent: Optional[ContextPlanningAgent] = None
+        self.fast_path_router: Optional[FastPathRouter] = None
         self.journal_agent: JournalAgent = None
         self.brain_agent: BrainAgent = None
         self.task_agent: TaskAgent = None
@@ -158,6 +196,12 @@ class TodowaApp:
         self.financial_agent: Optional[FinancialAgent] = None
         self.fallback_agent: GeneralFallbackAgent = None
         self.answering_agent: AnsweringAgent = None
+        self.agent_registry: Optional[AgentRegistry] = None
+        self.prompt_budgets: Optional[PromptBudgets] = None
+        self.user_clients: Optional[UserClientCache] = None
+        self.supabase_transport: Optional[SupabaseTransport] = None
+        self.usage_leases: Optional[QuotaLeases] = None
+        self.history_writer: Optional[ConversationHistoryWriter] = None
         self._is_initialized = False
         # The in-memory user_histories dictionary has been removed.
 
@@ -167,18 +211,104 @@ class TodowaApp:
 
         logger.info("🔧 Initializing Todowa system...")
         try:
-            self.supabase = create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
+            self.supabase_transport = SupabaseTransport(
+                max_connections=config.SUPABASE_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=config.SUPABASE_POOL_MAX_KEEPALIVE,
+                keepalive_expiry_seconds=config.SUPABASE_POOL_KEEPALIVE_EXPIRY_SECONDS,
+                timeout_seconds=config.SUPABASE_HTTP_TIMEOUT_SECONDS,
+                http2=config.SUPABASE_HTTP2_ENABLED,
+            )
+            self.supabase = self.supabase_transport.create_client(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY)
             logger.info("✅ Supabase connected")
+            self.user_clients = UserClientCache(
+                # Each client uses the anon key and the shared connection pool; the user JWT handles authorization.
+                build_client=lambda: self.supabase_transport.create_client(config.SUPABASE_URL, config.SUPABASE_ANON_KEY),
+                # The JWT is sent as the Authorization header of every database request.
+                apply_token=SupabaseTransport.authorize,
+                jwt_secret=config.SUPABASE_JWT_SECRET,
+                max_entries=config.RLS_CLIENT_CACHE_SIZE,
+                jwt_ttl_seconds=config.RLS_JWT_TTL_SECONDS,
+                refresh_margin_seconds=config.RLS_JWT_REFRESH_MARGIN_SECONDS,
+            )
+            if config.USAGE_LEASES_ENABLED:
+                self.usage_leases = QuotaLeases(lease_size=config.USAGE_LEASE_SIZE, ttl_seconds=config.USAGE_LEASE_TTL_SECONDS)
+                logger.info(f"🎟️ Usage quota leases enabled ({config.USAGE_LEASE_SIZE} messages per lease)")
+            # History rows are written with the service client, so rows of many users can share one batch.
+            self.history_writer = ConversationHistoryWriter(
+                self.supabase,
+                write_behind=config.HISTORY_WRITE_BEHIND_ENABLED,
+                batch_size=config.HISTORY_BATCH_SIZE,
+                flush_interval_seconds=config.HISTORY_FLUSH_INTERVAL_SECONDS,
+                max_pending=config.HISTORY_MAX_PENDING,
+            )
 
             gemini_keys_dict = config.get_gemini_api_keys()
-            self.api_key_manager = ApiKeyManager(gemini_keys=gemini_keys_dict)
+            rate_limiter = None
+            if config.GEMINI_RATE_LIMIT_ENABLED:
+                rate_limiter = KeyRateLimiter(
+                    requests_per_minute=config.GEMINI_RPM_PER_KEY,
+                    tokens_per_minute=config.GEMINI_TPM_PER_KEY,
+                    max_wait_seconds=config.GEMINI_RATE_LIMIT_MAX_WAIT_SECONDS,
+                )
+            health_store = None
+            if config.KEY_HEALTH_STORE == "supabase":
+                health_store = SupabaseKeyHealthStore(self.supabase)
+            elif config.KEY_HEALTH_STORE == "sqlite":
+                try:
+                    health_store = SQLiteKeyHealthStore(config.KEY_HEALTH_SQLITE_PATH)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not open the key health store at {config.KEY_HEALTH_SQLITE_PATH}; key health stays in memory: {e}")
+            response_cache = None
+            if config.LLM_CACHE_ENABLED and config.LLM_CACHE_AGENTS:
+                response_cache = LLMResponseCache(
+                    enabled_agents=config.LLM_CACHE_AGENTS,
+                    max_entries=config.LLM_CACHE_MAX_ENTRIES,
+                    ttl_seconds=config.LLM_CACHE_TTL_SECONDS,
+                    sqlite_path=config.LLM_CACHE_SQLITE_PATH,
+                )
+            hedge_policy = None
+            if config.GEMINI_HEDGE_ENABLED:
+                hedge_policy = HedgePolicy(
+                    percentile=config.GEMINI_HEDGE_PERCENTILE,
+                    min_samples=config.GEMINI_HEDGE_MIN_SAMPLES,
+                )
+            context_cache = None
+            if config.GEMINI_CONTEXT_CACHE_ENABLED:
+                context_cache = GeminiContextCache(
+                    ttl_seconds=config.GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+                    min_tokens=config.GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+                )
+            self.api_key_manager = ApiKeyManager(
+                gemini_keys=gemini_keys_dict,
+                rate_limiter=rate_limiter,
+                quota_cooldown_seconds=config.GEMINI_KEY_COOLDOWN_SECONDS,
+                max_cooldown_seconds=config.GEMINI_KEY_MAX_COOLDOWN_SECONDS,
+                health_store=health_store,
+                sync_interval_seconds=config.KEY_HEALTH_SYNC_SECONDS,
+                response_cache=response_cache,
+                hedge_policy=hedge_policy,
+                context_cache=context_cache,
+            )
             gemini_key_count = self.api_key_manager.get_key_count()
             logger.info(f"🔑 API Key Manager initialized with {gemini_key_count} Gemini key(s).")
             
             self.context_agent = ContextResolutionAgent(ai_model=self.api_key_manager.create_ai_model("context_agent"))
             self.audit_agent = AuditAgent(ai_model=self.api_key_manager.create_ai_model("audit_agent"))
+            if config.FUSED_PLANNING_ENABLED:
+                self.context_planning_agent = ContextPlanningAgent(ai_model=self.api_key_manager.create_ai_model("context_planning_agent"))
+                logger.info("🔗 Fused context resolution + planning is enabled.")
+            if config.FAST_PATH_ROUTER_ENABLED:
+                self.fast_path_router = FastPathRouter(min_confidence=config.FAST_PATH_MIN_CONFIDENCE)
             self.brain_agent = BrainAgent(ai_model=self.api_key_manager.create_ai_model("brain_agent"))
-            # DB-dependent agents are now initialized per-request in process_message_async
+            # DB-dependent agents are built lazily per request from the registry,
+            # which shares one model handle per agent across all requests.
+            if config.PROMPT_BUDGET_ENABLED:
+                self.prompt_budgets = PromptBudgets(
+                    budgets=config.PROMPT_BUDGET_TOKENS,
+                    default_tokens=config.PROMPT_BUDGET_DEFAULT_TOKENS,
+                    max_field_chars=config.PROMPT_BUDGET_MAX_FIELD_CHARS,
+                )
+            self.agent_registry = self._create_agent_registry()
             self.journal_agent = None
             self.task_agent = None
             self.schedule_agent = None
@@ -197,47 +327,107 @@ class TodowaApp:
             self._is_initialized = False
             return False
 
+    def _create_agent_registry(self) -> AgentRegistry:
+        """Registers every routable agent. Nothing is built until a request routes to it."""
+        registry = AgentRegistry(self.api_key_manager)
+        registry.register("TaskAgent", lambda model, db: TaskAgent(ai_model=model, supabase=db, prompt_budget=self._get_prompt_budget("task_agent")), model_name="task_agent")
+        registry.register("JournalAgent", lambda model, db: JournalAgent(ai_model=model, supabase=db, prompt_budget=self._get_prompt_budget("journal_agent")), model_name="journal_agent")
+        registry.register("BrainAgent", lambda model, db: self.brain_agent)
+        registry.register("ScheduleAgent", lambda model, db: ScheduleAgent(ai_model=model, supabase=db), model_name="schedule_agent")
+        registry.register("FindingAgent", lambda model, db: FindingAgent(ai_model=model, supabase=db, prompt_budget=self._get_prompt_budget("finding_agent")), model_name="finding_agent")
+        registry.register("FinancialAgent", lambda model, db: FinancialAgent(ai_model=model, supabase=db), model_name="financial_agent")
+        registry.register("TechSupportAgent", lambda model, db: TechSupportAgent(ai_model=model, supabase=db), model_name="tech_support_agent")
+        registry.register("GuideAgent", lambda model, db: GuideAgent())
+        registry.register("GeneralFallback", lambda model, db: GeneralFallbackAgent(ai_model=model, supabase=db), model_name="fallback_agent")
+        registry.register("AnsweringAgent", lambda model, db: AnsweringAgent(ai_model=model, supabase=db, use_templates=config.RESPONSE_TEMPLATES_ENABLED),
+                          model_name="answering_agent", chat_model=True, routable=False)
+        return registry
+
+    def _get_prompt_budget(self, agent_name: str) -> Optional[PromptBudget]:
+        """Returns an agent's prompt budget, or None if prompt budgets are disabled."""
+        return self.prompt_budgets.get(agent_name) if self.prompt_budgets is not None else None
+
     def create_user_supabase_client(self, user_id: str) -> Optional[Client]:
         """
-        Creates a new Supabase client authenticated as a specific user
-        by generating a custom JWT. This client will enforce RLS.
+        Returns a Supabase client authenticated as a specific user by a
+        custom JWT. This client will enforce RLS.
+
+        Clients are kept in `user_clients` and reused across messages; their
+        JWT is re-signed in the background shortly before it expires.
         """
-        if not self.supabase or not hasattr(config, 'SUPABASE_JWT_SECRET') or not hasattr(config, 'SUPABASE_ANON_KEY'):
+        if not self.supabase or self.user_clients is None or not hasattr(config, 'SUPABASE_JWT_SECRET') or not hasattr(config, 'SUPABASE_ANON_KEY'):
             logger.error("System not properly initialized for RLS. SUPABASE_JWT_SECRET or SUPABASE_ANON_KEY missing from config.")
             return None
 
-        try:
-            user_jwt = create_user_jwt(user_id, config.SUPABASE_JWT_SECRET)
-            # Create a new client instance. We use the anon key, and the JWT will handle user auth.
-            user_supabase_client = create_client(config.SUPABASE_URL, config.SUPABASE_ANON_KEY)
-            # Set the session for the client. This will attach the Authorization header for all subsequent requests.
-            user_supabase_client.auth.set_session(access_token=user_jwt, refresh_token="dummy-refresh-token-for-rls")
-            logger.info(f"Successfully created RLS-enabled client for user {user_id}")
-            return user_supabase_client
-        except Exception as e:
-            logger.error(f"Error creating user-specific Supabase client for {user_id}: {e}", exc_info=True)
-            return None
+        return self.user_clients.get(user_id)
 
-    async def process_message_async(self, message: str, user_id: str, user_supabase_client: Client) -> str:
+    async def process_message_async(self, message: str, user_id: str, user_supabase_client: Client,
+                                    started_at: Optional[float] = None,
+                                    reply_stream: Optional[ReplyStream] = None) -> str:
+        """
+        Runs the agent pipeline for one message within the message time budget.
+
+        The budget (`config.MESSAGE_DEADLINE_SECONDS`) starts when processing
+        starts, so time spent waiting in the worker queue is not charged to
+        it, and every Gemini call made while handling the message is bounded
+        by the time that is left.
+
+        Args:
+            message: The user's message.
+            user_id: The UUID of the user.
+            user_supabase_client: The user's RLS-enabled Supabase client.
+            started_at: The Unix time processing started (when a worker dequeued
+                        the message, or when the webhook received it on the
+                        inline path). Defaults to now.
+            reply_stream: An optional `ReplyStream`. AI-synthesized replies are
+                          sent through it paragraph by paragraph while they are
+                          generated; the caller then passes the returned reply
+                          to `reply_stream.finish`.
+
+        Returns:
+            The full reply for the user.
+        """
+        deadline = None
+        if config.MESSAGE_DEADLINE_SECONDS > 0:
+            deadline = Deadline.after(config.MESSAGE_DEADLINE_SECONDS, started_at=started_at)
+        with deadline_scope(deadline):
+            return await self._process_message(message, user_id, user_supabase_client, reply_stream)
+
+    async def _process_message(self, message: str, user_id: str, user_supabase_client: Client,
+                               reply_stream: Optional[ReplyStream] = None) -> str:
         if not self._is_initialized:
             return "❌ The server is not properly initialized. Please contact support."
 
         final_response_text = ""
         resolved_command = ""
 
+        # Agents are built on first use and bound to the user's RLS-enabled client.
+        # The data snapshot lets them share one read of each table for this message.
+        data_snapshot = UserDataSnapshot(user_supabase_client, user_id, max_rows=config.USER_DATA_SNAPSHOT_MAX_ROWS) if config.USER_DATA_SNAPSHOT_ENABLED else None
+        agents = self.agent_registry.bind(user_supabase_client, data_snapshot=data_snapshot)
         # Answering agent is used in success and error paths, so initialize it early.
-        answering_agent = AnsweringAgent(ai_model=self.api_key_manager.create_chat_model("answering_agent"), supabase=user_supabase_client)
+        answering_agent = agents["AnsweringAgent"]
 
         # Instantiate managers with the user-specific, RLS-enabled client
-        history_manager = DatabaseConversationHistory(user_supabase_client, user_id)
+        history_manager = DatabaseConversationHistory(user_supabase_client, user_id, writer=self.history_writer)
         
         try:
             db_manager = DatabaseManager(user_supabase_client, user_id)
             logger.info(f"💬 Processing for user '{user_id}': '{message}'")
             
-            # STAGE 1: CONTEXT RESOLUTION
-            conversation_history = history_manager.get_recent_context()
-            context_result = self.context_agent.resolve_context(message, conversation_history)
+            # STAGE 0: PREFETCH every independent per-message read concurrently, once.
+            request_context = await RequestContext.prefetch(user_id, user_supabase_client, history_manager)
+            conversation_history = request_context.conversation_history
+            user_context = self._build_user_context(request_context)
+
+            # STAGE 1: CONTEXT RESOLUTION (fused with planning when enabled)
+            fused_result = None
+            if self.context_planning_agent is not None:
+                fused_result = await self.context_planning_agent.resolve_and_plan_async(message, conversation_history)
+            if fused_result is not None:
+                context_result = fused_result
+            else:
+                context_result = await self.context_agent.resolve_context_async(message, conversation_history)
             
             if context_result.get("status") != "SUCCESS":
                  final_response_text = f"I need more information: {context_result.get('reason', 'Could you please rephrase?')}"
@@ -247,28 +437,29 @@ class TodowaApp:
             resolved_command = context_result.get("resolved_command", message)
             logger.info(f"✅ Context Resolved: '{resolved_command}'")
 
-            # STAGE 2: AUDIT & PLANNING
-            execution_plan = self.audit_agent.create_execution_plan(resolved_command, conversation_history)
+            # STAGE 2: AUDIT & PLANNING (already done by the fused stage when it succeeded)
+            fast_path = None
+            if fused_result is None and self.fast_path_router is not None:
+                fast_path = self.fast_path_router.route(resolved_command)
+            if fused_result is not None:
+                execution_plan = {'sub_tasks': fused_result['sub_tasks']}
+            elif fast_path is not None:
+                execution_plan = {'sub_tasks': [fast_path.to_sub_task(resolved_command)]}
+            else:
+                execution_plan = await self.audit_agent.create_execution_plan_async(resolved_command, conversation_history)
             sub_tasks = execution_plan.get('sub_tasks', [])
             
             logger.info(f"✅ Plan Created: Found {len(sub_tasks)} sub-task(s) for delegation.")
 
-            # Initialize DB-dependent agents now that we need them
-            task_agent = TaskAgent(ai_model=self.api_key_manager.create_ai_model("task_agent"), supabase=user_supabase_client)
-            journal_agent = JournalAgent(ai_model=self.api_key_manager.create_ai_model("journal_agent"), supabase=user_supabase_client)
-            schedule_agent = ScheduleAgent(ai_model=self.api_key_manager.create_ai_model("schedule_agent"), supabase=user_supabase_client)
-            finding_agent = FindingAgent(ai_model=self.api_key_manager.create_ai_model("finding_agent"), supabase=user_supabase_client)
-            financial_agent = FinancialAgent(ai_model=self.api_key_manager.create_ai_model("financial_agent"), supabase=user_supabase_client)
-            tech_support_agent = TechSupportAgent(ai_model=self.api_key_manager.create_ai_model("tech_support_agent"), supabase=user_supabase_client)
-            guide_agent = GuideAgent()
-            fallback_agent = GeneralFallbackAgent(ai_model=self.api_key_manager.create_ai_model("fallback_agent"), supabase=user_supabase_client)
-
             if not sub_tasks:
                 logger.warning(f"Audit Agent failed to create a plan for: '{resolved_command}'. Falling back.")
-                user_context = await self._build_user_context(user_id, user_supabase_client)
-                agent_response = fallback_agent.process_command(user_command=resolved_command, user_context=user_context)
+                agent_response = await asyncio.to_thread(
+                    agents["GeneralFallback"].process_command, user_command=resolved_command, user_context=user_context
+                )
                 
-                final_response_text = answering_agent.process_response(agent_response)
+                final_response_text = await answering_agent.process_response_async(
+                    agent_response, communication_style=request_context.communication_style, reply_stream=reply_stream
+                )
                 return final_response_text
 
             TASK_LIMIT = 3
@@ -278,43 +469,14 @@ class TodowaApp:
             
             all_agent_responses, all_actions_to_execute = [], []
             
-            agent_map = {
-                "TaskAgent": task_agent,
-                "JournalAgent": journal_agent,
-                "BrainAgent": self.brain_agent,
-                "ScheduleAgent": schedule_agent,
-                "FindingAgent": finding_agent,
-                "FinancialAgent": financial_agent,
-                "TechSupportAgent": tech_support_agent,
-                "GuideAgent": guide_agent,
-                "GeneralFallback": fallback_agent,
-            }
-
-            user_context = await self._build_user_context(user_id, user_supabase_client)
-
-            for task in sub_tasks:
-                clarified_command = task.get('clarified_command')
-                route_to = task.get('route_to')
-                
-                if not clarified_command or not route_to:
-                    continue
-
-                logger.info(f"  - Delegating to {route_to}: '{clarified_command}'")
-                
-                if route_to in agent_map:
-                    specialist_agent = agent_map[route_to]
-                    agent_response = specialist_agent.process_command(user_command=clarified_command, user_context=user_context)
-                    
-                    if agent_response:
-                        if 'user_context' not in agent_response:
-                            agent_response['user_context'] = user_context
-                        
-                        all_agent_responses.append(agent_response)
-                        all_actions_to_execute.extend(agent_response.get('actions', []))
+            agent_responses = await self._run_sub_tasks(sub_tasks, agents, user_context)
+            for agent_response in agent_responses:
+                all_agent_responses.append(agent_response)
+                all_actions_to_execute.extend(agent_response.get('actions', []))
             
             execution_result = {}
             if all_actions_to_execute:
-                execution_result = await self._execute_json_actions(user_id, all_actions_to_execute, db_manager)
+                execution_result = await self._execute_json_actions(user_id, all_actions_to_execute, db_manager, data_snapshot)
 
             final_response_context = {
                 'source': 'MultiAgentExecution',
@@ -322,10 +484,15 @@ class TodowaApp:
                 'agent_responses': all_agent_responses,
                 'execution_result': execution_result,
                 'user_context': user_context,
+                'communication_style': request_context.communication_style,
             }
-            final_response_text = answering_agent.process_multi_response(final_response_context)
+            final_response_text = await answering_agent.process_multi_response_async(final_response_context, reply_stream=reply_stream)
             return final_response_text
 
+        except DeadlineExceeded as e:
+            logger.warning(f"⏱️ Message from user '{user_id}' ran out of time: {e}")
+            final_response_text = "That took longer than expected. Please try again in a moment."
+            return final_response_text
         except Exception as e:
             logger.error(f"❌ An unexpected error occurred for user '{user_id}': {e}", exc_info=True)
             final_response_text = answering_agent.process_error("I ran into an unexpected problem.")
@@ -337,26 +504,130 @@ class TodowaApp:
                 response=final_response_text
             )
 
-    async def _build_user_context(self, user_id: str, user_supabase_client: Client) -> Dict[str, Any]:
-        context = {
-            'user_info': {'timezone': 'GMT+7', 'user_id': user_id},
-            'ai_brain': []
-        }
-        if not user_supabase_client:
-            return context
-        try:
-            brain_result = await user_supabase_client.table('ai_brain_memories').select('*').eq('user_id', user_id).limit(10).execute()
-            if brain_result.data:
-                context['ai_brain'] = brain_result.data
-        except Exception as e:
-            logger.warning(f"Could not fetch ai_brain context from database: {e}")
-        return context
+    @staticmethod
+    def _group_sub_tasks(sub_tasks: List[Dict[str, Any]]) -> List[List[int]]:
+        """
+        Groups sub-task indices into chains that must run sequentially.
+
+        A sub-task joins the previous sub-task's chain when the AuditAgent marks it
+        `depends_on_previous`, and joins any chain already using the same agent,
+        since agent instances are not safe to call from two threads at once.
+        Different chains run concurrently.
+        """
+        chain_of: Dict[int, int] = {}
+        chains: Dict[int, List[int]] = {}
+        chain_by_agent: Dict[str, int] = {}
+
+        for index, task in enumerate(sub_tasks):
+            candidates = set()
+            if index > 0 and task.get('depends_on_previous') is True:
+                candidates.add(chain_of[index - 1])
+            route_to = task.get('route_to')
+            if route_to in chain_by_agent:
+                candidates.add(chain_by_agent[route_to])
+
+            if not candidates:
+                chain_id = index
+                chains[chain_id] = []
+            else:
+                # Merge every chain this sub-task is tied to into the oldest one.
+                chain_id = min(candidates)
+                for other_id in candidates - {chain_id}:
+                    for member in chains.pop(other_id):
+                        chain_of[member] = chain_id
+                        chains[chain_id].append(member)
+                    for agent_name, agent_chain in chain_by_agent.items():
+                        if agent_chain == other_id:
+                            chain_by_agent[agent_name] = chain_id
+
+            chains[chain_id].append(index)
+            chain_of[index] = chain_id
+            if route_to:
+                chain_by_agent[route_to] = chain_id
+
+        return [sorted(members) for _, members in sorted(chains.items())]
+
+    async def _run_sub_tasks(self, sub_tasks: List[Dict[str, Any]], agent_map: Mapping[str, Any],
+                             user_context: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Runs the planned sub-tasks on their specialist agents concurrently.
+
+        Independent chains (see `_group_sub_tasks`) run in parallel worker threads,
+        each sub-task bounded by `config.SUBTASK_TIMEOUT_SECONDS`. The responses are
+        returned in plan order so that actions execute in the order the user asked.
+        """
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(sub_tasks)
+
+        async def run_chain(chain: List[int]):
+            previous_failed = False
+            for index in chain:
+                task = sub_tasks[index]
+                clarified_command = task.get('clarified_command')
+                route_to = task.get('route_to')
+                if not clarified_command or route_to not in agent_map:
+                    continue
+
+                if previous_failed and task.get('depends_on_previous') is True:
+                    logger.warning(f"  - Skipping {route_to}: '{clarified_command}' because the step it depends on failed.")
+                    responses[index] = {
+                        'success': False, 'actions': [],
+                        'response': "I skipped this step because the step before it did not complete.",
+                        'error': 'dependency_failed',
+                    }
+                    continue
+
+                logger.info(f"  - Delegating to {route_to}: '{clarified_command}'")
+                # A sub-task never gets more time than the message has left.
+                remaining = remaining_seconds()
+                timeout = config.SUBTASK_TIMEOUT_SECONDS if remaining is None else min(config.SUBTASK_TIMEOUT_SECONDS, remaining)
+                try:
+                    specialist_agent = agent_map[route_to]
+                    agent_response = await asyncio.wait_for(
+                        asyncio.to_thread(specialist_agent.process_command,
+                                          user_command=clarified_command, user_context=user_context),
+                        timeout=timeout,
+                    )
+                except asyncio.TimeoutError:
+                    # The worker thread cannot be cancelled; its result is discarded when it finishes.
+                    logger.error(f"  - {route_to} timed out after {timeout:.1f}s on '{clarified_command}'.")
+                    agent_response = {
+                        'success': False, 'actions': [],
+                        'response': "This part of your request took too long, so I stopped waiting for it.",
+                        'error': 'timeout',
+                    }
+                except Exception as e:
+                    logger.error(f"  - {route_to} failed on '{clarified_command}': {e}", exc_info=True)
+                    agent_response = {
+                        'success': False, 'actions': [],
+                        'response': "Something went wrong with this part of your request.",
+                        'error': str(e),
+                    }
+
+                if agent_response:
+                    if 'user_context' not in agent_response:
+                        agent_response['user_context'] = user_context
+                    responses[index] = agent_response
+                previous_failed = not agent_response or agent_response.get('success') is False
+
+        chains = self._group_sub_tasks(sub_tasks)
+        logger.info(f"⚡ Running {len(sub_tasks)} sub-task(s) as {len(chains)} concurrent chain(s).")
+        await asyncio.gather(*(run_chain(chain) for chain in chains))
+        return [response for response in responses if response]
+
+    def _build_user_context(self, request_context: RequestContext) -> Dict[str, Any]:
+        """Builds the user_context passed to the specialist agents from the prefetched request context."""
+        return request_context.to_user_context()
     
-    async def _execute_json_actions(self, user_id: str, actions: List[Dict[str, Any]], db_manager: DatabaseManager) -> Dict[str, Any]:
+    async def _execute_json_actions(self, user_id: str, actions: List[Dict[str, Any]], db_manager: DatabaseManager,
+                                    data_snapshot: Optional[UserDataSnapshot] = None) -> Dict[str, Any]:
         if not actions: return {'success': True, 'results': []}
         try:
             executor = ActionExecutor(db_manager, user_id)
             execution_results = executor.execute_actions(actions)
+            if data_snapshot is not None:
+                # Keep the snapshot consistent with the writes for the rest of the message.
+                for action, result in zip(actions, execution_results):
+                    data_snapshot.apply_action_result(action, result)
             successful_count = sum(1 for r in execution_results if not (isinstance(r, dict) and 'error' in r))
             total_count = len(execution_results)
             logger.info(f"📊 Execution: {successful_count}/{total_count} successful for user '{user_id}'.")
@@ -373,6 +644,71 @@ chat_app = TodowaApp()
 logger.info("Starting Todowa application setup...")
 if not chat_app.initialize_system():
     logger.critical("FATAL: Todowa Application failed to initialize. The app may not work correctly.")
+if chat_app.history_writer is not None:
+    # Registered before the worker pool, so it runs after the pool has finished its last messages.
+    atexit.register(chat_app.history_writer.close)
+
+# --- Background worker pool for asynchronous webhook intake. ---
+worker_pool: Optional[MessageWorkerPool] = None
+if config.ASYNC_WEBHOOK_ENABLED:
+    worker_pool = MessageWorkerPool(
+        chat_app,
+        worker_count=config.WEBHOOK_WORKER_COUNT,
+        max_queue_size=config.WEBHOOK_QUEUE_MAXSIZE,
+        max_queue_depth_per_user=config.WEBHOOK_MAX_QUEUE_PER_USER,
+        max_active_users=config.WEBHOOK_MAX_ACTIVE_USERS,
+        stream_replies=config.STREAMING_REPLIES_ENABLED,
+        stream_chunk_chars=(config.STREAMING_MIN_CHUNK_CHARS, config.STREAMING_MAX_CHUNK_CHARS),
+    )
+    worker_pool.start()
+    atexit.register(worker_pool.stop)
+
+# --- Threads used to overlap independent reads inside the webhook request. ---
+prefetch_executor = ThreadPoolExecutor(max_workers=config.WEBHOOK_PREFETCH_THREADS, thread_name_prefix="todowa-prefetch")
+atexit.register(prefetch_executor.shutdown, wait=False)
+
+# --- Deduplication of provider retries, checked before any other work. ---
+deduplicator: Optional[MessageDeduplicator] = None
+if config.DEDUP_ENABLED:
+    deduplicator = MessageDeduplicator(
+        ttl_seconds=config.DEDUP_TTL_SECONDS,
+        max_entries=config.DEDUP_MAX_ENTRIES,
+        sqlite_path=config.DEDUP_SQLITE_PATH,
+        text_fallback=config.DEDUP_TEXT_FALLBACK_ENABLED,
+        text_window_seconds=config.DEDUP_TIME_BUCKET_SECONDS,
+    )
+
+# --- Cache of phone number to user ID lookups, including unregistered numbers. ---
+phone_cache: Optional[database.PhoneLookupCache] = None
+if config.PHONE_CACHE_ENABLED:
+    phone_cache = database.PhoneLookupCache(
+        max_entries=config.PHONE_CACHE_MAX_ENTRIES,
+        ttl_seconds=config.PHONE_CACHE_TTL_SECONDS,
+        negative_ttl_seconds=config.PHONE_CACHE_NEGATIVE_TTL_SECONDS,
+    )
+
+@app.route('/hooks/user-registered', methods=['POST'])
+def user_registered_hook():
+    """Clears cached phone lookups after a registration, e.g. from a Supabase database webhook on `user_whatsapp`."""
+    if not config.REGISTRATION_HOOK_SECRET:
+        return jsonify({"status": "error", "message": "Registration hook is not configured"}), 404
+    if not hmac.compare_digest(request.headers.get('X-Webhook-Secret', ''), config.REGISTRATION_HOOK_SECRET):
+        return jsonify({"status": "error", "message": "Invalid secret"}), 403
+
+    data = request.get_json(silent=True) or {}
+    # Accepts {"phone": ...} or a database webhook payload with `record` and `old_record`.
+    phones = {data.get('phone')}
+    for key in ('record', 'old_record'):
+        if isinstance(data.get(key), dict):
+            phones.add(data[key].get('phone'))
+    phones.discard(None)
+    if not phones:
+        return jsonify({"status": "error", "message": "Missing 'phone'"}), 400
+    if phone_cache is not None:
+        for phone in phones:
+            phone_cache.invalidate(phone)
+        logger.info(f"📇 Cleared the cached user lookup of {len(phones)} phone number(s) after a registration event.")
+    return jsonify({"status": "ok", "invalidated": len(phones)}), 200
 
 @app.route('/webhook', methods=['POST', 'GET'])
 def webhook():
@@ -380,6 +716,7 @@ def webhook():
         return jsonify({"status": "verified"}), 200
         
     sender_phone = None
+    received_at = time.time()
     try:
         data = request.get_json()
         if not data: return jsonify({"status": "error", "message": "Invalid JSON"}), 400
@@ -389,26 +726,75 @@ def webhook():
         if not sender_phone or not message_text:
             return jsonify({"status": "error", "message": "Missing 'sender' or 'message'"}), 400
 
-        user_id = database.get_user_id_by_phone(chat_app.supabase, sender_phone)
+        dedup_key = None
+        if deduplicator is not None:
+            dedup_key = deduplicator.claim(data)
+            if dedup_key is None:
+                logger.info(f"Ignoring a duplicate delivery from {sender_phone}.")
+                return jsonify({"status": "duplicate_ignored"}), 200
+
+        user_id = database.get_user_id_by_phone(chat_app.supabase, sender_phone, phone_cache)
         if not user_id:
             reply = "Welcome! To use this service, please sign up on our website first."
             services.send_fonnte_message(sender_phone, reply)
             return jsonify({"status": "unauthorized_user_prompted"}), 200
 
-        is_allowed, limit_message = database.check_and_update_usage(chat_app.supabase, sender_phone, user_id)
+        def reject_queue_full():
+            # Processing inline here could overtake this user's queued messages, so ask them to retry instead.
+            busy_reply = "I'm still working on your previous messages. Please send this one again in a moment."
+            services.send_fonnte_message(sender_phone, busy_reply)
+            if deduplicator is not None:
+                # The user is asked to resend, so the resend must not be dropped as a duplicate.
+                deduplicator.release(dedup_key)
+            return jsonify({"status": "queue_full"}), 200
+
+        # Check the queue before metering usage, so a message that is turned away is not charged.
+        if worker_pool is not None and worker_pool.is_running and not worker_pool.has_capacity(user_id):
+            return reject_queue_full()
+
+        # The usage check and the user client creation are independent; overlap them.
+        client_future = prefetch_executor.submit(chat_app.create_user_supabase_client, user_id)
+        is_allowed, limit_message = database.check_and_update_usage(chat_app.supabase, sender_phone, user_id, chat_app.usage_leases)
         if not is_allowed:
             services.send_fonnte_message(sender_phone, limit_message)
             return jsonify({"status": "limit_exceeded"}), 429
 
-        user_supabase_client = chat_app.create_user_supabase_client(user_id)
+        user_supabase_client = client_future.result()
         if not user_supabase_client:
             # If client creation fails, send an error and stop.
             error_reply = "I'm having trouble authenticating your session right now. Please try again later."
             services.send_fonnte_message(sender_phone, error_reply)
+            if deduplicator is not None:
+                # Let the provider's retry through, since nothing was processed.
+                deduplicator.release(dedup_key)
             return jsonify({"status": "error", "message": "User client creation failed"}), 500
 
-        response_text = asyncio.run(chat_app.process_message_async(message_text, user_id, user_supabase_client))
-        services.send_fonnte_message(sender_phone, response_text)
+        if worker_pool is not None:
+            queued = worker_pool.submit(InboundMessage(
+                sender_phone=sender_phone,
+                message_text=message_text,
+                user_id=user_id,
+                user_supabase_client=user_supabase_client,
+                received_at=received_at,
+            ))
+            if queued:
+                return jsonify({"status": "queued"}), 200
+            if worker_pool.is_running:
+                return reject_queue_full()
+            logger.warning(f"Worker pool is not running; processing the message from {sender_phone} inline.")
+
+        if config.STREAMING_REPLIES_ENABLED:
+            reply_stream = ReplyStream(
+                lambda text: services.send_fonnte_message(sender_phone, text),
+                min_chars=config.STREAMING_MIN_CHUNK_CHARS,
+                max_chars=config.STREAMING_MAX_CHUNK_CHARS,
+            )
+            response_text = asyncio.run(chat_app.process_message_async(message_text, user_id, user_supabase_client,
+                                                                       received_at, reply_stream))
+            reply_stream.finish(response_text)
+        else:
+            response_text = asyncio.run(chat_app.process_message_async(message_text, user_id, user_supabase_client, received_at))
+            services.send_fonnte_message(sender_phone, response_text)
         return jsonify({"status": "success"}), 200
 
     except Exception as e:
@@ -421,7 +807,37 @@ def webhook():
 
 @app.route('/', methods=['GET'])
 def health_check():
-    return jsonify({"status": "ok", "initialized": chat_app._is_initialized}), 200
+    health = {"status": "ok", "initialized": chat_app._is_initialized}
+    if worker_pool is not None:
+        health["worker_pool"] = worker_pool.get_stats()
+    if deduplicator is not None:
+        health["deduplication"] = deduplicator.get_stats()
+    if phone_cache is not None:
+        health["phone_cache"] = phone_cache.get_stats()
+    if chat_app.fast_path_router is not None:
+        health["fast_path_router"] = chat_app.fast_path_router.get_stats()
+    if chat_app.api_key_manager is not None:
+        health["api_keys"] = chat_app.api_key_manager.get_stats()
+        health["gemini_clients"] = chat_app.api_key_manager.client_pool.get_stats()
+        if chat_app.api_key_manager.rate_limiter is not None:
+            health["rate_limiter"] = chat_app.api_key_manager.rate_limiter.get_stats()
+        if chat_app.api_key_manager.hedge_policy is not None:
+            health["hedging"] = chat_app.api_key_manager.hedge_policy.get_stats()
+        if chat_app.api_key_manager.response_cache is not None:
+            health["llm_cache"] = chat_app.api_key_manager.response_cache.get_stats()
+        if chat_app.api_key_manager.context_cache is not None:
+            health["context_cache"] = chat_app.api_key_manager.context_cache.get_stats()
+    if chat_app.supabase_transport is not None:
+        health["supabase_transport"] = chat_app.supabase_transport.get_stats()
+    if chat_app.history_writer is not None:
+        health["history_writer"] = chat_app.history_writer.get_stats()
+    if chat_app.usage_leases is not None:
+        health["usage_leases"] = chat_app.usage_leases.get_stats()
+    if chat_app.user_clients is not None:
+        health["user_clients"] = chat_app.user_clients.get_stats()
+    if chat_app.prompt_budgets is not None:
+        health["prompt_budgets"] = chat_app.prompt_budgets.get_stats()
+    return jsonify(health), 200
 
 if __name__ == "__main__":
     logger.info("Starting Flask development server on http://localhost:5001")